@@ -0,0 +1,729 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+OPTIONS:
+    -h : print this help message
+    -b NAME : run benchmark "NAME" (NAME in {startup, pruning, loading,
+              codec, sparse, updates, segments, cache, sharding,
+              positions, boolean, dense}, default: startup), positions
+              needs the positions_*.txt files of indexer.py -P
+    -r INT : repeat each measurement INT times and keep the best (default: 3)
+    -k INT : retrieve the top INT documents for each query (default: 10)
+    -q : print measurements for each individual query (not just totals)
+------------------------------------------------------------\
+"""
+
+import sys, getopt, time, os, re, threading, random
+from ir_engine import IndexLoader, Queries, MyTimer
+from my_retriever import Retrieve
+from binary_index import compile_index, map_index
+from result_cache import ResultCache, CachedRetrieve
+from positional_index import PositionalIndex
+from boolean_query import parse_boolean
+
+INDEX_FILES = ['index_nostoplist_nostemming.txt',
+               'index_withstoplist_nostemming.txt',
+               'index_nostoplist_withstemming.txt',
+               'index_withstoplist_withstemming.txt']
+
+
+def best_time(repeat, func, *args):
+    """
+    Time a function call
+
+    :param repeat: The number of times to call the function
+    :param func: The function to call
+    :param args: The arguments of the function
+    :return: The shortest duration in seconds
+    """
+
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def sub_index(index, max_doc):
+    """
+    Restrict an index to the documents with id up to max_doc
+
+    :param index: The index dictionary
+    :param max_doc: The largest document id to keep
+    :return: The restricted index dictionary
+    """
+
+    restricted = {}
+
+    for term, docs in index.items():
+        kept = {doc: count for doc, count in docs.items() if doc <= max_doc}
+        if kept:
+            restricted[term] = kept
+
+    return restricted
+
+
+def bench_startup(config):
+    """
+    Report the Retrieve construction time against the size of the index
+
+    :param config: The benchmark options
+    """
+
+    print('%-38s %6s %7s %8s %10s' % ('index', 'docs', 'terms', 'postings', 'init (s)'))
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+        total_doc = max(doc for docs in index.values() for doc in docs)
+
+        for fraction in (0.25, 0.5, 0.75, 1.0):
+            restricted = sub_index(index, int(total_doc * fraction))
+            postings = sum(len(docs) for docs in restricted.values())
+            duration = best_time(config.repeat, Retrieve, restricted, 'tfidf')
+
+            print('%-38s %6d %7d %8d %10.3f' % (index_file, int(total_doc * fraction),
+                                                len(restricted), postings, duration))
+
+
+def bench_pruning(config):
+    """
+    Compare MaxScore pruning against exhaustive term at a time scoring, reporting the
+    postings touched, the documents scored and the latency of each query
+
+    :param config: The benchmark options
+    """
+
+    print('%-38s %-7s %-8s %10s %8s %9s %6s' % ('index', 'scheme', 'mode', 'postings',
+                                               'scored', 'ms/query', 'same'))
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+        queries = Queries(index_file.replace('index_', 'queries_'))
+
+        for scheme in ('tf', 'tfidf', 'bm25', 'pivoted'):
+            exhaustive = Retrieve(index, scheme, 'taat')
+            expected = {qid: exhaustive.forQuery(queries.getQuery(qid), config.k)
+                        for qid in queries.qids()}
+
+            for retrieve in (exhaustive, Retrieve(index, scheme, 'maxscore')):
+                postings = scored = same = 0
+                latency = 0.0
+
+                for qid in queries.qids():
+                    query = queries.getQuery(qid)
+                    duration = best_time(config.repeat, retrieve.forQuery, query, config.k)
+                    stats = retrieve.query_stats
+
+                    postings += stats['postings']
+                    scored += stats['scored']
+                    latency += duration
+                    same += retrieve.forQuery(query, config.k) == expected[qid]
+
+                    if config.query_print:
+                        print('    query %2d %-8s %8d %8d %9.3f' % (
+                            qid, retrieve.evaluation, stats['postings'], stats['scored'],
+                            duration * 1000))
+
+                count = len(queries.qids())
+                print('%-38s %-7s %-8s %10.1f %8.1f %9.3f %3d/%d' % (
+                    index_file, scheme, retrieve.evaluation, postings / count, scored / count,
+                    latency / count * 1000, same, count))
+
+
+def bench_loading(config):
+    """
+    Compare loading the text index against mapping the compiled binary index, reporting
+    the file sizes, the load times and whether the retrieval results are identical
+
+    :param config: The benchmark options
+    """
+
+    print('%-38s %9s %9s %9s %9s %6s' % ('index', 'txt (KB)', 'bin (KB)', 'txt (s)',
+                                         'bin (s)', 'same'))
+
+    for index_file in INDEX_FILES:
+        binary_file = index_file.replace('.txt', '.bin')
+        compile_index(index_file, binary_file)
+
+        text_time = best_time(config.repeat, IndexLoader, index_file)
+        binary_time = best_time(config.repeat, IndexLoader, binary_file)
+
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        text = Retrieve(IndexLoader(index_file).getIndex(), 'tfidf')
+        binary = Retrieve(IndexLoader(binary_file).getIndex(), 'tfidf')
+        same = sum(text.forQuery(queries.getQuery(qid), config.k) ==
+                   binary.forQuery(queries.getQuery(qid), config.k)
+                   for qid in queries.qids())
+
+        print('%-38s %9.1f %9.1f %9.4f %9.4f %3d/%d' % (
+            index_file, os.path.getsize(index_file) / 1024,
+            os.path.getsize(binary_file) / 1024, text_time, binary_time,
+            same, len(queries.qids())))
+
+
+def decode_all(index):
+    """
+    Read every posting of an index
+
+    :param index: The index
+    """
+
+    for docs in index.values():
+        for _ in docs.items():
+            pass
+
+
+def bench_codec(config):
+    """
+    Report the bytes per posting of the text, binary and compressed indexes, and the decode
+    throughput of the binary and compressed postings
+
+    :param config: The benchmark options
+    """
+
+    print('%-38s %8s %8s %8s %8s %11s %11s' % ('index', 'postings', 'txt B/p', 'bin B/p',
+                                               'cmp B/p', 'bin Mp/s', 'cmp Mp/s'))
+
+    for index_file in INDEX_FILES:
+        binary_file = index_file.replace('.txt', '.bin')
+        compressed_file = index_file.replace('.txt', '.cmp.bin')
+        compile_index(index_file, binary_file)
+        compile_index(index_file, compressed_file, compress=True)
+
+        binary = map_index(binary_file)
+        compressed = map_index(compressed_file)
+        postings = len(binary.docs)
+
+        binary_time = best_time(config.repeat, decode_all, binary)
+        compressed_time = best_time(config.repeat, decode_all, compressed)
+
+        print('%-38s %8d %8.2f %8.2f %8.2f %11.2f %11.2f' % (
+            index_file, postings, os.path.getsize(index_file) / postings,
+            os.path.getsize(binary_file) / postings,
+            os.path.getsize(compressed_file) / postings,
+            postings / binary_time / 1e6, postings / compressed_time / 1e6))
+
+
+def retrieve_each(retrieve, queries, k):
+    """
+    Retrieve the results of a list of queries one at a time
+
+    :param retrieve: The retriever
+    :param queries: The queries
+    :param k: The number of documents to return for each query
+    :return: The top k documents of each query
+    """
+
+    return [retrieve.forQuery(query, k) for query in queries]
+
+
+def bench_sparse(config):
+    """
+    Compare the throughput of the sparse matrix backend scoring the whole query set as one
+    batch against Retrieve scoring one query at a time, and check the rankings agree
+
+    :param config: The benchmark options
+    """
+
+    from sparse_retriever import SparseRetrieve
+
+    print('%-38s %-7s %10s %10s %8s %6s' % ('index', 'scheme', 'dict q/s', 'sparse q/s',
+                                            'speedup', 'same'))
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        batch = [queries.getQuery(qid) for qid in queries.qids()]
+
+        for scheme in ('binary', 'tf', 'tfidf'):
+            retrieve = Retrieve(index, scheme)
+            matrix = SparseRetrieve(index, scheme)
+
+            dict_time = best_time(config.repeat, retrieve_each, retrieve, batch, config.k)
+            sparse_time = best_time(config.repeat, matrix.forQueries, batch, config.k)
+            same = sum(expected == ranked for expected, ranked in
+                       zip(retrieve_each(retrieve, batch, config.k),
+                           matrix.forQueries(batch, config.k)))
+
+            print('%-38s %-7s %10.0f %10.0f %8.1f %3d/%d' % (
+                index_file, scheme, len(batch) / dict_time, len(batch) / sparse_time,
+                dict_time / sparse_time, same, len(batch)))
+
+
+def forward_index(index):
+    """
+    Invert an index into the terms of each document
+
+    :param index: The index dictionary
+    :return: The dictionary of the count of each term in each document
+    """
+
+    forward = {}
+
+    for term, docs in index.items():
+        for doc, count in docs.items():
+            forward.setdefault(doc, {})[term] = count
+
+    return forward
+
+
+def bench_updates(config):
+    """
+    Build a retriever on the first 80% of the documents, then add the rest, delete and
+    update some documents in place, and check the rankings equal those of a retriever
+    rebuilt from the final collection
+
+    :param config: The benchmark options
+    """
+
+    print('%-38s %-7s %-9s %9s %9s %11s %6s' % ('index', 'scheme', 'mode', 'add (ms)',
+                                                'del (ms)', 'rebuild (s)', 'same'))
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        forward = forward_index(index)
+        total_doc = max(forward)
+        cut = int(total_doc * 0.8)
+
+        deleted = range(1, cut, 10)
+        updated = range(5, cut, 25)
+
+        for scheme in ('binary', 'tf', 'tfidf', 'bm25', 'pivoted'):
+            for evaluation in ('taat', 'maxscore'):
+                retrieve = Retrieve(sub_index(index, cut), scheme, evaluation)
+
+                start = time.perf_counter()
+                for doc in range(cut + 1, total_doc + 1):
+                    retrieve.add_document(doc, forward.get(doc, {}))
+                add_time = (time.perf_counter() - start) / (total_doc - cut)
+
+                start = time.perf_counter()
+                for doc in deleted:
+                    retrieve.delete_document(doc)
+                delete_time = (time.perf_counter() - start) / len(deleted)
+
+                for doc in updated:
+                    retrieve.update_document(doc, {term: count * 2 for term, count
+                                                   in forward.get(doc, {}).items()})
+
+                # TFIDF, BM25 and pivoted weights are only exact once the IDF and the
+                # average document length are recomputed
+                retrieve.reweigh()
+
+                # The same collection built from scratch
+                final = {doc: terms for doc, terms in forward.items() if doc not in deleted}
+                for doc in updated:
+                    final[doc] = {term: count * 2 for term, count in forward[doc].items()}
+                rebuilt_index = {}
+                for doc, terms in final.items():
+                    for term, count in terms.items():
+                        rebuilt_index.setdefault(term, {})[doc] = count
+
+                start = time.perf_counter()
+                rebuilt = Retrieve(rebuilt_index, scheme, evaluation,
+                                   docs=[doc for doc in range(1, total_doc + 1)
+                                         if doc not in deleted])
+                rebuild_time = time.perf_counter() - start
+
+                same = sum(retrieve.forQuery(queries.getQuery(qid), config.k) ==
+                           rebuilt.forQuery(queries.getQuery(qid), config.k)
+                           for qid in queries.qids())
+
+                print('%-38s %-7s %-9s %9.3f %9.3f %11.3f %3d/%d' % (
+                    index_file, scheme, evaluation, add_time * 1000, delete_time * 1000,
+                    rebuild_time, same, len(queries.qids())))
+
+
+def query_stream(segmented, queries, timer, label, stop):
+    """
+    Run queries in a loop until told to stop, recording the latency of each
+
+    :param segmented: The segmented index
+    :param queries: The queries
+    :param timer: The timer recording the latencies
+    :param label: The label of the latencies
+    :param stop: The event ending the loop
+    """
+
+    while not stop.is_set():
+        for qid in queries.qids():
+            start = time.perf_counter()
+            segmented.forQuery(queries.getQuery(qid))
+            timer.record(label, time.perf_counter() - start)
+
+            if stop.is_set():
+                return
+
+
+def bench_segments(config):
+    """
+    Load the first half of the collection as the main index, then ingest the rest of
+    documents.txt in chunks while queries run concurrently, reporting the query latency
+    before, during and after the ingest, once its segments are merged, and check the
+    rankings after a full compaction equal those of Retrieve over the whole index
+
+    :param config: The benchmark options
+    """
+
+    from indexer import Preprocessor, read_collection
+    from segmented_index import SegmentedIndex
+
+    variant = 'withstoplist_withstemming'
+    index = IndexLoader('index_%s.txt' % variant).getIndex()
+    queries = Queries('queries_%s.txt' % variant)
+    preprocessor = Preprocessor(os.path.join('..', 'Lab Exercises', 'stop_list.txt'))
+    documents = [(doc, preprocessor.term_counts(text)[variant])
+                 for doc, text in read_collection('documents.txt')]
+    half = len(documents) // 2
+    chunk = 32
+
+    print('%-7s %8s %6s %6s %8s %6s %6s %8s %6s %6s %8s %7s %6s' % (
+        'scheme', 'idle p50', 'p95', 'p99', 'load p50', 'p95', 'p99', 'done p50', 'p95',
+        'p99', 'docs/s', 'merges', 'same'))
+
+    for scheme in ('binary', 'tf', 'tfidf'):
+        segmented = SegmentedIndex(sub_index(index, documents[half - 1][0]), scheme)
+        timer = MyTimer()
+
+        for label in ('idle', 'load', 'done'):
+            if label == 'done':
+                segmented.wait_merges()
+
+            stop = threading.Event()
+            reader = threading.Thread(target=query_stream,
+                                      args=(segmented, queries, timer, label, stop))
+            reader.start()
+
+            if label == 'load':
+                start = time.perf_counter()
+                for i in range(half, len(documents), chunk):
+                    segmented.add_documents(dict(documents[i:i + chunk]))
+                ingest_time = time.perf_counter() - start
+            else:
+                time.sleep(1)
+
+            stop.set()
+            reader.join()
+
+        segmented.wait_merges()
+        segmented.compact()
+        retrieve = Retrieve(index, scheme)
+        same = sum(segmented.forQuery(queries.getQuery(qid), config.k) ==
+                   retrieve.forQuery(queries.getQuery(qid), config.k)
+                   for qid in queries.qids())
+
+        print('%-7s %8.3f %6.3f %6.3f %8.3f %6.3f %6.3f %8.3f %6.3f %6.3f %8.0f %7d %3d/%d' % (
+            scheme, *[timer.percentile(label, p) * 1000 for label in ('idle', 'load', 'done')
+                      for p in (50, 95, 99)],
+            (len(documents) - half) / ingest_time, segmented.merges, same,
+            len(queries.qids())))
+
+        segmented.close()
+
+
+def bench_cache(config):
+    """
+    Replay a query log whose query frequencies follow Zipf's law, with and without the
+    result cache, reporting the hit rate and the throughput
+
+    :param config: The benchmark options
+    """
+
+    print('%-38s %8s %10s %10s %8s %9s' % ('index', 'capacity', 'plain q/s', 'cached q/s',
+                                           'hit rate', 'evictions'))
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        qids = queries.qids()
+
+        # The query of rank r is asked with a probability proportional to 1 / r
+        log = random.Random(0).choices(qids, weights=[1 / rank for rank in
+                                                      range(1, len(qids) + 1)], k=2000)
+        log = [queries.getQuery(qid) for qid in log]
+        retrieve = Retrieve(index, 'tfidf')
+
+        plain_time = best_time(config.repeat, retrieve_each, retrieve, log, config.k)
+
+        for capacity in (8, 32):
+            cache = ResultCache(capacity)
+            cached = CachedRetrieve(retrieve, cache)
+
+            start = time.perf_counter()
+            retrieve_each(cached, log, config.k)
+            cached_time = time.perf_counter() - start
+            stats = cache.stats()
+
+            print('%-38s %8d %10.0f %10.0f %8.2f %9d' % (
+                index_file, capacity, len(log) / plain_time, len(log) / cached_time,
+                stats['hits'] / len(log), stats['evictions']))
+
+
+def bench_sharding(config):
+    """
+    Compare the throughput of the sharded retriever, scoring the whole query set on every
+    shard at once, against Retrieve, and check that the rankings and scores are the same
+
+    :param config: The benchmark options
+    """
+
+    from sharded_retriever import ShardedRetrieve
+
+    print('%-38s %-7s %-5s %6s %10s %11s %6s' % ('index', 'scheme', 'by', 'shards',
+                                                 'plain q/s', 'sharded q/s', 'same'))
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        batch = [queries.getQuery(qid) for qid in queries.qids()]
+
+        for scheme in ('binary', 'tf', 'tfidf'):
+            retrieve = Retrieve(index, scheme)
+            plain_time = best_time(config.repeat, retrieve_each, retrieve, batch, config.k)
+            expected = [retrieve.ranked(query, config.k) for query in batch]
+
+            for by in ('range', 'hash'):
+                for shards in (2, 4):
+                    sharded = ShardedRetrieve(index, scheme, shards, by)
+
+                    sharded_time = best_time(config.repeat, sharded.forQueries, batch, config.k)
+                    same = sum(ranked == pairs for ranked, pairs in
+                               zip(sharded.rankedQueries(batch, config.k), expected))
+
+                    print('%-38s %-7s %-5s %6d %10.0f %11.0f %3d/%d' % (
+                        index_file, scheme, by, shards, len(batch) / plain_time,
+                        len(batch) / sharded_time, same, len(batch)))
+
+                    sharded.close()
+
+
+def bench_positions(config):
+    """
+    Measure the positional index apart from the query cost it adds: the size and load time
+    of the positions against those of the index, then the postings walked, the positions
+    decoded and the latency of plain queries, of the same queries reranked by proximity and
+    of the two and three term phrases of the raw queries
+
+    :param config: The benchmark options
+    """
+
+    from indexer import Preprocessor, read_collection
+
+    missing = [index_file.replace('index_', 'positions_') for index_file in INDEX_FILES
+               if not os.path.exists(index_file.replace('index_', 'positions_'))]
+    if missing:
+        print('*** ERROR: %s not found -- build it with indexer.py -P ***' % missing[0],
+              file=sys.stderr)
+        return
+
+    preprocessor = Preprocessor(os.path.join('..', 'Lab Exercises', 'stop_list.txt'))
+    texts = [text for _, text in read_collection('queries.txt')]
+
+    print('%-38s %9s %9s %9s %9s %9s' % ('index', 'txt (KB)', 'pos (KB)', 'mem (KB)',
+                                         'load (s)', '+pos (s)'))
+
+    for index_file in INDEX_FILES:
+        positions_file = index_file.replace('index_', 'positions_')
+        positions = IndexLoader(index_file, positions_file).getPositions()
+
+        print('%-38s %9.1f %9.1f %9.1f %9.4f %9.4f' % (
+            index_file, os.path.getsize(index_file) / 1024,
+            os.path.getsize(positions_file) / 1024, positions.size() / 1024,
+            best_time(config.repeat, IndexLoader, index_file),
+            best_time(config.repeat, PositionalIndex, positions_file)))
+
+    print()
+    print('%-38s %-9s %7s %9s %9s %8s %9s' % ('index', 'mode', 'queries', 'postings',
+                                              'decoded', 'matched', 'ms/query'))
+
+    for index_file in INDEX_FILES:
+        loader = IndexLoader(index_file, index_file.replace('index_', 'positions_'))
+        retrieve = Retrieve(loader.getIndex(), 'tfidf', positions=loader.getPositions())
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        variant = index_file[len('index_'):-len('.txt')]
+
+        # Every run of two and of three consecutive terms of the raw queries
+        phrases = []
+        for text in texts:
+            terms = preprocessor.analyze_positions(text, variant)
+            for length in (2, 3):
+                phrases.extend(terms[i:i + length] for i in range(len(terms) - length + 1))
+
+        modes = (('plain', [queries.getQuery(qid) for qid in queries.qids()], retrieve.ranked),
+                 ('proximity', [queries.getQuery(qid) for qid in queries.qids()],
+                  retrieve.proximity_ranked),
+                 ('phrase', phrases, retrieve.phrase_ranked))
+
+        for mode, batch, rank in modes:
+            postings = decoded = matched = 0
+            latency = 0.0
+
+            for query in batch:
+                latency += best_time(config.repeat, rank, query, config.k)
+                postings += retrieve.query_stats['postings']
+                decoded += retrieve.query_stats.get('positions', 0)
+                matched += retrieve.query_stats['scored']
+
+            print('%-38s %-9s %7d %9.1f %9.1f %8.1f %9.3f' % (
+                index_file, mode, len(batch), postings / len(batch), decoded / len(batch),
+                matched / len(batch), latency / len(batch) * 1000))
+
+
+def match_sets(index, docs, expression):
+    """
+    Find the documents matching a Boolean query with set operations, the baseline of the
+    cursors
+
+    :param index: The index dictionary
+    :param docs: The set of every doc id
+    :param expression: The expression tree, as parse_boolean returns
+    :return: The set of matching doc ids
+    """
+
+    if expression[0] == 'term':
+        return set(index.get(expression[1], ()))
+
+    if expression[0] == 'not':
+        return docs - match_sets(index, docs, expression[1])
+
+    matched = [match_sets(index, docs, child) for child in expression[1]]
+
+    if expression[0] == 'and':
+        return set.intersection(*matched)
+
+    return set.union(*matched)
+
+
+def bench_boolean(config):
+    """
+    Compare matching Boolean queries built from the query terms with the skipping cursors
+    against set operations, reporting the postings in the query terms, the postings the
+    cursors touch and the latency of both, and check that the matches are the same
+
+    :param config: The benchmark options
+    """
+
+    print('%-38s %-8s %9s %9s %8s %9s %9s %6s' % ('index', 'query', 'postings', 'touched',
+                                                  'matched', 'cursor ms', 'set ms', 'same'))
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+        retrieve = Retrieve(index, 'tfidf')
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        docs = set(retrieve.doc_len)
+
+        # The query terms by ascending document frequency
+        terms = [sorted((term for term in queries.getQuery(qid) if term in index),
+                        key=lambda term: len(index[term]))
+                 for qid in queries.qids()]
+        terms = [query_terms for query_terms in terms if len(query_terms) >= 3]
+
+        kinds = (('rare2', lambda t: '%s AND %s' % (t[0], t[1])),
+                 ('common2', lambda t: '%s AND %s' % (t[-1], t[-2])),
+                 ('and-or', lambda t: '%s AND (%s OR %s)' % (t[-1], t[0], t[1])),
+                 ('and-not', lambda t: '%s AND NOT %s' % (t[-1], t[-2])))
+
+        for kind, build in kinds:
+            expressions = [parse_boolean(build(query_terms), str) for query_terms in terms]
+            postings = touched = matched = same = 0
+            cursor_time = set_time = 0.0
+
+            for expression in expressions:
+                cursor_time += best_time(config.repeat, retrieve.boolean_docs, expression)
+                touched += retrieve.query_stats['postings']
+                matched += retrieve.query_stats['scored']
+                postings += sum(len(index[term]) for term in
+                                re.findall(r"'term', '(\w+)'", str(expression)))
+
+                set_time += best_time(config.repeat, match_sets, index, docs, expression)
+                same += retrieve.boolean_docs(expression) == sorted(match_sets(index, docs,
+                                                                               expression))
+
+            count = len(expressions)
+            print('%-38s %-8s %9.1f %9.1f %8.1f %9.3f %9.3f %3d/%d' % (
+                index_file, kind, postings / count, touched / count, matched / count,
+                cursor_time / count * 1000, set_time / count * 1000, same, count))
+
+
+def bench_dense(config):
+    """
+    Measure the LSA retriever: the time to factor the TFIDF matrix and cluster the
+    document vectors, then the documents scanned, the recall of the exact top k cosine and
+    the latency of a query against the number of inverted lists it scans
+
+    :param config: The benchmark options
+    """
+
+    from dense_retriever import DenseRetrieve
+
+    print('%-38s %6s %6s %6s %9s %9s' % ('index', 'docs', 'dims', 'lists', 'build (s)',
+                                         'vec (KB)'))
+
+    retrievers = []
+
+    for index_file in INDEX_FILES:
+        index = IndexLoader(index_file).getIndex()
+
+        start = time.perf_counter()
+        dense = DenseRetrieve(index)
+        build = time.perf_counter() - start
+
+        retrievers.append((index_file, dense))
+        print('%-38s %6d %6d %6d %9.2f %9.1f' % (
+            index_file, len(dense.docs), dense.vectors.shape[1], len(dense.centroids), build,
+            dense.vectors.nbytes / 1024))
+
+    print()
+    print('%-38s %6s %9s %9s %9s' % ('index', 'probe', 'scanned', 'recall', 'ms/query'))
+
+    for index_file, dense in retrievers:
+        queries = Queries(index_file.replace('index_', 'queries_'))
+        batch = [queries.getQuery(qid) for qid in queries.qids()]
+        lists = len(dense.centroids)
+
+        # The exact top k, every list scanned
+        exact = [set(doc for doc, _ in dense.ranked(query, config.k, lists)) for query in batch]
+
+        for probe in [probe for probe in (1, 2, 4, 8, 16, 32) if probe < lists] + [lists]:
+            scanned = found = 0
+            latency = 0.0
+
+            for query, expected in zip(batch, exact):
+                latency += best_time(config.repeat, dense.ranked, query, config.k, probe)
+                scanned += dense.query_stats['scored']
+                found += len(expected & set(doc for doc, _ in
+                                            dense.ranked(query, config.k, probe)))
+
+            print('%-38s %6s %9.1f %9.3f %9.3f' % (
+                index_file, probe if probe < lists else 'exact', scanned / len(batch),
+                found / max(sum(map(len, exact)), 1), latency / len(batch) * 1000))
+
+
+BENCHMARKS = {'startup': bench_startup, 'pruning': bench_pruning, 'loading': bench_loading,
+              'codec': bench_codec, 'sparse': bench_sparse, 'updates': bench_updates,
+              'segments': bench_segments, 'cache': bench_cache, 'sharding': bench_sharding,
+              'positions': bench_positions, 'boolean': bench_boolean, 'dense': bench_dense}
+
+
+class BenchmarkOptions:
+    def __init__(self, opts):
+        self.name = opts.get('-b', 'startup')
+        self.repeat = int(opts.get('-r', 3))
+        self.k = int(opts.get('-k', 10))
+        self.query_print = '-q' in opts
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hb:r:k:q')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0 or opts.get('-b', 'startup') not in BENCHMARKS:
+        print(__doc__.replace('<PROGNAME>', sys.argv[0].split('/')[-1], 1), file=sys.stderr)
+        sys.exit(0)
+
+    config = BenchmarkOptions(opts)
+    BENCHMARKS[config.name](config)
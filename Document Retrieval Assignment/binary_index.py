@@ -0,0 +1,353 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options) INDEX_FILE...
+ACTION: compiles each text index file (index_*.txt) into the
+    binary index format, written next to it as index_*.bin
+OPTIONS:
+    -h : print this help message
+    -c : compress the postings (see postings_codec.py)
+    -o FILE : write the binary index to FILE (only with a single INDEX_FILE)
+------------------------------------------------------------\
+"""
+
+import sys, getopt, re, struct, mmap, bisect, functools
+from array import array
+from collections.abc import Mapping, ItemsView
+from postings_codec import CompressedPostings, encode_postings
+
+# File layout, all integers are unsigned 32 bit little endian:
+#   header:  magic, term count T, posting count P, size of the term block in bytes
+#   offsets: T + 1 positions, the postings of term i are at [offsets[i], offsets[i + 1])
+#   docs:    P doc ids, ascending within the postings of each term
+#   counts:  P term counts, parallel to docs
+#   terms:   the T terms in UTF-8, separated by newlines
+MAGIC = b'IRBI'
+HEADER = struct.Struct('<4sIII')
+
+# Compressed file layout:
+#   header:   magic, term count T, block count B, size of the blocks and the term block
+#   blocks:   T + 1 block numbers, the blocks of term i are [blocks[i], blocks[i + 1])
+#   lengths:  T posting counts
+#   last:     B last doc ids of the blocks, the skip data
+#   position: B positions of the blocks in the encoded bytes
+#   data:     the encoded blocks
+#   terms:    the T terms in UTF-8, separated by newlines
+COMPRESSED_MAGIC = b'IRBC'
+COMPRESSED_HEADER = struct.Struct('<4sIIII')
+
+# Python type code of an unsigned 32 bit integer
+UINT32 = 'I'
+
+# The number of terms whose compressed postings, with their last decoded block, are kept
+# between lookups
+CACHED_POSTINGS = 1024
+
+
+def read_text_index(index_file):
+    """
+    Read a text index file into parallel arrays
+
+    :param index_file: The text index file, one term and its doc:count postings per line
+    :return: The terms, the offsets of their postings, the doc ids and the term counts
+    """
+
+    docid_count_re = re.compile(r'(\d+):(\d+)')
+
+    terms = []
+    offsets = array(UINT32, [0])
+    docs = array(UINT32)
+    counts = array(UINT32)
+
+    with open(index_file, 'r') as f:
+        for line in f:
+            terms.append(line.split(' ', 1)[0])
+
+            for doc, count in sorted((int(doc), int(count))
+                                     for doc, count in docid_count_re.findall(line)):
+                docs.append(doc)
+                counts.append(count)
+
+            offsets.append(len(docs))
+
+    return terms, offsets, docs, counts
+
+
+def write_uint32(out, *arrays):
+    """
+    Write arrays of unsigned 32 bit integers in little endian order
+
+    :param out: The binary file to write to
+    :param arrays: The arrays to write
+    """
+
+    for values in arrays:
+        if sys.byteorder == 'big':
+            values = array(UINT32, values)
+            values.byteswap()
+
+        values.tofile(out)
+
+
+def compile_index(index_file, binary_file, compress=False):
+    """
+    Compile a text index file into the binary index format
+
+    :param index_file: The text index file, one term and its doc:count postings per line
+    :param binary_file: The binary index file to write
+    :param compress: Whether to compress the postings
+    """
+
+    terms, offsets, docs, counts = read_text_index(index_file)
+    term_block = '\n'.join(terms).encode('utf-8')
+
+    if not compress:
+        with open(binary_file, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, len(terms), len(docs), len(term_block)))
+            write_uint32(out, offsets, docs, counts)
+            out.write(term_block)
+        return
+
+    blocks = array(UINT32, [0])
+    lengths = array(UINT32)
+    block_last = array(UINT32)
+    block_position = array(UINT32)
+    data = bytearray()
+
+    for i in range(len(terms)):
+        start, end = offsets[i], offsets[i + 1]
+
+        for last, position in encode_postings(docs[start:end], counts[start:end], data):
+            block_last.append(last)
+            block_position.append(position)
+
+        blocks.append(len(block_last))
+        lengths.append(end - start)
+
+    with open(binary_file, 'wb') as out:
+        out.write(COMPRESSED_HEADER.pack(COMPRESSED_MAGIC, len(terms), len(block_last),
+                                         len(data), len(term_block)))
+        write_uint32(out, blocks, lengths, block_last, block_position)
+        out.write(data)
+        out.write(term_block)
+
+
+def is_binary_index(index_file):
+    """
+    Check whether a file is in the binary index format
+
+    :param index_file: The index file to check
+    :return: True if the file starts with a binary index magic
+    """
+
+    with open(index_file, 'rb') as f:
+        return f.read(len(MAGIC)) in (MAGIC, COMPRESSED_MAGIC)
+
+
+def map_index(binary_file):
+    """
+    Map a binary index file of either format into memory
+
+    :param binary_file: The binary index file
+    :return: The index, a mapping of each term to its postings
+    """
+
+    with open(binary_file, 'rb') as f:
+        compressed = f.read(len(COMPRESSED_MAGIC)) == COMPRESSED_MAGIC
+
+    return CompressedIndex(binary_file) if compressed else BinaryIndex(binary_file)
+
+
+def uint32_view(mapped, start, length):
+    """
+    Get the unsigned 32 bit integers stored at a position of a mapped file
+
+    :param mapped: The mapped file
+    :param start: The byte position of the first integer
+    :param length: The number of integers
+    :return: A view of the integers, a copy on big endian machines
+    """
+
+    view = memoryview(mapped)[start:start + length * 4].cast(UINT32)
+
+    if sys.byteorder == 'big':
+        view = array(UINT32, view)
+        view.byteswap()
+
+    return view
+
+
+class BinaryIndex(Mapping):
+    """
+    The class for a memory mapped binary index, a read only mapping of each term to its
+    postings that can be used wherever the index dictionary is expected
+
+    The postings stay in the mapped file, so loading only reads the term dictionary and
+    every process mapping the same file shares one copy of them through the page cache
+    """
+
+    def __init__(self, binary_file):
+        """
+        Map a binary index file into memory
+
+        :param binary_file: The binary index file
+        """
+
+        with open(binary_file, 'rb') as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, term_count, posting_count, term_bytes = HEADER.unpack_from(self.mapped)
+
+        if magic != MAGIC:
+            raise ValueError('%s is not a binary index file' % binary_file)
+
+        start = HEADER.size
+        self.offsets = uint32_view(self.mapped, start, term_count + 1)
+        start += (term_count + 1) * 4
+        self.docs = uint32_view(self.mapped, start, posting_count)
+        start += posting_count * 4
+        self.counts = uint32_view(self.mapped, start, posting_count)
+        start += posting_count * 4
+
+        terms = self.mapped[start:start + term_bytes].decode('utf-8').split('\n')
+        self.term_id = {term: i for i, term in enumerate(terms[:term_count])}
+
+    def __getitem__(self, term):
+        i = self.term_id[term]
+        start, end = self.offsets[i], self.offsets[i + 1]
+
+        return Postings(self.docs[start:end], self.counts[start:end])
+
+    def __contains__(self, term):
+        return term in self.term_id
+
+    def __iter__(self):
+        return iter(self.term_id)
+
+    def __len__(self):
+        return len(self.term_id)
+
+
+class CompressedIndex(Mapping):
+    """
+    The class for a memory mapped compressed index, a read only mapping of each term to
+    its compressed postings, which are only decoded block by block as they are read
+    """
+
+    def __init__(self, binary_file):
+        """
+        Map a compressed index file into memory
+
+        :param binary_file: The compressed index file
+        """
+
+        with open(binary_file, 'rb') as f:
+            self.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, term_count, block_count, data_bytes, term_bytes = \
+            COMPRESSED_HEADER.unpack_from(self.mapped)
+
+        if magic != COMPRESSED_MAGIC:
+            raise ValueError('%s is not a compressed index file' % binary_file)
+
+        start = COMPRESSED_HEADER.size
+        self.blocks = uint32_view(self.mapped, start, term_count + 1)
+        start += (term_count + 1) * 4
+        self.lengths = uint32_view(self.mapped, start, term_count)
+        start += term_count * 4
+        self.block_last = uint32_view(self.mapped, start, block_count)
+        start += block_count * 4
+        self.block_position = uint32_view(self.mapped, start, block_count)
+        start += block_count * 4
+        self.data = memoryview(self.mapped)[start:start + data_bytes]
+        start += data_bytes
+
+        terms = self.mapped[start:start + term_bytes].decode('utf-8').split('\n')
+        self.term_id = {term: i for i, term in enumerate(terms[:term_count])}
+
+        # The postings of the recently read terms, so that the block a lookup decoded is
+        # still there for the next lookup of the same term
+        self.postings = functools.lru_cache(maxsize=CACHED_POSTINGS)(self._postings)
+
+    def _postings(self, term):
+        """
+        Get the compressed postings of a term
+
+        :param term: The term
+        :return: The postings, over the mapped blocks of the term
+        """
+
+        i = self.term_id[term]
+        start, end = self.blocks[i], self.blocks[i + 1]
+
+        return CompressedPostings(self.data, self.lengths[i], self.block_last[start:end],
+                                  self.block_position[start:end])
+
+    def __getitem__(self, term):
+        return self.postings(term)
+
+    def __contains__(self, term):
+        return term in self.term_id
+
+    def __iter__(self):
+        return iter(self.term_id)
+
+    def __len__(self):
+        return len(self.term_id)
+
+
+class Postings(Mapping):
+    """
+    The class for the postings of a term in a binary index, a read only mapping of each
+    doc id to the term count in that document
+    """
+
+    def __init__(self, docs, counts):
+        """
+        Create new postings over parallel arrays
+
+        :param docs: The doc ids in ascending order
+        :param counts: The term count in each document
+        """
+
+        self.docs = docs
+        self.counts = counts
+
+    def __getitem__(self, doc):
+        i = bisect.bisect_left(self.docs, doc)
+
+        if i < len(self.docs) and self.docs[i] == doc:
+            return self.counts[i]
+
+        raise KeyError(doc)
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def items(self):
+        return PostingsItems(self)
+
+
+class PostingsItems(ItemsView):
+    """
+    The class for the (doc id, count) pairs of postings, read in order from the arrays
+    """
+
+    def __iter__(self):
+        return zip(self._mapping.docs, self._mapping.counts)
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hco:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) == 0 or ('-o' in opts and len(args) > 1):
+        print(__doc__.replace('<PROGNAME>', sys.argv[0].split('/')[-1], 1), file=sys.stderr)
+        sys.exit(0)
+
+    for index_file in args:
+        binary_file = opts.get('-o', re.sub(r'(\.txt)?$', '.bin', index_file, count=1))
+        compile_index(index_file, binary_file, '-c' in opts)
+        print('%s -> %s' % (index_file, binary_file), file=sys.stderr)
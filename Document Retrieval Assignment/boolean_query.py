@@ -0,0 +1,173 @@
+"""
+The Boolean queries of Document Retrieval System
+
+A Boolean query combines words with the AND, OR and NOT operators, written in capitals,
+and parentheses. Words next to each other without an operator are ANDed, NOT binds tighter
+than AND, which binds tighter than OR. Words are turned into index terms by the same
+preprocessing as the documents, and the words that are not indexed (stop words) are dropped
+from the query
+"""
+
+import re
+
+TOKEN_RE = re.compile(r'\(|\)|[A-Za-z]+')
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+
+def parse_boolean(text, analyze=None):
+    """
+    Parse a Boolean query
+
+    :param text: The query text
+    :param analyze: The function turning a word into its index term, or into None when the
+                    word is not indexed, by default the lower cased word
+    :return: The expression tree, ('term', term), ('and', children), ('or', children) or
+             ('not', child), or None when no word of the query is indexed
+    """
+
+    if analyze is None:
+        analyze = str.lower
+
+    # The tokens in reverse order, the next one is the last
+    tokens = TOKEN_RE.findall(text)[::-1]
+
+    if not tokens:
+        raise ValueError('the Boolean query is empty')
+
+    expression = _parse_or(tokens, analyze)
+
+    if tokens:
+        raise ValueError('unexpected %s in the Boolean query' % tokens[-1])
+
+    return expression
+
+
+def _combine(operator, children):
+    """
+    Build an AND or OR node, dropping the children without indexed words and merging the
+    children with the same operator
+
+    :param operator: The operator, and or or
+    :param children: The child expressions
+    :return: The expression, or None when no child has an indexed word
+    """
+
+    merged = []
+
+    for child in children:
+        if child is None:
+            continue
+        if child[0] == operator:
+            merged.extend(child[1])
+        else:
+            merged.append(child)
+
+    if not merged:
+        return None
+
+    if len(merged) == 1:
+        return merged[0]
+
+    return operator, tuple(merged)
+
+
+def _parse_or(tokens, analyze):
+    """
+    Parse the ORed AND expressions at the start of the tokens
+
+    :param tokens: The remaining tokens in reverse order, consumed
+    :param analyze: The function turning a word into its index term
+    :return: The expression tree, or None when it has no indexed word
+    """
+
+    children = [_parse_and(tokens, analyze)]
+
+    while tokens and tokens[-1] == 'OR':
+        tokens.pop()
+        children.append(_parse_and(tokens, analyze))
+
+    return _combine('or', children)
+
+
+def _parse_and(tokens, analyze):
+    """
+    Parse the ANDed NOT expressions at the start of the tokens
+
+    :param tokens: The remaining tokens in reverse order, consumed
+    :param analyze: The function turning a word into its index term
+    :return: The expression tree, or None when it has no indexed word
+    """
+
+    children = [_parse_not(tokens, analyze)]
+
+    while tokens and tokens[-1] not in ('OR', ')'):
+        if tokens[-1] == 'AND':
+            tokens.pop()
+        children.append(_parse_not(tokens, analyze))
+
+    return _combine('and', children)
+
+
+def _parse_not(tokens, analyze):
+    """
+    Parse a word or parenthesised expression at the start of the tokens, negated
+    by any NOT before it
+
+    :param tokens: The remaining tokens in reverse order, consumed
+    :param analyze: The function turning a word into its index term
+    :return: The expression tree, or None when it has no indexed word
+    """
+
+    if tokens and tokens[-1] == 'NOT':
+        tokens.pop()
+        child = _parse_not(tokens, analyze)
+        return None if child is None else ('not', child)
+
+    return _parse_atom(tokens, analyze)
+
+
+def _parse_atom(tokens, analyze):
+    """
+    Parse a word or parenthesised expression at the start of the tokens
+
+    :param tokens: The remaining tokens in reverse order, consumed
+    :param analyze: The function turning a word into its index term
+    :return: The expression tree, or None when it has no indexed word
+    """
+
+    if not tokens:
+        raise ValueError('the Boolean query ends where a word or ( is expected')
+
+    token = tokens.pop()
+
+    if token == '(':
+        expression = _parse_or(tokens, analyze)
+        if not tokens or tokens.pop() != ')':
+            raise ValueError('missing ) in the Boolean query')
+        return expression
+
+    if token in OPERATORS or token == ')':
+        raise ValueError('unexpected %s in the Boolean query' % token)
+
+    term = analyze(token)
+
+    return None if term is None else ('term', term)
+
+
+def positive_terms(expression):
+    """
+    Get the terms of a Boolean query that a matching document may contain, those not
+    under a NOT
+
+    :param expression: The expression tree
+    :return: The list of terms, in the order of the query
+    """
+
+    if expression is None or expression[0] == 'not':
+        return []
+
+    if expression[0] == 'term':
+        return [expression[1]]
+
+    return [term for child in expression[1] for term in positive_terms(child)]
@@ -0,0 +1,314 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: checks that the retrievers agree with the results they
+    must match, prints each failure and exits with status 1 when
+    any check fails
+OPTIONS:
+    -h : print this help message
+    -c NAMES : run the comma separated checks NAMES (NAME in
+               {proximity, updates, segments}, default: all)
+    -k INT : compare the top INT documents of each query (default: 10)
+------------------------------------------------------------\
+"""
+
+import sys, getopt, math, threading
+from ir_engine import IndexLoader, Queries
+from my_retriever import Retrieve, SCHEMES
+from segmented_index import SegmentedIndex
+
+INDEX_FILE = 'index_withstoplist_withstemming.txt'
+
+
+def check_proximity(config):
+    """
+    Check that proximity queries skip the documents added or updated since the positional
+    index was built, ranking them by their similarity score alone
+
+    :param config: The check options
+    :return: The list of failures
+    """
+
+    failures = []
+    loader = IndexLoader(INDEX_FILE, INDEX_FILE.replace('index_', 'positions_'))
+    retrieve = Retrieve(loader.getIndex(), 'tfidf', positions=loader.getPositions())
+
+    # A copy of a document under a new id, and the document itself with other counts
+    source = max(retrieve.terms_in_doc, key=lambda doc: len(retrieve.terms_in_doc[doc]))
+    terms = dict(retrieve.terms_in_doc[source])
+    added = max(retrieve.terms_in_doc) + 1
+
+    retrieve.add_document(added, terms)
+    retrieve.update_document(source, {term: count + 1 for term, count in terms.items()})
+
+    for doc in (added, source):
+        query = retrieve.terms_in_doc[doc]
+
+        try:
+            reranked = dict(retrieve.proximity_ranked(query, config.k))
+        except Exception as error:
+            failures.append('proximity query of document %d: %r' % (doc, error))
+            continue
+
+        plain = dict(retrieve.ranked(query, config.k))
+
+        if doc not in reranked:
+            failures.append('document %d is not in the top %d of its own terms'
+                            % (doc, config.k))
+        elif reranked[doc] != plain.get(doc):
+            failures.append('document %d is boosted without positions: %r != %r'
+                            % (doc, reranked[doc], plain.get(doc)))
+
+    return failures
+
+
+def compare_rankings(label, retrieve, rebuilt, queries, k):
+    """
+    Compare the rankings of two retrievers over a set of queries
+
+    :param label: The label of the comparison in the failures
+    :param retrieve: The retriever under check
+    :param rebuilt: The retriever it must agree with
+    :param queries: The queries
+    :param k: The number of documents to compare
+    :return: The list of failures, the first differing query only
+    """
+
+    for qid in queries.qids():
+        query = queries.getQuery(qid)
+        ranked, expected = retrieve.ranked(query, k), rebuilt.ranked(query, k)
+
+        if ([doc for doc, _ in ranked] != [doc for doc, _ in expected] or
+                not all(math.isclose(score, other, rel_tol=1e-9)
+                        for (_, score), (_, other) in zip(ranked, expected))):
+            return ['%s: query %s ranks %s, the rebuilt retriever %s'
+                    % (label, qid, ranked[:3], expected[:3])]
+
+    return []
+
+
+def check_updates(config):
+    """
+    Check that documents added, deleted and updated in place give the rankings of a
+    retriever built from scratch on the final collection, for every weighting scheme and
+    evaluation strategy, both once the weights are recomputed and while the IDF is left
+    stale below the drift threshold
+
+    :param config: The check options
+    :return: The list of failures
+    """
+
+    failures = []
+    index = IndexLoader(INDEX_FILE).getIndex()
+    queries = Queries(INDEX_FILE.replace('index_', 'queries_'))
+
+    forward = {}
+    for term, postings in index.items():
+        for doc, count in postings.items():
+            forward.setdefault(doc, {})[term] = count
+    total_doc = max(forward)
+
+    # Enough changes to drift past the threshold and be reweighed, and few enough to
+    # leave the IDF stale
+    for mode, cut, step in (('reweigh', int(total_doc * 0.8), 10),
+                            ('lazy', total_doc - 150, 50)):
+        deleted = set(range(1, cut, step))
+        updated = set(range(5, cut, step * 2)) - deleted
+
+        # The final collection, built from scratch
+        final = {doc: terms for doc, terms in forward.items() if doc not in deleted}
+        for doc in updated:
+            final[doc] = {term: count * 2 for term, count in forward[doc].items()}
+        final_index = {}
+        for doc in sorted(final):
+            for term, count in final[doc].items():
+                final_index.setdefault(term, {})[doc] = count
+        docs = [doc for doc in range(1, total_doc + 1) if doc not in deleted]
+
+        for scheme in SCHEMES:
+            for evaluation in ('taat', 'candidate', 'maxscore'):
+                label = '%s %s %s' % (mode, scheme, evaluation)
+                initial = {}
+                for doc in range(1, cut + 1):
+                    for term, count in forward.get(doc, {}).items():
+                        initial.setdefault(term, {})[doc] = count
+                retrieve = Retrieve(initial, scheme, evaluation)
+
+                for doc in range(cut + 1, total_doc + 1):
+                    retrieve.add_document(doc, forward.get(doc, {}))
+                for doc in deleted:
+                    retrieve.delete_document(doc)
+                for doc in updated:
+                    retrieve.update_document(doc, final[doc])
+
+                rebuilt = Retrieve({term: dict(postings) for term, postings
+                                    in final_index.items()}, scheme, evaluation, docs=docs)
+
+                if mode == 'reweigh':
+                    if not retrieve.idf_stale:
+                        failures.append('%s: the changes did not mark the IDF stale' % label)
+                    retrieve.reweigh()
+                else:
+                    if retrieve.idf_stale:
+                        failures.append('%s: the changes marked the IDF stale' % label)
+                        continue
+                    if retrieve.idf == rebuilt.idf:
+                        failures.append('%s: the IDF is not stale' % label)
+
+                    # The rebuilt retriever weighs its documents with the same stale IDF
+                    # and average length
+                    rebuilt.idf = dict(retrieve.idf)
+                    rebuilt.avg_doc_len = retrieve.avg_doc_len
+                    rebuilt._weigh_docs()
+                    if evaluation == 'maxscore':
+                        rebuilt._bound_terms(rebuilt.index)
+
+                # A MaxScore bound may stay above the highest weight of its term after a
+                # delete, never below it
+                if evaluation == 'maxscore':
+                    low = [term for term, bound in rebuilt.term_max_score.items()
+                           if retrieve.term_max_score[term] < bound * (1 - 1e-9)]
+                    if low:
+                        failures.append('%s: the MaxScore bound of %s is too low' % (label, low[0]))
+
+                failures.extend(compare_rankings(label, retrieve, rebuilt, queries, config.k))
+
+    return failures
+
+
+def check_segments(config):
+    """
+    Check that a segmented index gives the rankings of Retrieve built from scratch once
+    documents added, deleted and updated are compacted, that a compaction running while
+    documents are added leaves one version of each document, and that compaction drops
+    every tombstone
+
+    :param config: The check options
+    :return: The list of failures
+    """
+
+    failures = []
+    index = IndexLoader(INDEX_FILE).getIndex()
+    queries = Queries(INDEX_FILE.replace('index_', 'queries_'))
+
+    forward = {}
+    for term, postings in index.items():
+        for doc, count in postings.items():
+            forward.setdefault(doc, {})[term] = count
+    total_doc = max(forward)
+    cut = total_doc // 2
+
+    # Deleted from the main index and from the added segments, some deleted after an update
+    deleted = set(range(1, total_doc + 1, 7))
+    updated = set(range(2, total_doc + 1, 5))
+
+    doubled = {doc: {term: count * 2 for term, count in forward.get(doc, {}).items()}
+               for doc in updated}
+    final = {doc: doubled.get(doc, forward.get(doc, {}))
+             for doc in range(1, total_doc + 1) if doc not in deleted}
+    final_index = {}
+    for doc in sorted(final):
+        for term, count in final[doc].items():
+            final_index.setdefault(term, {})[doc] = count
+
+    for scheme in ('binary', 'tf', 'tfidf'):
+        segmented = SegmentedIndex({term: {doc: count for doc, count in postings.items()
+                                           if doc <= cut}
+                                    for term, postings in index.items()}, scheme)
+
+        def ingest(first, last):
+            for doc in range(first, last, 32):
+                segmented.add_documents({other: forward.get(other, {}) for other
+                                         in range(doc, min(doc + 32, last))})
+
+        try:
+            # A tier one segment short of a merge, the writer fills it while the compaction
+            # merges it, and the two must not both publish its documents
+            filling = cut + 1 + 32 * (segmented.merge_factor - 1)
+            ingest(cut + 1, filling)
+            writer = threading.Thread(target=ingest, args=(filling, total_doc + 1))
+            writer.start()
+            segmented.compact()
+            writer.join()
+            segmented.wait_merges()
+
+            snapshot = segmented.snapshot
+            versions = {}
+            for segment in snapshot.segments:
+                for doc in segment:
+                    if snapshot.is_visible(segment, doc):
+                        versions[doc] = versions.get(doc, 0) + 1
+            repeated = [doc for doc, count in versions.items() if count > 1]
+            if repeated:
+                failures.append('%s: %d documents have several live versions, e.g. %d'
+                                % (scheme, len(repeated), repeated[0]))
+
+            for doc in sorted(updated):
+                segmented.add_document(doc, doubled[doc])
+            for doc in sorted(deleted):
+                segmented.delete_document(doc)
+
+            if segmented.snapshot.total_doc != len(final):
+                failures.append('%s: %d live documents, expected %d'
+                                % (scheme, segmented.snapshot.total_doc, len(final)))
+
+            segmented.wait_merges()
+            segmented.compact()
+
+            if segmented.snapshot.tombstones:
+                failures.append('%s: %d tombstones left after compaction'
+                                % (scheme, len(segmented.snapshot.tombstones)))
+
+            rebuilt = Retrieve(final_index, scheme, docs=sorted(final))
+            for qid in queries.qids():
+                query = queries.getQuery(qid)
+                if segmented.forQuery(query, config.k) != rebuilt.forQuery(query, config.k):
+                    failures.append('%s: query %s ranks %s, the rebuilt retriever %s'
+                                    % (scheme, qid, segmented.forQuery(query, config.k)[:3],
+                                       rebuilt.forQuery(query, config.k)[:3]))
+                    break
+        finally:
+            segmented.close()
+
+    return failures
+
+
+CHECKS = {'proximity': check_proximity, 'updates': check_updates,
+          'segments': check_segments}
+
+
+class CheckOptions:
+    def __init__(self, opts):
+        self.names = opts['-c'].split(',') if '-c' in opts else list(CHECKS)
+        self.k = int(opts.get('-k', 10))
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hc:k:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0:
+        print(__doc__.replace('<PROGNAME>', sys.argv[0].split('/')[-1], 1), file=sys.stderr)
+        sys.exit(0)
+
+    config = CheckOptions(opts)
+
+    unknown = [name for name in config.names if name not in CHECKS]
+    if unknown:
+        print('*** ERROR: unknown check %s, must be one of: %s ***'
+              % (unknown[0], ', '.join(CHECKS)), file=sys.stderr)
+        sys.exit(1)
+
+    failed = 0
+
+    for name in config.names:
+        failures = CHECKS[name](config)
+
+        for failure in failures:
+            print('FAIL %s: %s' % (name, failure))
+        if not failures:
+            print('PASS %s' % name)
+
+        failed += bool(failures)
+
+    sys.exit(1 if failed else 0)
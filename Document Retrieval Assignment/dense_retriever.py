@@ -0,0 +1,237 @@
+"""
+The dense retriever of Document Retrieval System, answering queries from a latent semantic
+analysis (LSA) of the collection through an approximate nearest neighbour index
+
+The TFIDF term-document matrix is factored by a randomized truncated SVD. Each document
+becomes the unit float32 vector of its coordinates in the latent space, and a query is
+folded into the same space through the term factors, so that the cosine of two vectors is
+their dot product. The document vectors are clustered by spherical k-means into inverted
+lists (IVF): a query is compared with the centroids of the lists, then with the documents
+of the few lists closest to it only, about sqrt(|D|) lists of sqrt(|D|) documents each
+instead of the whole collection
+"""
+
+import time
+import numpy as np
+from scipy import sparse
+
+# The dimensions of the latent space, and the number of inverted lists a query scans
+LSA_DIMS = 128
+IVF_PROBE = 8
+
+
+def truncated_svd(matrix, dims, oversample=10, iterations=4, seed=0):
+    """
+    Compute the largest singular values and vectors of a matrix with a randomized range
+    finder, which only needs products with the matrix and its transpose
+
+    :param matrix: The matrix, dense or sparse
+    :param dims: The number of singular values to keep
+    :param oversample: The extra dimensions of the random range, for accuracy
+    :param iterations: The number of power iterations, for accuracy on a slow decay
+    :param seed: The seed of the random range
+    :return: The left singular vectors, one column each, the singular values in descending
+             order and the right singular vectors, one row each
+    """
+
+    rng = np.random.default_rng(seed)
+    size = min(dims + oversample, *matrix.shape)
+
+    # An orthonormal basis of the range of the matrix, sharpened by power iterations
+    basis, _ = np.linalg.qr(matrix @ rng.standard_normal((matrix.shape[1], size)))
+
+    for _ in range(iterations):
+        basis, _ = np.linalg.qr(matrix.T @ basis)
+        basis, _ = np.linalg.qr(matrix @ basis)
+
+    # The SVD of the small projection of the matrix onto the basis
+    left, values, right = np.linalg.svd((matrix.T @ basis).T, full_matrices=False)
+
+    return (basis @ left)[:, :dims], values[:dims], right[:dims]
+
+
+def spherical_kmeans(vectors, clusters, iterations=10, seed=0):
+    """
+    Cluster unit vectors by cosine similarity
+
+    :param vectors: The unit vectors, one row each
+    :param clusters: The number of clusters
+    :param iterations: The number of assignment and update rounds
+    :param seed: The seed of the initial centroids
+    :return: The unit centroids, one row each, and the cluster of each vector
+    """
+
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+
+        # An empty cluster keeps its centroid
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class DenseRetrieve:
+    """
+    The class for the LSA Retriever, ranking documents by the cosine of their latent
+    vectors with the query
+    """
+
+    def __init__(self, index, dims=LSA_DIMS, lists=None, probe=IVF_PROBE, seed=0):
+        """
+        Create new DenseRetrieve object factoring the TFIDF matrix and building the
+        inverted lists
+
+        :param index: The index dictionary
+        :param dims: The dimensions of the latent space
+        :param lists: The number of inverted lists, by default the square root of the
+                      number of documents
+        :param probe: The number of inverted lists a query scans, all of them for an exact
+                      search
+        :param seed: The seed of the SVD and of the clustering
+        """
+
+        self.term_weighting = 'tfidf'
+        self.query_times = {}
+        self.query_stats = {}
+
+        # The row of each term in the matrices
+        self.term_id = {term: i for i, term in enumerate(index)}
+
+        rows, docs, counts = [], [], []
+        for i, postings in enumerate(index.values()):
+            for doc, count in postings.items():
+                rows.append(i)
+                docs.append(doc)
+                counts.append(count)
+
+        # The total number of documents in the collection |D|, doc ids are column numbers
+        total_doc = max(docs, default=0)
+        counts = sparse.csc_matrix((np.array(counts, dtype=np.float64), (rows, docs)),
+                                   shape=(len(self.term_id), total_doc + 1))
+
+        # The inverse document frequency of each term, as in Retrieve
+        doc_freq = np.bincount(rows, minlength=len(self.term_id))
+        self.idf = np.log(total_doc / np.maximum(doc_freq, 1))
+
+        # The unit TFIDF vector of each document with a term, one column each
+        tfidf = sparse.diags(self.idf) @ counts
+        norms = np.sqrt(np.asarray(tfidf.power(2).sum(axis=0)).ravel())
+        self.docs = np.flatnonzero(norms)
+        tfidf = tfidf[:, self.docs] @ sparse.diags(1 / norms[self.docs])
+
+        dims = min(dims, *tfidf.shape)
+        term_vectors, values, doc_vectors = truncated_svd(tfidf, dims, seed=seed)
+
+        # A query is folded in by the term vectors, a document is scaled by the singular
+        # values so that both are in the coordinates of the term vectors
+        self.term_vectors = term_vectors.astype(np.float32)
+        vectors = doc_vectors.T * values
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)[:, None]
+
+        # The documents of each list are stored contiguously, list i spans
+        # self.start[i]:self.start[i + 1] of the vectors and doc ids
+        lists = min(lists or max(int(round(np.sqrt(len(vectors)))), 1), len(vectors))
+        centroids, assignment = spherical_kmeans(vectors, lists, seed=seed)
+        order = np.argsort(assignment, kind='stable')
+
+        self.centroids = centroids.astype(np.float32)
+        self.vectors = vectors[order].astype(np.float32)
+        self.docs = self.docs[order]
+        self.start = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=lists))))
+        self.probe = probe
+
+    def embed(self, query):
+        """
+        Fold a query into the latent space
+
+        :param query: The query, the count of each term
+        :return: The unit vector of the query, or None when it has no indexed term
+        """
+
+        ids = [self.term_id[term] for term in query if term in self.term_id]
+        if not ids:
+            return None
+
+        # TFIDF in query, the count of each term times its IDF
+        weights = np.array([query[term] for term in query if term in self.term_id]) \
+            * self.idf[ids]
+        vector = weights.astype(np.float32) @ self.term_vectors[ids]
+        norm = np.linalg.norm(vector)
+
+        return vector / norm if norm > 0 else None
+
+    def ranked(self, query, k=10, probe=None):
+        """
+        Retrieve the top k documents of a query with their cosine similarity, from the
+        documents of the inverted lists closest to the query
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :param probe: The number of inverted lists to scan, by default the probe of the
+                      retriever, all of them for an exact search
+        :return: The (doc id, score) pairs of the top k documents, by similarity score in
+                 descending order, ties broken by ascending document id
+        """
+
+        self.query_times = {}
+        start = time.perf_counter()
+
+        vector = self.embed(query)
+        if vector is None:
+            self.query_stats = {'scored': 0}
+            return []
+
+        lists = len(self.centroids)
+        probe = min(self.probe if probe is None else probe, lists)
+
+        if probe == lists:
+            vectors, docs = self.vectors, self.docs
+        else:
+            nearest = np.argpartition(-(self.centroids @ vector), probe - 1)[:probe]
+
+            # The rows of the nearest lists, each list a run of consecutive rows
+            first, sizes = self.start[nearest], self.start[nearest + 1] - self.start[nearest]
+            rows = np.repeat(first - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+            vectors, docs = self.vectors[rows], self.docs[rows]
+
+        candidates = time.perf_counter()
+        self.query_times['candidates'] = candidates - start
+
+        scores = vectors @ vector
+
+        scored = time.perf_counter()
+        self.query_times['scoring'] = scored - candidates
+
+        # The k-th highest score, every document reaching it is kept so that ties at the
+        # boundary are broken by doc id
+        if len(scores) > k > 0:
+            threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+            kept = np.flatnonzero(scores >= threshold)
+            scores, docs = scores[kept], docs[kept]
+
+        order = np.lexsort((docs, -scores))[:k]
+        ranked_doc = list(zip(docs[order].tolist(), scores[order].tolist()))
+
+        self.query_stats = {'scored': len(vectors)}
+        self.query_times['top_k'] = time.perf_counter() - scored
+
+        return ranked_doc
+
+    def forQuery(self, query, k=10):
+        """
+        Method performing retrieval for specified query
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The top k most relevant documents to the query
+        """
+
+        return [doc for doc, score in self.ranked(query, k)]
@@ -14,6 +14,9 @@
         -F : print terse flat summary - shows only P, R, F scores (on single line)
         -I : show interpolated precision scores
         -i INT : use INT recall points for interpolated precision (def=10)
+        -k INT : use the top INT ranks for P@k and nDCG@k (def=10)
+        -v : read the files in bulk and compute the scores with array
+             operations, for large runs (needs NumPy)
     DATAFORMAT:
         In both input files, each line specifies two integers, in the manner:
          QID  DOCID
@@ -26,12 +29,16 @@
 --------------------------------------------------------------------------------
 """
 
-import sys, re
+import sys, re, math
 import getopt
 
+# The position of each rank-aware measure in Score.rank_measures: average precision,
+# R-precision, reciprocal rank, P@k and nDCG@k
+AP, R_PRECISION, RR, P_AT_K, NDCG = range(5)
+
 class CommandLine:
     def __init__(self):
-        opts, args = getopt.getopt(sys.argv[1:],'hn:qfFi:I')
+        opts, args = getopt.getopt(sys.argv[1:],'hn:qfFi:Ivk:')
         opts = dict(opts)
 
         if '-h' in opts:
@@ -66,6 +73,22 @@ class CommandLine:
         else:
             self.interp_points = 10
 
+        if '-k' in opts:
+            if opts['-k'].isdigit() and int(opts['-k']) > 0:
+                self.cutoff = int(opts['-k'])
+            else:
+                warning = (
+                    "*** ERROR: rank cutoff (opt: -k INT)! ***\n"
+                    "    -- value (%s) not recognised!\n"
+                    "    -- must be a positive integer"
+                    )  % (opts['-k'])
+                print(warning, file=sys.stderr)
+                self.printHelp()
+        else:
+            self.cutoff = 10
+
+        self.vectorized = '-v' in opts
+
     def printHelp(self):
         progname = sys.argv[0]
         progname = progname.split('/')[-1] # strip off extended path
@@ -107,20 +130,13 @@ class Key:
         return set(self.relevant.keys())
      
 class Response:
-    def __init__(self,config,key):
+    def __init__(self,config,key,results=None):
         seen = {}
         self.retrieved = {}
         self.rel_ranks = {}
-        skip = re.compile('^\s*($|#)')
-        response = open(config.responsefile,'r')
-        for line in response:
-            if skip.search(line): continue
-            vals = line.split()
-            if len(vals) != 2:
-                msg = 'ERROR: bad line in key file:<%s>' % line
-                raise Exception(msg)
-            qid = int(vals[0])
-            docid = int(vals[1])
+        if results is None:
+            results = self.readResponseFile(config.responsefile)
+        for (qid,docid) in results:
             if qid not in seen:
                 seen[qid] = set()
                 self.retrieved[qid] = 0
@@ -133,6 +149,17 @@ class Response:
                 self.rel_ranks[qid].append(self.retrieved[qid])
             # duplicate entries are counted, but only *credited* at first occurrence. 
             seen[qid].add(docid)            
+
+    def readResponseFile(self,responsefile):
+        skip = re.compile('^\s*($|#)')
+        response = open(responsefile,'r')
+        for line in response:
+            if skip.search(line): continue
+            vals = line.split()
+            if len(vals) != 2:
+                msg = 'ERROR: bad line in key file:<%s>' % line
+                raise Exception(msg)
+            yield (int(vals[0]), int(vals[1]))
         response.close()
 
     def getRanks(self,qid):
@@ -162,6 +189,7 @@ class Score:
         self.total_retrieved = 0
         self.total_relevant_retrieved = 0
         self.global_interpolation_points = [0.0] * (self.interp_points + 1)
+        self.initRankMeasures(config)
         
         for qid in self.all_queries:
             
@@ -186,13 +214,55 @@ class Score:
             for i in range(self.interp_points + 1):
                 self.global_interpolation_points[i] += query_interpolation_points[i]
 
+            # The rank-aware measures, from the same relevant ranks
+            measures = self.rankMeasures(ranks, rel)
+            for i in range(len(measures)):
+                self.rank_measures[i] += measures[i]
+
             if config.query_print:
                 self.print_measure1_query(qid,ret,rel,rel_ret)
+                self.print_measure3_query(measures)
                 if config.show_interp_prec:
                     self.print_measure2_query(query_interpolation_points)
                 
         for i in range(self.interp_points + 1):
             self.global_interpolation_points[i] /= self.num_queries
+        for i in range(len(self.rank_measures)):
+            self.rank_measures[i] /= self.num_queries
+
+    def initRankMeasures(self,config):
+        # The rank cutoff of P@k and nDCG@k, the DCG discount of each rank up to
+        # it and the ideal DCG of 0 to k relevant documents
+        self.cutoff = config.cutoff
+        self.discounts = [1.0 / math.log2(rank + 1) for rank in range(1, self.cutoff + 1)]
+        self.ideal_dcg = [0.0]
+        for discount in self.discounts:
+            self.ideal_dcg.append(self.ideal_dcg[-1] + discount)
+        # The totals, then means, of AP, R-precision, RR, P@k and nDCG@k
+        self.rank_measures = [0.0] * 5
+
+    def rankMeasures(self,ranks,rel):
+        # Average precision, R-precision, reciprocal rank, P@k and nDCG@k of a
+        # query, given the ranks of its relevant retrieved documents (binary gain)
+        precisions = 0.0
+        dcg = 0.0
+        in_rel = 0
+        in_cutoff = 0
+        for i in range(len(ranks)):
+            precisions += (i + 1.0) / ranks[i]
+            if ranks[i] <= rel:
+                in_rel += 1
+            if ranks[i] <= self.cutoff:
+                in_cutoff += 1
+                dcg += self.discounts[ranks[i] - 1]
+        if rel > 0:
+            ap = precisions / rel
+            rprec = float(in_rel) / rel
+            ndcg = dcg / self.ideal_dcg[min(rel, self.cutoff)]
+        else:
+            ap = rprec = ndcg = 0.0
+        rr = 1.0 / ranks[0] if ranks else 0.0
+        return (ap, rprec, rr, float(in_cutoff) / self.cutoff, ndcg)
 
     def print_measure1_query(self,qid,ret,rel,rel_ret):
         print(("Query ID: %d\n"
@@ -201,8 +271,18 @@ class Score:
                "    Relevant:        %4d\n"
                "    Rel_Retr:        %4d\n"
         ) % (qid,ret,rel,rel_ret), file=sys.stdout, end='')
+
+    def print_measure3_query(self,measures):
+        print(("Rank-aware measures:\n"
+               "    AP:              %.3f\n"
+               "    R-Precision:     %.3f\n"
+               "    RR:              %.3f\n"
+               "    %-17s%.3f\n"
+               "    %-17s%.3f\n"
+        ) % (measures[0], measures[1], measures[2], 'P@%d:' % self.cutoff, measures[3],
+             'nDCG@%d:' % self.cutoff, measures[4]), file=sys.stdout, end='')
     
-    def print_measure1_summary(self,config):
+    def precisionRecallF(self):
         if self.total_retrieved > 0:
             precision = float(self.total_relevant_retrieved)/self.total_retrieved
         else: 
@@ -215,10 +295,14 @@ class Score:
             fmeasure = (2 * precision * recall)/(precision + recall)
         else:
             fmeasure = 0.0
+        return (precision, recall, fmeasure)
+
+    def print_measure1_summary(self,config):
+        precision, recall, fmeasure = self.precisionRecallF()
         if config.print_terse_flat:
             format = "N:{3} P:{4:.2f} R:{5:.2f} F:{6:.2f}"
         elif config.print_flat:
-            format = "{0} {1} {2} {3} {4:.2f} {5:.2f} {6:.2f}"
+            format = "{0} {1} {2} {3} {4:.2f} {5:.2f} {6:.2f} {7:.3f} {8:.3f} {9:.3f} {10:.3f} {11:.3f}"
         else:
             format = (
             "-------------------------------------------\n"
@@ -231,13 +315,20 @@ class Score:
             "    Precision:       {4:.2f}\n"
             "    Recall:          {5:.2f}\n"
             "    F-measure:       {6:.2f}\n"
+            "Rank-aware measures across all queries:\n"
+            "    MAP:             {7:.3f}\n"
+            "    R-Precision:     {8:.3f}\n"
+            "    MRR:             {9:.3f}\n"
+            "    {12:<17}{10:.3f}\n"
+            "    {13:<17}{11:.3f}\n"
             )
         scores = (
             self.num_queries,
             self.total_retrieved,
             self.total_relevant,
             self.total_relevant_retrieved,
-            precision, recall, fmeasure)
+            precision, recall, fmeasure) + tuple(self.rank_measures) + (
+            'P@%d:' % self.cutoff, 'nDCG@%d:' % self.cutoff)
         print(format.format(*scores), file=sys.stdout, end='')
         if not config.show_interp_prec:
             print(file=sys.stdout)
@@ -265,11 +356,195 @@ class Score:
                     self.global_interpolation_points[i]), file=sys.stdout)
         print(file=sys.stdout)
 
+#==============================================================================
+# Vectorized evaluation, for run files with many queries and documents
+
+# The bytes of a chunk holding only "QID DOCID" lines and blank lines, that can
+# be parsed in bulk; any other chunk is parsed line by line
+PAIR_BYTES = b'0123456789 \t\r\n'
+
+def isPairChunk(data):
+    """
+    Check that a chunk holds only lines of two numbers and blank lines
+
+    :param data: The chunk, as an array of bytes ending with a newline
+    :return: True if every line holds two numbers or nothing
+    """
+
+    import numpy as np
+
+    allowed = np.zeros(256, dtype=bool)
+    allowed[np.frombuffer(PAIR_BYTES, dtype=np.uint8)] = True
+    if not allowed[data].all():
+        return False
+
+    # The number of numbers starting on each line
+    digit = (data >= ord('0')) & (data <= ord('9'))
+    starts = digit.copy()
+    starts[1:] &= ~digit[:-1]
+    line = np.cumsum(data == ord('\n'))
+    numbers = np.bincount(line[starts], minlength=int(line[-1]) + 1)
+    return bool(np.all((numbers == 0) | (numbers == 2)))
+
+def readPairs(filename, kind, chunkSize=1 << 24):
+    """
+    Read the (QID, DOCID) lines of a file in chunks of about chunkSize bytes
+
+    :param filename: The key or response file
+    :param kind: The kind of file, for the error message of a bad line
+    :param chunkSize: The number of bytes parsed at a time
+    :return: The arrays of the query ids and of the doc ids, in file order
+    """
+
+    import io
+    import numpy as np
+
+    skip = re.compile('^\\s*($|#)')
+    chunks = []
+    rest = b''
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(chunkSize)
+            # Whole lines only, the end of the last one is in the next block
+            data = rest + block
+            end = data.rfind(b'\n') + 1 if block else len(data)
+            data, rest = data[:end], data[end:]
+            if not data:
+                if not block:
+                    break
+                continue
+            if not data.endswith(b'\n'):
+                data += b'\n'
+            if isPairChunk(np.frombuffer(data, dtype=np.uint8)):
+                chunks.append(np.fromstring(data.decode('ascii'), dtype=np.int64, sep=' '))
+                continue
+            values = []
+            for line in io.StringIO(data.decode(), newline=None):
+                if skip.search(line): continue
+                vals = line.split()
+                if len(vals) != 2:
+                    msg = 'ERROR: bad line in %s file:<%s>' % (kind, line)
+                    raise Exception(msg)
+                values.extend((int(vals[0]), int(vals[1])))
+            chunks.append(np.array(values, dtype=np.int64))
+
+    pairs = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+    pairs = pairs.reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+class VectorScore(Score):
+    """
+    Score computing the same measures as Score with array operations, the
+    files are read by readPairs instead of Key and Response
+    """
+
+    def __init__(self, config, keyfile=None, responsefile=None):
+        import numpy as np
+
+        key_qids, key_docids = readPairs(keyfile or config.keyfile, 'key')
+        resp_qids, resp_docids = readPairs(responsefile or config.responsefile, 'response')
+
+        # Each (qid, docid) pair as a single integer, relevant pairs are a set
+        base = int(max(key_docids.max(initial=0), resp_docids.max(initial=0))) + 1
+        key_codes = np.unique(key_qids * base + key_docids)
+        key_qids = key_codes // base
+
+        self.all_queries = np.union1d(key_qids, resp_qids)
+        self.num_queries = len(self.all_queries)
+        self.interp_points = config.interp_points
+        points = self.interp_points
+
+        # The responses of each query in file order, with their rank; run files
+        # usually list the queries one after the other already
+        if np.all(resp_qids[1:] >= resp_qids[:-1]):
+            qids, docids = resp_qids, resp_docids
+        else:
+            order = np.argsort(resp_qids, kind='stable')
+            qids, docids = resp_qids[order], resp_docids[order]
+        codes = qids * base + docids
+        query = np.searchsorted(self.all_queries, qids)
+        first = np.searchsorted(qids, qids, side='left')
+        ranks = np.arange(1, len(qids) + 1) - first
+
+        # Responses past the limit are ignored
+        if config.response_limit:
+            kept = ranks <= config.response_limit
+            query, codes, ranks = query[kept], codes[kept], ranks[kept]
+
+        # Duplicate entries are counted, but only credited at first occurrence
+        _, first_seen = np.unique(codes, return_index=True)
+        credited = np.zeros(len(codes), dtype=bool)
+        credited[first_seen] = True
+        credited &= np.isin(codes, key_codes)
+
+        rel = np.bincount(np.searchsorted(self.all_queries, key_qids),
+                          minlength=self.num_queries)
+        ret = np.bincount(query, minlength=self.num_queries)
+        rel_ret = np.bincount(query[credited], minlength=self.num_queries)
+
+        self.total_relevant = int(rel.sum())
+        self.total_retrieved = int(ret.sum())
+        self.total_relevant_retrieved = int(rel_ret.sum())
+
+        # The precision at each relevant document, at the recall point it reaches
+        hit_query, hit_ranks = query[credited], ranks[credited]
+        hit_first = np.searchsorted(hit_query, hit_query, side='left')
+        hits = np.arange(1, len(hit_query) + 1) - hit_first + 0.0
+        prec = hits / hit_ranks
+        ipt = ((hits * points) / rel[hit_query]).astype(np.int64)
+
+        interpolation = np.zeros((self.num_queries, points + 1))
+        np.maximum.at(interpolation, (hit_query, ipt), prec)
+        interpolation = np.maximum.accumulate(interpolation[:, ::-1], axis=1)[:, ::-1]
+
+        # Summed one query at a time, in the order Score adds them up
+        total = np.zeros(points + 1)
+        for row in interpolation:
+            total += row
+        self.global_interpolation_points = list(total / self.num_queries)
+
+        # The rank-aware measures, from the same relevant ranks and in the same
+        # order of float operations as rankMeasures
+        self.initRankMeasures(config)
+        queries = self.num_queries
+        has_rel = rel > 0
+        in_rel = hit_ranks <= rel[hit_query]
+        in_cutoff = hit_ranks <= self.cutoff
+
+        precisions = np.bincount(hit_query, weights=hits / hit_ranks, minlength=queries)
+        dcg = np.bincount(hit_query[in_cutoff], minlength=queries,
+                          weights=np.array(self.discounts)[hit_ranks[in_cutoff] - 1])
+        ideal_dcg = np.array(self.ideal_dcg)[np.minimum(rel, self.cutoff)]
+
+        ap = np.divide(precisions, rel, out=np.zeros(queries), where=has_rel)
+        rprec = np.divide(np.bincount(hit_query[in_rel], minlength=queries) + 0.0, rel,
+                          out=np.zeros(queries), where=has_rel)
+        rr = np.zeros(queries)
+        first_hit = hits == 1
+        rr[hit_query[first_hit]] = 1.0 / hit_ranks[first_hit]
+        p_at_k = np.bincount(hit_query[in_cutoff], minlength=queries) / float(self.cutoff)
+        ndcg = np.divide(dcg, ideal_dcg, out=np.zeros(queries), where=has_rel)
+
+        measures = np.column_stack((ap, rprec, rr, p_at_k, ndcg))
+        # Summed one query at a time as in Score
+        totals = np.cumsum(measures, axis=0)[-1] if queries else np.zeros(5)
+        self.rank_measures = list(totals / self.num_queries)
+
+        if config.query_print:
+            for (i, qid) in enumerate(self.all_queries):
+                self.print_measure1_query(int(qid), int(ret[i]), int(rel[i]), int(rel_ret[i]))
+                self.print_measure3_query(tuple(measures[i]))
+                if config.show_interp_prec:
+                    self.print_measure2_query(list(interpolation[i]))
+
 if __name__ == '__main__':
     config = CommandLine()
-    key = Key(config)
-    response = Response(config,key)
-    scorer = Score(config,key,response)
+    if config.vectorized:
+        scorer = VectorScore(config)
+    else:
+        key = Key(config)
+        response = Response(config,key)
+        scorer = Score(config,key,response)
     scorer.print_measure1_summary(config)
     scorer.print_measure2_summary(config)
 
@@ -0,0 +1,393 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: builds the four index_*.txt and queries_*.txt files
+    ({with,no}stoplist x {with,no}stemming) from the raw
+    document and query collections in a single pass, and
+    optionally the positions_*.txt positional postings
+OPTIONS:
+    -h : print this help message
+    -D FILE : read the documents from FILE (default: documents.txt)
+    -Q FILE : read the queries from FILE (default: queries.txt)
+    -s FILE : use stoplist file FILE (default: ../Lab Exercises/stop_list.txt)
+    -o DIR : write the output files to directory DIR (default: .)
+    -m INT : keep at most INT postings in memory before spilling a
+             sorted run to disk (default: 1000000)
+    -P : also write the positions of every posting to positions_*.txt
+         (see positional_index.py)
+------------------------------------------------------------\
+"""
+
+import sys, getopt, re, os, heapq, itertools, tempfile, functools
+from collections import Counter
+from nltk.stem.porter import PorterStemmer
+from positional_index import delta_encode
+
+# The preprocessing variants, (name, use the stoplist, use stemming)
+VARIANTS = [('nostoplist_nostemming', False, False),
+            ('withstoplist_nostemming', True, False),
+            ('nostoplist_withstemming', False, True),
+            ('withstoplist_withstemming', True, True)]
+
+# The preprocessing steps of each variant name, (use the stoplist, use stemming)
+VARIANT_STEPS = {name: (stoplist, stemming) for name, stoplist, stemming in VARIANTS}
+
+
+def read_collection(collection_file):
+    """
+    Stream the documents of a collection file in the <document docid=N> markup
+
+    :param collection_file: The collection file
+    :return: A generator of (doc id, text) in the order of the file
+    """
+
+    docid_re = re.compile(r'<document docid=(\d+)>')
+    doc = None
+
+    with open(collection_file, 'r') as f:
+        for line in f:
+            match = docid_re.match(line)
+
+            if match:
+                doc = int(match.group(1))
+                lines = []
+            elif line.startswith('</document>'):
+                yield doc, ''.join(lines)
+                doc = None
+            elif doc is not None:
+                lines.append(line)
+
+
+class Preprocessor:
+    """
+    The class for turning a text into the term counts of the preprocessing variants
+    """
+
+    def __init__(self, stop_list_file, stem_cache_size=None):
+        """
+        Create new preprocessor
+
+        :param stop_list_file: The stoplist file, one word per line
+        :param stem_cache_size: The largest number of stems kept, the least recently used
+                                are dropped first, by default every stem is kept
+        """
+
+        with open(stop_list_file, 'r') as f:
+            self.stops = set(line.strip() for line in f)
+
+        # The stemmer the shipped index files were built with
+        self.stemmer = PorterStemmer(PorterStemmer.MARTIN_EXTENSIONS)
+
+        # The stems of the words seen so far, stemming is the costly step
+        self.stem = functools.lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def term_counts(self, text):
+        """
+        Tokenize a text and count its terms under every variant
+
+        :param text: The text
+        :return: The dictionary of the term counts of each variant name
+        """
+
+        words = Counter(re.findall(r'[a-z]+', text.lower()))
+        kept = Counter({word: count for word, count in words.items() if word not in self.stops})
+
+        counts = {}
+
+        for name, stoplist, stemming in VARIANTS:
+            source = kept if stoplist else words
+
+            if stemming:
+                stemmed = Counter()
+                for word, count in source.items():
+                    stemmed[self.stem(word)] += count
+                source = stemmed
+
+            counts[name] = source
+
+        return counts
+
+    def term_positions(self, text):
+        """
+        Tokenize a text and find the positions of its terms under every variant
+
+        :param text: The text
+        :return: The dictionary of the positions of each term of each variant name, the
+                 token offsets in the text counted before stop words are removed
+        """
+
+        words = re.findall(r'[a-z]+', text.lower())
+        positions = {}
+
+        for name, stoplist, stemming in VARIANTS:
+            terms = {}
+
+            for position, word in enumerate(words):
+                if stoplist and word in self.stops:
+                    continue
+
+                term = self.stem(word) if stemming else word
+                if term in terms:
+                    terms[term].append(position)
+                else:
+                    terms[term] = [position]
+
+            positions[name] = terms
+
+        return positions
+
+    def analyze_positions(self, text, variant):
+        """
+        Tokenize a text into the terms of one variant with their token offsets, as
+        term_positions does
+
+        :param text: The text
+        :param variant: The variant name
+        :return: The list of (term, position) in the order of the text
+        """
+
+        stoplist, stemming = VARIANT_STEPS[variant]
+        terms = []
+
+        for position, word in enumerate(re.findall(r'[a-z]+', text.lower())):
+            if stoplist and word in self.stops:
+                continue
+
+            terms.append((self.stem(word) if stemming else word, position))
+
+        return terms
+
+    def term(self, word, variant):
+        """
+        Turn a word into its index term under one variant
+
+        :param word: The word
+        :param variant: The variant name
+        :return: The term, or None if the variant drops the word
+        """
+
+        stoplist, stemming = VARIANT_STEPS[variant]
+        word = word.lower()
+
+        if stoplist and word in self.stops:
+            return None
+
+        return self.stem(word) if stemming else word
+
+    def analyze(self, text, variant):
+        """
+        Tokenize a text and count its terms under one variant, as term_counts does
+
+        :param text: The text
+        :param variant: The variant name
+        :return: The dictionary of the count of each term
+        """
+
+        stoplist, stemming = VARIANT_STEPS[variant]
+        counts = {}
+
+        for word, count in Counter(re.findall(r'[a-z]+', text.lower())).items():
+            if stoplist and word in self.stops:
+                continue
+
+            term = self.stem(word) if stemming else word
+            counts[term] = counts.get(term, 0) + count
+
+        return counts
+
+
+class RunIndexer:
+    """
+    The class for inverting a stream of documents with bounded memory, spilling the postings
+    to sorted run files and merging the runs into the final index file
+    """
+
+    def __init__(self, run_prefix, run_size):
+        """
+        Create new indexer
+
+        :param run_prefix: The path prefix of the run files
+        :param run_size: The number of postings to keep in memory before spilling a run
+        """
+
+        self.run_prefix = run_prefix
+        self.run_size = run_size
+        self.runs = []
+        self.postings = {}
+        self.size = 0
+
+    def add(self, doc, counts):
+        """
+        Add the postings of a document
+
+        :param doc: The doc id
+        :param counts: The value of each term in the document, its count or its positions
+        """
+
+        for term, count in counts.items():
+            if term in self.postings:
+                self.postings[term].append((doc, count))
+            else:
+                self.postings[term] = [(doc, count)]
+
+        self.size += len(counts)
+
+        if self.size >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        """
+        Write the postings in memory to a new run file, sorted by term
+        """
+
+        run_file = '%s.%d' % (self.run_prefix, len(self.runs))
+
+        with open(run_file, 'w') as out:
+            for line in format_postings(sorted(self.postings.items())):
+                out.write(line)
+
+        self.runs.append(run_file)
+        self.postings = {}
+        self.size = 0
+
+    def write(self, index_file):
+        """
+        Write the index file, merging the runs if any were spilled
+
+        :param index_file: The index file to write
+        """
+
+        if self.runs:
+            self.spill()
+            terms = merge_runs(self.runs)
+        else:
+            terms = sorted(self.postings.items())
+
+        with open(index_file, 'w') as out:
+            for line in format_postings(terms):
+                out.write(line)
+
+
+def format_postings(terms):
+    """
+    Format index lines, a term followed by its doc:value postings in ascending doc id
+
+    :param terms: The (term, postings) pairs in the order of the lines, the values are
+                  counts or delta coded positions
+    :return: A generator of the lines
+    """
+
+    for term, postings in terms:
+        yield '%s %s\n' % (term, ' '.join('%d:%s' % posting for posting in sorted(postings)))
+
+
+def read_run(run_file):
+    """
+    Stream the (term, postings) pairs of a run file
+
+    :param run_file: The run file
+    :return: A generator of the pairs in the order of the file, the posting values are
+             kept as written
+    """
+
+    docid_value_re = re.compile(r'(\d+):([\d,]+)')
+
+    with open(run_file, 'r') as f:
+        for line in f:
+            term, postings = line.split(' ', 1)
+            yield term, [(int(doc), value) for doc, value in docid_value_re.findall(postings)]
+
+
+def merge_runs(run_files):
+    """
+    Merge sorted run files, holding only the postings of one term at a time
+
+    :param run_files: The run files
+    :return: A generator of the (term, postings) pairs by term
+    """
+
+    merged = heapq.merge(*[read_run(run_file) for run_file in run_files], key=lambda x: x[0])
+
+    for term, group in itertools.groupby(merged, key=lambda x: x[0]):
+        yield term, list(heapq.merge(*[postings for _, postings in group]))
+
+
+def write_queries(queries_file, queries):
+    """
+    Write a queries file, a query id followed by its term:count pairs in term order
+
+    :param queries_file: The queries file to write
+    :param queries: The (query id, term counts) pairs in the order of the lines
+    """
+
+    with open(queries_file, 'w') as out:
+        for qid, counts in queries:
+            terms = ' '.join('%s:%d' % (term, counts[term]) for term in sorted(counts))
+            out.write('%d %s\n' % (qid, terms))
+
+
+def build(documents_file, queries_file, stop_list_file, output_dir, run_size, positions=False):
+    """
+    Build the index and queries files of every variant
+
+    :param documents_file: The document collection file
+    :param queries_file: The query collection file
+    :param stop_list_file: The stoplist file
+    :param output_dir: The directory to write the files to
+    :param run_size: The number of postings to keep in memory before spilling runs
+    :param positions: Whether to write the positions files as well
+    """
+
+    preprocessor = Preprocessor(stop_list_file)
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        # The postings in memory are shared by the count and positions indexers
+        layers = 2 if positions else 1
+        indexers = {name: RunIndexer(os.path.join(run_dir, name),
+                                     run_size // (len(VARIANTS) * layers))
+                    for name, _, _ in VARIANTS}
+        positioners = {name: RunIndexer(os.path.join(run_dir, name + '.positions'),
+                                        run_size // (len(VARIANTS) * layers))
+                       for name, _, _ in VARIANTS} if positions else {}
+
+        for doc, text in read_collection(documents_file):
+            if positions:
+                for name, term_positions in preprocessor.term_positions(text).items():
+                    indexers[name].add(doc, {term: len(found)
+                                             for term, found in term_positions.items()})
+                    positioners[name].add(doc, {term: delta_encode(found)
+                                                for term, found in term_positions.items()})
+            else:
+                for name, counts in preprocessor.term_counts(text).items():
+                    indexers[name].add(doc, counts)
+
+        for name, indexer in indexers.items():
+            indexer.write(os.path.join(output_dir, 'index_%s.txt' % name))
+
+        for name, positioner in positioners.items():
+            positioner.write(os.path.join(output_dir, 'positions_%s.txt' % name))
+
+    queries = {name: [] for name, _, _ in VARIANTS}
+
+    for qid, text in read_collection(queries_file):
+        for name, counts in preprocessor.term_counts(text).items():
+            queries[name].append((qid, counts))
+
+    for name, variant_queries in queries.items():
+        write_queries(os.path.join(output_dir, 'queries_%s.txt' % name), variant_queries)
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hD:Q:s:o:m:P')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0:
+        print(__doc__.replace('<PROGNAME>', sys.argv[0].split('/')[-1], 1), file=sys.stderr)
+        sys.exit(0)
+
+    build(opts.get('-D', 'documents.txt'),
+          opts.get('-Q', 'queries.txt'),
+          opts.get('-s', os.path.join('..', 'Lab Exercises', 'stop_list.txt')),
+          opts.get('-o', '.'),
+          int(opts.get('-m', 1000000)),
+          '-P' in opts)
@@ -5,7 +5,28 @@ OPTIONS:
     -h : print this help message
     -s : use "with stoplist" configuration (default: without)
     -p : use "with stemming" configuration (default: without)
-    -w LABEL : use weighting scheme "LABEL" (LABEL in {binary, tf, tfidf}, default: binary)
+    -w LABEL : use weighting scheme "LABEL" (LABEL in {binary, tf, tfidf,
+               bm25, pivoted}, default: binary)
+    -k INT : retrieve the top INT documents for each query (default: 10)
+    -m : use the memory mapped binary index (index_*.bin, see binary_index.py)
+    -j INT : run the queries across INT worker processes (default: 1)
+    -t FILE : dump the timing profile to FILE as JSON
+    -x : score the queries in batches with the sparse matrix backend
+         (sparse_retriever.py, needs NumPy and SciPy, binary, tf and tfidf only)
+    -c INT : cache the results of up to INT distinct queries (per worker process)
+    -r FILE : analyze the raw text queries of FILE (e.g. queries.txt) with
+              the stoplist and stemming of the configuration, instead of
+              reading the preprocessed queries_*.txt file
+    -n INT : split the documents by doc id range across INT shard processes
+             (sharded_retriever.py), the queries are sent to every shard
+    -P : rerank the top 100 documents of each query by the proximity of
+         the query terms, with the positions_*.txt file of the
+         configuration (built by indexer.py -P, see positional_index.py)
+    -f : expand each query with Rocchio pseudo relevance feedback from
+         its top 10 documents, then retrieve again (not with binary)
+    -l INT : rank by the cosine of INT-dimensional LSA vectors, searched
+             approximately through inverted lists of their clusters
+             (dense_retriever.py, needs NumPy and SciPy, tfidf only)
     -o FILE : output results to file FILE
 ------------------------------------------------------------\
 """
@@ -13,15 +34,18 @@ OPTIONS:
 #==============================================================================
 # Importing
 
-import sys, getopt, re, time
-from my_retriever import Retrieve
+import sys, getopt, re, time, json, multiprocessing
+from my_retriever import Retrieve, SCHEMES
+from binary_index import is_binary_index, map_index
+from positional_index import PositionalIndex
+from result_cache import ResultCache, CachedRetrieve
 
 #==============================================================================
 # Command line processing
 
 class CommandLine:
     def __init__(self):
-        opts, args = getopt.getopt(sys.argv[1:], 'hspw:o:')
+        opts, args = getopt.getopt(sys.argv[1:], 'hspw:k:o:mj:t:xc:n:r:Pfl:')
         opts = dict(opts)
         self.exit = True
 
@@ -35,20 +59,50 @@ class CommandLine:
             return
 
         if '-w' in opts:
-            if opts['-w'] in ('binary', 'tf', 'tfidf'):
+            if opts['-w'] in SCHEMES:
                 self.termWeighting = opts['-w']
             else:
                 warning = (
                     "*** ERROR: term weighting label (opt: -w LABEL)! ***\n"
                     "    -- value (%s) not recognised!\n"
-                    "    -- must be one of: binary / tf / tfidf"
-                    )  % (opts['-w'])
+                    "    -- must be one of: %s"
+                    )  % (opts['-w'], ' / '.join(SCHEMES))
                 print(warning, file=sys.stderr)
                 self.printHelp()
                 return
         else:
             self.termWeighting = 'binary'
 
+        if '-k' in opts:
+            if opts['-k'].isdigit() and int(opts['-k']) > 0:
+                self.topK = int(opts['-k'])
+            else:
+                warning = (
+                    "*** ERROR: number of documents (opt: -k INT)! ***\n"
+                    "    -- value (%s) not recognised!\n"
+                    "    -- must be a positive integer"
+                    )  % (opts['-k'])
+                print(warning, file=sys.stderr)
+                self.printHelp()
+                return
+        else:
+            self.topK = 10
+
+        if '-j' in opts:
+            if opts['-j'].isdigit() and int(opts['-j']) > 0:
+                self.jobs = int(opts['-j'])
+            else:
+                warning = (
+                    "*** ERROR: number of worker processes (opt: -j INT)! ***\n"
+                    "    -- value (%s) not recognised!\n"
+                    "    -- must be a positive integer"
+                    )  % (opts['-j'])
+                print(warning, file=sys.stderr)
+                self.printHelp()
+                return
+        else:
+            self.jobs = 1
+
         if '-o' in opts:
             self.outfile = opts['-o']
         else:
@@ -57,6 +111,87 @@ class CommandLine:
             self.printHelp()
             return
 
+        self.profileFile = opts.get('-t')
+
+        self.sparse = '-x' in opts
+
+        if self.sparse and self.termWeighting not in ('binary', 'tf', 'tfidf'):
+            warning = (
+                "*** ERROR: term weighting label (opt: -w LABEL)! ***\n"
+                "    -- value (%s) not supported by the sparse backend (opt: -x)\n"
+                "    -- must be one of: binary / tf / tfidf"
+                )  % (self.termWeighting)
+            print(warning, file=sys.stderr)
+            self.printHelp()
+            return
+
+        if '-l' in opts:
+            if opts['-l'].isdigit() and int(opts['-l']) > 0:
+                self.dims = int(opts['-l'])
+            else:
+                warning = (
+                    "*** ERROR: LSA dimensions (opt: -l INT)! ***\n"
+                    "    -- value (%s) not recognised!\n"
+                    "    -- must be a positive integer"
+                    )  % (opts['-l'])
+                print(warning, file=sys.stderr)
+                self.printHelp()
+                return
+        else:
+            self.dims = None
+
+        if self.dims and self.termWeighting != 'tfidf':
+            warning = (
+                "*** ERROR: term weighting label (opt: -w LABEL)! ***\n"
+                "    -- value (%s) not supported by LSA (opt: -l INT)\n"
+                "    -- must be: tfidf"
+                )  % (self.termWeighting)
+            print(warning, file=sys.stderr)
+            self.printHelp()
+            return
+
+        if '-c' in opts:
+            if opts['-c'].isdigit() and int(opts['-c']) > 0:
+                self.cacheSize = int(opts['-c'])
+            else:
+                warning = (
+                    "*** ERROR: result cache size (opt: -c INT)! ***\n"
+                    "    -- value (%s) not recognised!\n"
+                    "    -- must be a positive integer"
+                    )  % (opts['-c'])
+                print(warning, file=sys.stderr)
+                self.printHelp()
+                return
+        else:
+            self.cacheSize = None
+
+        if '-n' in opts:
+            if opts['-n'].isdigit() and int(opts['-n']) > 0:
+                self.shards = int(opts['-n'])
+            else:
+                warning = (
+                    "*** ERROR: number of shard processes (opt: -n INT)! ***\n"
+                    "    -- value (%s) not recognised!\n"
+                    "    -- must be a positive integer"
+                    )  % (opts['-n'])
+                print(warning, file=sys.stderr)
+                self.printHelp()
+                return
+        else:
+            self.shards = None
+
+        if self.shards and self.jobs > 1:
+            # The shards already score every query in parallel, and worker processes
+            # cannot share the pipes to them
+            print('WARNING: -j is ignored with -n -- the shards run in parallel', file=sys.stderr)
+            self.jobs = 1
+
+        if self.dims and (self.sparse or self.shards):
+            print("*** ERROR: LSA (opt: -l INT) cannot be combined with -x or -n ***",
+                  file=sys.stderr)
+            self.printHelp()
+            return
+
         if '-s' in opts and '-p' in opts:
             self.indexFile   = 'index_withstoplist_withstemming.txt'
             self.queriesFile = 'queries_withstoplist_withstemming.txt'
@@ -69,7 +204,43 @@ class CommandLine:
         else:
             self.indexFile   = 'index_nostoplist_nostemming.txt'
             self.queriesFile = 'queries_nostoplist_nostemming.txt'
-            
+
+        self.feedback = '-f' in opts
+
+        if self.feedback and (self.sparse or self.shards or self.dims or '-P' in opts):
+            print("*** ERROR: feedback (opt: -f) needs the default retriever, "
+                  "not -x, -n, -l or -P ***", file=sys.stderr)
+            self.printHelp()
+            return
+
+        if self.feedback and self.termWeighting == 'binary':
+            warning = (
+                "*** ERROR: term weighting label (opt: -w LABEL)! ***\n"
+                "    -- value (%s) not supported by feedback (opt: -f)\n"
+                "    -- must be one of: tf / tfidf / bm25 / pivoted"
+                )  % (self.termWeighting)
+            print(warning, file=sys.stderr)
+            self.printHelp()
+            return
+
+        if '-P' in opts:
+            self.positionsFile = self.indexFile.replace('index_', 'positions_')
+        else:
+            self.positionsFile = None
+
+        if self.positionsFile and (self.sparse or self.shards or self.dims):
+            print("*** ERROR: proximity reranking (opt: -P) needs the default retriever, "
+                  "not -x, -n or -l ***", file=sys.stderr)
+            self.printHelp()
+            return
+
+        if '-m' in opts:
+            self.indexFile = self.indexFile.replace('.txt', '.bin')
+
+        # The raw queries file, analyzed under the variant of the queries file
+        self.rawQueriesFile = opts.get('-r')
+        self.variant = self.queriesFile[len('queries_'):-len('.txt')]
+
         self.exit = False
 
     def printHelp(self):
@@ -82,22 +253,74 @@ class CommandLine:
 # Timer 
 
 class MyTimer:
+    # The per-query stages, in the order they are reported, the stages the retriever
+    # does not time (candidates for taat and maxscore) are left out
+    STAGES = ('query', 'candidates', 'scoring', 'top_k')
+
     def __init__(self):
         self.startTime = {}
+        self.timings = {}
 
     def start(self, label = None):
-        self.startTime[label] = time.clock()
+        self.startTime[label] = time.perf_counter()
+
+    def stop(self, label = None):
+        duration = time.perf_counter() - self.startTime[label]
+        self.record(label, duration)
+        return duration
+
+    def record(self, label, duration):
+        if label not in self.timings:
+            self.timings[label] = []
+        self.timings[label].append(duration)
 
     def stopPrint(self, label = None):
-        duration = time.clock() - self.startTime[label]
+        duration = self.stop(label)
         msg = 'TIME (%s): %.2f' % (label, duration)
         print(msg, file=sys.stderr)
 
+    def percentile(self, label, p):
+        # Nearest rank percentile
+        durations = sorted(self.timings[label])
+        rank = max(1, -(-len(durations) * p // 100))
+        return durations[int(rank) - 1]
+
+    def profile(self):
+        profile = {}
+        for (label, durations) in self.timings.items():
+            profile[label] = {'count': len(durations), 'total': sum(durations)}
+            if label in self.STAGES:
+                for p in (50, 95, 99):
+                    profile[label]['p%d' % p] = self.percentile(label, p)
+        return profile
+
+    def printSummary(self):
+        for label in self.STAGES:
+            if label in self.timings:
+                msg = 'TIME (%s): p50 %.3f ms, p95 %.3f ms, p99 %.3f ms' % (
+                    label, self.percentile(label, 50) * 1000,
+                    self.percentile(label, 95) * 1000, self.percentile(label, 99) * 1000)
+                print(msg, file=sys.stderr)
+
+    def dumpJson(self, outfile):
+        with open(outfile, 'w') as out:
+            json.dump(self.profile(), out, indent=2, sort_keys=True)
+
 #==============================================================================
 # Load (precomputed) Index File for (preprocessed) Document Collection
 
 class IndexLoader:
-    def __init__(self, indexFile):
+    def __init__(self, indexFile, positionsFile = None):
+        # The positions are only decoded for the documents a query asks about
+        if positionsFile is not None:
+            self.positions = PositionalIndex(positionsFile)
+        else:
+            self.positions = None
+
+        if is_binary_index(indexFile):
+            self.index = map_index(indexFile)
+            return
+
         self.index = {}
         docidCountRE = re.compile('(\d+):(\d+)')
         f = open(indexFile, 'r')
@@ -111,6 +334,9 @@ class IndexLoader:
     def getIndex(self):
         return self.index
 
+    def getPositions(self):
+        return self.positions
+
 #==============================================================================
 # Load (preprocessed) Collection of Queries
 
@@ -138,17 +364,37 @@ class Queries:
     def qids(self):
         return sorted(self.qStore)
 
+#==============================================================================
+# Analyze (raw text) Collection of Queries
+
+class RawQueries(Queries):
+    # The stem cache is bounded, query streams have no fixed vocabulary
+    STEM_CACHE_SIZE = 100000
+
+    def __init__(self, queriesFile, variant,
+                 stopListFile = '../Lab Exercises/stop_list.txt'):
+        from indexer import Preprocessor, read_collection
+        self.preprocessor = Preprocessor(stopListFile, self.STEM_CACHE_SIZE)
+        self.variant = variant
+        self.qStore = {}
+        for (qid, text) in read_collection(queriesFile):
+            self.qStore[qid] = self.analyze(text)
+
+    def analyze(self, text):
+        return self.preprocessor.analyze(text, self.variant)
+
 #==============================================================================
 # Store for Retrieval Results
 
 class ResultStore:
-    def __init__(self, outfile):
+    def __init__(self, outfile, k = 10):
         self.outfile = outfile
+        self.k = k
         self.results = []
 
     def store(self, qid, docids):
-        if len(docids) > 10:
-            docids = docids[:10]
+        if len(docids) > self.k:
+            docids = docids[:self.k]
         self.results.append((qid, docids))
 
     def output(self):
@@ -157,6 +403,67 @@ class ResultStore:
                 for docid in docids:
                     print(qid, docid, file=out)
 
+#==============================================================================
+# Batch Query Execution
+
+# The retriever and queries of the batch, set before the worker processes are
+# forked so that they inherit the loaded index copy-on-write instead of having
+# it pickled to them
+batchRetrieve = None
+batchQueries = None
+
+def retrieveQuery(qid, k):
+    start = time.perf_counter()
+    results = batchRetrieve.forQuery(batchQueries.getQuery(qid), k)
+    times = dict(batchRetrieve.query_times, query = time.perf_counter() - start)
+    return qid, results, times
+
+def retrieveBatch(qids, k):
+    if len(qids) == 0:
+        return []
+    start = time.perf_counter()
+    allResults = batchRetrieve.forQueries([batchQueries.getQuery(qid) for qid in qids], k)
+    # One matrix product scores the whole batch, each query is charged an equal share
+    share = (time.perf_counter() - start) / len(qids)
+    return [(qid, results, {'query': share}) for (qid, results) in zip(qids, allResults)]
+
+def retrieveShard(qids, k):
+    # A cached retriever batches its cache misses when the retriever it wraps scores batches
+    if hasattr(getattr(batchRetrieve, 'retrieve', batchRetrieve), 'forQueries'):
+        return retrieveBatch(qids, k)
+    return [retrieveQuery(qid, k) for qid in qids]
+
+def retrieveShards(qids, k, jobs):
+    if jobs == 1 or len(qids) < 2:
+        return retrieveShard(qids, k)
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print('WARNING: worker processes need fork -- running serially', file=sys.stderr)
+        return retrieveShard(qids, k)
+
+    # Contiguous shards, so that results come back already in qid order
+    jobs = min(jobs, len(qids))
+    size = -(-len(qids) // jobs)
+    shards = [(qids[i:i + size], k) for i in range(0, len(qids), size)]
+
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        results = pool.starmap(retrieveShard, shards)
+
+    return [result for shard in results for result in shard]
+
+def retrieveAll(retrieve, queries, k, jobs = 1, timer = None):
+    global batchRetrieve, batchQueries
+    batchRetrieve, batchQueries = retrieve, queries
+
+    allResults = []
+    for (qid, results, times) in retrieveShards(queries.qids(), k, jobs):
+        if timer is not None:
+            for stage in MyTimer.STAGES:
+                if stage in times:
+                    timer.record(stage, times[stage])
+        allResults.append((qid, results))
+    return allResults
+
 #==============================================================================
 # MAIN
 
@@ -165,19 +472,56 @@ if __name__ == '__main__':
     config = CommandLine()
     if config.exit:
         sys.exit(0)        
-    index = IndexLoader(config.indexFile).getIndex()
-    retrieve = Retrieve(index, config.termWeighting)
-    queries = Queries(config.queriesFile)
-    allResults = ResultStore(config.outfile)
-
     t = MyTimer()
+
+    t.start('index load')
+    loader = IndexLoader(config.indexFile, config.positionsFile)
+    index = loader.getIndex()
+    t.stopPrint('index load')
+
+    t.start('construction')
+    if config.sparse:
+        from sparse_retriever import SparseRetrieve
+        retrieve = SparseRetrieve(index, config.termWeighting)
+    elif config.dims:
+        from dense_retriever import DenseRetrieve
+        retrieve = DenseRetrieve(index, config.dims)
+    elif config.shards:
+        from sharded_retriever import ShardedRetrieve
+        shardedRetrieve = ShardedRetrieve(index, config.termWeighting, config.shards)
+        retrieve = shardedRetrieve
+    else:
+        retrieve = Retrieve(index, config.termWeighting, positions = loader.getPositions(),
+                            proximity = config.positionsFile is not None,
+                            feedback = config.feedback)
+    if config.cacheSize:
+        cache = ResultCache(config.cacheSize)
+        retrieve = CachedRetrieve(retrieve, cache)
+    t.stopPrint('construction')
+
+    if config.rawQueriesFile:
+        t.start('analysis')
+        queries = RawQueries(config.rawQueriesFile, config.variant)
+        t.stopPrint('analysis')
+    else:
+        queries = Queries(config.queriesFile)
+    allResults = ResultStore(config.outfile, config.topK)
+
     t.start('retrieval')
 
-    for qid in queries.qids():
-        query = queries.getQuery(qid)
-        results = retrieve.forQuery(query)
+    for (qid, results) in retrieveAll(retrieve, queries, config.topK, config.jobs, t):
         allResults.store(qid, results)
 
     t.stopPrint('retrieval')    
+    if config.shards:
+        shardedRetrieve.close()
+    t.printSummary()
+
+    if config.cacheSize and config.jobs == 1:
+        msg = 'CACHE: %(hits)d hits, %(misses)d misses, %(evictions)d evictions' % cache.stats()
+        print(msg, file=sys.stderr)
     allResults.output()
 
+    if config.profileFile:
+        t.dumpJson(config.profileFile)
+
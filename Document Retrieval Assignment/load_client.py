@@ -0,0 +1,159 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: sends queries to a running retrieval_server.py from
+    several concurrent connections and reports the throughput
+    and the p50/p95/p99 latency of the requests
+OPTIONS:
+    -h : print this help message
+    -a HOST : connect to address HOST (default: 127.0.0.1)
+    -p PORT : connect to port PORT (default: 8000)
+    -q FILE : send the term:count queries of FILE (default: the
+              raw text queries of queries.txt)
+    -v NAME : search variant NAME (default: the server's first)
+    -w LABEL : use weighting scheme LABEL (default: the server's first)
+    -k INT : retrieve the top INT documents for each query (default: 10)
+    -n INT : send INT requests in total, cycling over the queries
+             (default: 1000)
+    -C INT : keep INT connections sending requests concurrently
+             (default: 8)
+------------------------------------------------------------\
+"""
+
+import sys, getopt, json, time, asyncio
+from ir_engine import MyTimer
+from indexer import read_collection
+
+
+class LoadOptions:
+    def __init__(self, opts):
+        self.host = opts.get('-a', '127.0.0.1')
+        self.port = int(opts.get('-p', 8000))
+        self.queries_file = opts.get('-q')
+        self.variant = opts.get('-v')
+        self.weighting = opts.get('-w')
+        self.k = int(opts.get('-k', 10))
+        self.requests = int(opts.get('-n', 1000))
+        self.concurrency = int(opts.get('-C', 8))
+
+
+def read_queries(config):
+    """
+    Read the queries to send
+
+    :param config: The load options
+    :return: The list of query texts
+    """
+
+    if config.queries_file is None:
+        return [text for _, text in read_collection('queries.txt')]
+
+    with open(config.queries_file, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+async def post(reader, writer, host, body):
+    """
+    Send a search request on an open connection and read the reply
+
+    :param reader: The stream reader of the connection
+    :param writer: The stream writer of the connection
+    :param host: The server address, for the Host header
+    :param body: The JSON body
+    :return: The status code and the decoded reply
+    """
+
+    writer.write(('POST /search HTTP/1.1\r\n'
+                  'Host: %s\r\n'
+                  'Content-Type: application/json\r\n'
+                  'Content-Length: %d\r\n\r\n' % (host, len(body))).encode('latin-1') + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(config, bodies, counter, timer, errors):
+    """
+    Send requests on one connection until the requests run out
+
+    :param config: The load options
+    :param bodies: The encoded request bodies
+    :param counter: The iterator handing out request numbers, shared by the clients
+    :param timer: The timer recording the latency of each request
+    :param errors: The list the failed replies are appended to
+    """
+
+    reader, writer = await asyncio.open_connection(config.host, config.port)
+
+    try:
+        for i in counter:
+            start = time.perf_counter()
+            status, reply = await post(reader, writer, config.host, bodies[i % len(bodies)])
+            timer.record('query', time.perf_counter() - start)
+
+            if status != 200:
+                errors.append(reply.get('error', status))
+    finally:
+        writer.close()
+
+
+async def run(config, queries):
+    """
+    Send the requests from concurrent connections
+
+    :param config: The load options
+    :param queries: The query texts
+    :return: The timer holding the latencies, the failed replies and the total time
+    """
+
+    bodies = []
+    for text in queries:
+        request = {'query': text, 'k': config.k}
+        if config.variant:
+            request['variant'] = config.variant
+        if config.weighting:
+            request['weighting'] = config.weighting
+        bodies.append(json.dumps(request).encode('utf-8'))
+
+    timer = MyTimer()
+    errors = []
+    counter = iter(range(config.requests))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(config, bodies, counter, timer, errors)
+                           for _ in range(config.concurrency)])
+
+    return timer, errors, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'ha:p:q:v:w:k:n:C:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0:
+        print(__doc__.replace('<PROGNAME>', sys.argv[0].split('/')[-1], 1), file=sys.stderr)
+        sys.exit(0)
+
+    config = LoadOptions(opts)
+    timer, errors, duration = asyncio.run(run(config, read_queries(config)))
+
+    count = len(timer.timings.get('query', []))
+    print('REQUESTS: %d in %.2f s, %d errors' % (count, duration, len(errors)))
+    print('THROUGHPUT: %.1f requests/s' % (count / duration))
+    if count:
+        print('LATENCY: p50 %.3f ms, p95 %.3f ms, p99 %.3f ms' % (
+            timer.percentile('query', 50) * 1000, timer.percentile('query', 95) * 1000,
+            timer.percentile('query', 99) * 1000))
+    for error in sorted(set(map(str, errors)))[:5]:
+        print('ERROR: %s' % error, file=sys.stderr)
@@ -2,7 +2,53 @@
 The retriever of Document Retrieval System
 """
 
+import bisect
+import functools
+import heapq
+import itertools
 import math
+import time
+from boolean_query import positive_terms
+
+# Cursor position past the end of a postings list
+END = math.inf
+
+# The term weighting schemes
+SCHEMES = ('binary', 'tf', 'tfidf', 'bm25', 'pivoted')
+
+# BM25 term frequency saturation and length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# The slope of pivoted length normalisation
+PIVOT_SLOPE = 0.2
+
+# The number of top documents reranked by the proximity of the query terms, and how much
+# the proximity raises their scores
+PROXIMITY_DEPTH = 100
+PROXIMITY_WEIGHT = 0.25
+
+# Rocchio pseudo relevance feedback: the number of top documents taken as relevant, the
+# largest number of terms the query is expanded with and the most postings they may add,
+# relative to those of the query, and the weights of the query and of the centroid of the
+# feedback documents
+FEEDBACK_DOCS = 10
+FEEDBACK_TERMS = 10
+FEEDBACK_POSTINGS = 0.25
+ROCCHIO_ALPHA = 1.0
+ROCCHIO_BETA = 0.25
+
+
+@functools.lru_cache(maxsize=None)
+def pivoted_tf(count):
+    """
+    Get the dampened term frequency of pivoted normalisation
+
+    :param count: The term count in a document, at least 1
+    :return: 1 + ln(1 + ln(count))
+    """
+
+    return 1 + math.log(1 + math.log(count))
 
 
 class Retrieve:
@@ -10,64 +56,609 @@ class Retrieve:
     The class for Retriever
     """
 
-    def __init__(self, index, term_weighting):
+    def __init__(self, index, term_weighting, evaluation='taat', docs=None, idf_drift=0.1,
+                 stats=None, positions=None, proximity=False, feedback=False):
         """
         Create new Retrieve object storing index and term weighting scheme
 
-        :param index: The index dictionary
-        :param term_weighting: The term weighting scheme, binary, tf or tfidf
+        :param index: The index dictionary, documents added, updated or deleted later
+                      change it in place, or a read only mapped index (binary_index.py),
+                      for which no forward index is kept
+        :param term_weighting: The term weighting scheme, binary, tf, tfidf, bm25 or pivoted
+        :param evaluation: The query evaluation strategy, taat (term at a time over the
+                           postings), candidate (document at a time over the candidates) or
+                           maxscore (document at a time with dynamic pruning)
+        :param docs: The doc ids of the collection, by default 1 to the largest doc id
+        :param idf_drift: The relative change of |D| after which the IDF of every term and
+                          the TFIDF weights are recomputed, before the next query
+        :param stats: The |D|, the document frequency of each term and the average
+                      document length of the whole collection, when the index holds only a
+                      shard of it, by default computed from the index
+        :param positions: The positional index of the collection, for phrase and proximity
+                          queries
+        :param proximity: Whether forQuery reranks the top documents by the proximity of
+                          the query terms, it needs the positional index
+        :param feedback: Whether forQuery expands the query with pseudo relevance feedback,
+                         any scheme but binary
         """
 
         self.index = index
         self.term_weighting = term_weighting
+        self.evaluation = evaluation
+
+        if isinstance(index, dict):
+            # All the terms that appear in a document with their counts (forward index),
+            # built by inverting the postings in a single pass
+            forward = {}
+
+            for term, postings in index.items():
+                for doc, count in postings.items():
+                    if doc in forward:
+                        forward[doc][term] = count
+                    else:
+                        forward[doc] = {term: count}
+
+            if docs is None:
+                docs = range(1, max(forward, default=0) + 1)
+
+            # Documents without any indexed term still count towards |D|
+            self.terms_in_doc = {doc: forward.get(doc, {}) for doc in docs}
+
+            # The length of each document, its total term count
+            self.doc_len = {doc: sum(terms.values()) for doc, terms in self.terms_in_doc.items()}
+        else:
+            # A mapped index cannot be updated, so its documents never have to be weighed
+            # again one at a time: their lengths and vector sizes are gathered term at a
+            # time from the postings, which stay compressed or mapped, and no forward index
+            # is kept
+            self.terms_in_doc = None
+            lengths = {}
+
+            for postings in index.values():
+                for doc, count in postings.items():
+                    lengths[doc] = lengths.get(doc, 0) + count
+
+            if docs is None:
+                docs = range(1, max(lengths, default=0) + 1)
+
+            self.doc_len = {doc: lengths.get(doc, 0) for doc in docs}
 
         # The total number of documents in the collection |D|
-        self.total_doc = max(doc for docs in index.values() for doc in docs)
+        self.total_doc = len(self.doc_len)
+
+        # The number of documents containing a term
+        self.doc_freq = {term: len(docs) for term, docs in index.items()}
+
+        # The total length of the collection
+        self.total_len = sum(self.doc_len.values())
+
+        # The statistics of the whole collection when this is a shard of it
+        self.stats = stats
+
+        # The inverse document frequency of each term and the average document length,
+        # and the |D| they were computed with; they are only recomputed once |D| drifts by
+        # more than idf_drift
+        self.idf_drift = idf_drift
+        self._weigh_collection()
+
+        # The TFIDF value of each term in each document, the document vector size (the
+        # pivoted length factor for pivoted, 1 for bm25) under every weighting scheme, and
+        # the BM25 saturation constant of each document, so that no query has to compute
+        # them again; the TFIDF vectors of a mapped index are only built by the first
+        # feedback query, see tfidf_vectors
+        self.term_tfidf_in_doc = {} if self.terms_in_doc is not None else None
+        self.doc_norm = {scheme: {} for scheme in SCHEMES}
+        self.doc_saturation = {}
+
+        self._weigh_docs()
+
+        # The size of each document vector for the chosen weighting scheme
+        self.doc_vec_size = self.doc_norm[term_weighting]
+
+        # The positions of the postings, and the documents added since they were loaded,
+        # whose positions are unknown
+        self.positions = positions
+        self.proximity = proximity
+        self.feedback = feedback
+        self.unpositioned = set()
+
+        # The number of changes to the collection or its weights, for result caches
+        self.version = 0
+
+        # The postings touched and documents scored by the last query
+        self.query_stats = {'postings': 0, 'scored': 0}
+
+        # The seconds spent by the last query in each stage its evaluation times
+        self.query_times = {}
+
+        # The doc ids of each term in ascending order, for the cursors, unless its postings
+        # provide their own cursor (compressed postings); kept for every term by maxscore,
+        # sorted on demand by Boolean queries otherwise
+        self.sorted_postings = {}
+
+        if evaluation == 'maxscore':
+            self.sorted_postings = {term: sorted(docs) for term, docs in index.items()
+                                    if not hasattr(docs, 'cursor')}
+
+            # The highest normalised document weight of each term, an upper bound of its
+            # contribution to any similarity score once multiplied by the query weight
+            self.term_max_score = {}
+            self._bound_terms(index)
+
+    def collection_stats(self):
+        """
+        Get the statistics of the collection the scores are computed with
+
+        :return: The |D|, the document frequency of each term and the average document
+                 length, of the whole collection if this is a shard of it
+        """
+
+        if self.stats is not None:
+            return self.stats
+
+        return self.total_doc, self.doc_freq, self.total_len / max(self.total_doc, 1)
+
+    def _weigh_collection(self):
+        """
+        Compute the IDF of every term and the average document length from the collection
+        """
+
+        total_doc, doc_freq, self.avg_doc_len = self.collection_stats()
+
+        self.idf = {term: math.log(total_doc / doc_freq[term]) for term in self.doc_freq}
+        self.idf_total_doc = self.total_doc
+        self.idf_stale = False
+
+    def _weigh_docs(self):
+        """
+        Compute the vector sizes under every weighting scheme of every document, from the
+        forward index, or term at a time from the postings of a mapped index
+        """
+
+        if self.terms_in_doc is not None:
+            for doc in self.terms_in_doc:
+                self._weigh_doc(doc)
+            return
+
+        # The same sums as _weigh_doc, added in the same term order
+        terms = dict.fromkeys(self.doc_len, 0)
+        tf = dict.fromkeys(self.doc_len, 0)
+        tfidf = dict.fromkeys(self.doc_len, 0)
+
+        for term, postings in self.index.items():
+            idf = self.idf[term]
+            for doc, count in postings.items():
+                terms[doc] += 1
+                tf[doc] += count ** 1.95
+                tfidf[doc] += (idf * count) ** 2
+
+        for doc in self.doc_len:
+            self.doc_norm['binary'][doc] = math.sqrt(terms[doc])
+            self.doc_norm['tf'][doc] = math.sqrt(tf[doc])
+            self.doc_norm['tfidf'][doc] = math.sqrt(tfidf[doc])
+            self._weigh_length(doc)
+
+        # The TFIDF vectors a feedback query built are stale
+        self.term_tfidf_in_doc = None
+
+    def _weigh_doc(self, doc):
+        """
+        Compute the TFIDF vector and the vector size under every weighting scheme of a document
+
+        :param doc: The document id, its terms must already be in the forward index
+        """
+
+        terms = self.terms_in_doc[doc]
+
+        tfidf = {term: self.idf[term] * count for term, count in terms.items()}
+        self.term_tfidf_in_doc[doc] = tfidf
+
+        # Binary: the number of terms in the document
+        self.doc_norm['binary'][doc] = math.sqrt(len(terms))
+
+        # TF: 1.95 gives better results
+        self.doc_norm['tf'][doc] = math.sqrt(sum(count ** 1.95 for count in terms.values()))
+
+        # TFIDF
+        self.doc_norm['tfidf'][doc] = math.sqrt(sum(value ** 2 for value in tfidf.values()))
+
+        self._weigh_length(doc)
+
+    def _weigh_length(self, doc):
+        """
+        Compute the length normalisation of a document under pivoted and BM25
+
+        :param doc: The document id, its length must already be known
+        """
+
+        # Pivoted: documents longer than average are penalised, shorter ones favoured
+        relative_len = self.doc_len[doc] / (self.avg_doc_len or 1)
+        self.doc_norm['pivoted'][doc] = 1 - PIVOT_SLOPE + PIVOT_SLOPE * relative_len
+
+        # BM25: the length is normalised inside the saturation of each term count
+        self.doc_norm['bm25'][doc] = 1
+        self.doc_saturation[doc] = BM25_K1 * (1 - BM25_B + BM25_B * relative_len)
+
+    def tfidf_vectors(self):
+        """
+        Get the TFIDF vector of every document, inverting the postings of a mapped index on
+        first use, as only pseudo relevance feedback needs whole document vectors
+
+        :return: The dictionary of the TFIDF value of each term in each document
+        """
+
+        if self.term_tfidf_in_doc is None:
+            vectors = {doc: {} for doc in self.doc_len}
+
+            for term, postings in self.index.items():
+                idf = self.idf[term]
+                for doc, count in postings.items():
+                    vectors[doc][term] = idf * count
+
+            self.term_tfidf_in_doc = vectors
+
+        return self.term_tfidf_in_doc
+
+    def posting_tf(self, doc, count):
+        """
+        Get the document side weight of a posting before the division by the document vector
+        size, the query weight is folded in by query_weights
+
+        :param doc: The doc id
+        :param count: The term count in the document
+        :return: The weight of the posting
+        """
+
+        if self.term_weighting == 'binary':
+            return 1
+
+        if self.term_weighting == 'bm25':
+            return count / (count + self.doc_saturation[doc])
+
+        if self.term_weighting == 'pivoted':
+            return pivoted_tf(count)
+
+        return count
+
+    def _bound_terms(self, terms):
+        """
+        Compute the MaxScore upper bound of terms
+
+        :param terms: The terms, they must appear in the index
+        """
+
+        for term in terms:
+            self.term_max_score[term] = max(self.posting_tf(doc, count) / self.doc_vec_size[doc]
+                                            for doc, count in self.index[term].items())
+
+    def add_document(self, doc, terms):
+        """
+        Add a document to the collection, it is searchable by the next query
+
+        :param doc: The doc id, it must not be in the collection
+        :param terms: The dictionary of the count of each term in the document
+        """
+
+        if self.terms_in_doc is None:
+            raise TypeError('a mapped index is read only')
+
+        if doc in self.terms_in_doc:
+            raise ValueError('document %s is already in the collection' % doc)
+
+        self.terms_in_doc[doc] = dict(terms)
+        self.unpositioned.add(doc)
+        self.total_doc += 1
+        self.doc_len[doc] = sum(terms.values())
+        self.total_len += self.doc_len[doc]
+
+        for term, count in terms.items():
+            if term in self.index:
+                self.index[term][doc] = count
+                self.doc_freq[term] += 1
+            else:
+                self.index[term] = {doc: count}
+                self.doc_freq[term] = 1
+                self.idf[term] = math.log(self.total_doc)
+
+            if self.evaluation == 'maxscore':
+                bisect.insort(self.sorted_postings.setdefault(term, []), doc)
+            else:
+                self.sorted_postings.pop(term, None)
+
+        self._weigh_doc(doc)
+
+        if self.evaluation == 'maxscore':
+            for term, weight in self._doc_weights(doc).items():
+                self.term_max_score[term] = max(self.term_max_score.get(term, 0), weight)
+
+        self._collection_changed()
+
+    def delete_document(self, doc):
+        """
+        Delete a document from the collection
+
+        :param doc: The doc id, it must be in the collection
+        """
+
+        if self.terms_in_doc is None:
+            raise TypeError('a mapped index is read only')
+
+        if doc not in self.terms_in_doc:
+            raise KeyError(doc)
+
+        if self.evaluation == 'maxscore':
+            weights = self._doc_weights(doc)
+
+        terms = self.terms_in_doc.pop(doc)
+        self.total_doc -= 1
+        self.total_len -= self.doc_len.pop(doc)
+
+        self.unpositioned.discard(doc)
+        del self.term_tfidf_in_doc[doc], self.doc_saturation[doc]
+        for norms in self.doc_norm.values():
+            del norms[doc]
+
+        for term in terms:
+            del self.index[term][doc]
+            self.doc_freq[term] -= 1
+
+            if self.evaluation != 'maxscore':
+                self.sorted_postings.pop(term, None)
+
+            if self.doc_freq[term] == 0:
+                del self.index[term], self.doc_freq[term], self.idf[term]
+
+                if self.evaluation == 'maxscore':
+                    del self.sorted_postings[term], self.term_max_score[term]
+
+            elif self.evaluation == 'maxscore':
+                postings = self.sorted_postings[term]
+                del postings[bisect.bisect_left(postings, doc)]
+
+                # Only the document holding the bound can lower it
+                if weights[term] >= self.term_max_score[term]:
+                    self._bound_terms([term])
+
+        self._collection_changed()
+
+    def update_document(self, doc, terms):
+        """
+        Replace the terms of a document, adding it if it is not in the collection
+
+        :param doc: The doc id
+        :param terms: The dictionary of the count of each term in the document
+        """
+
+        if self.terms_in_doc is not None and doc in self.terms_in_doc:
+            self.delete_document(doc)
+
+        self.add_document(doc, terms)
+
+    def _doc_weights(self, doc):
+        """
+        Get the normalised weight of each term of a document, its contribution to the
+        MaxScore upper bound of the term
+
+        :param doc: The doc id, it must be in the collection
+        :return: The dictionary of the weight of each term
+        """
+
+        norm = self.doc_vec_size[doc]
+
+        return {term: self.posting_tf(doc, count) / norm
+                for term, count in self.terms_in_doc[doc].items()}
+
+    def _collection_changed(self):
+        """
+        Mark the IDF stale once |D| has drifted too far from the one it was computed with
+        """
 
-        # All the terms that appear in a document (doc: set() for better performance)
-        self.terms_in_doc = {doc: {terms
-                                   for terms, docs in index.items()
-                                   if doc in docs}
-                             for doc in range(1, self.total_doc + 1)}
+        self.version += 1
 
-        if term_weighting == 'tf':
-            # The size of each document vector for TF, 1.95 gives better results
-            self.doc_vec_size = dict.fromkeys(self.terms_in_doc, 0)
+        if abs(self.total_doc - self.idf_total_doc) > self.idf_drift * self.idf_total_doc:
+            self.idf_stale = True
 
-            for doc, terms in self.terms_in_doc.items():
-                for term in terms:
-                    self.doc_vec_size[doc] += index[term][doc] ** 1.95
+    def reweigh(self):
+        """
+        Recompute the IDF of every term and the average document length from the current
+        collection, and the TFIDF weights and vector sizes of every document
+        """
 
-                self.doc_vec_size[doc] = math.sqrt(self.doc_vec_size[doc])
+        self._weigh_collection()
+        self.version += 1
 
-        elif term_weighting == 'tfidf':
-            # The number of documents containing a term
-            self.doc_freq = {term: len(index[term]) for term in index}
+        self._weigh_docs()
 
-            # The TFIDF value of each term in each document
-            # Prevent calculating the same values in the loop, reduce retrieval time
-            self.term_tfidf_in_doc = \
-                {doc: {term: math.log(self.total_doc / self.doc_freq[term]) * index[term][doc]
-                       for term in terms}
-                 for doc, terms in self.terms_in_doc.items()}
+        if self.evaluation == 'maxscore':
+            self._bound_terms(self.index)
 
-    def forQuery(self, query):
+    def forQuery(self, query, k=10):
         """
         Method performing retrieval for specified query
 
         :param query: The query to process
-        :return: The top 10 most relevant documents to the query
+        :param k: The number of documents to return
+        :return: The top k most relevant documents to the query
+        """
+
+        if self.feedback:
+            return [doc for doc, score in self.feedback_ranked(query, k)]
+
+        if self.proximity:
+            return [doc for doc, score in self.proximity_ranked(query, k)]
+
+        return [doc for doc, score in self.ranked(query, k)]
+
+    def ranked(self, query, k=10):
+        """
+        Retrieve the top k documents of a query with their similarity scores
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The (doc id, score) pairs of the top k most relevant documents to the query
+        """
+
+        self.query_times = {}
+
+        if self.idf_stale:
+            self.reweigh()
+
+        if self.evaluation == 'maxscore':
+            # Candidates, scores and the top k heap are interleaved, timed as scoring
+            start = time.perf_counter()
+            ranked_doc = self.score_maxscore(query, k)
+            self.query_times['scoring'] = time.perf_counter() - start
+
+            return ranked_doc
+
+        if self.evaluation == 'taat':
+            similarity = self.score_postings(query)
+        else:
+            similarity = self.score_candidates(query)
+
+        start = time.perf_counter()
+        ranked_doc = self.top_k_scores(similarity, k)
+        self.query_times['top_k'] = time.perf_counter() - start
+
+        return ranked_doc
+
+    @staticmethod
+    def top_k_scores(similarity, k):
+        """
+        Select the k documents with the highest similarity scores with a bounded heap
+
+        :param similarity: The similarity score of each document
+        :param k: The number of documents to select
+        :return: The (doc id, score) pairs by similarity scores in descending order, ties
+                 broken by ascending document id
+        """
+
+        if len(similarity) <= k:
+            return sorted(similarity.items(), key=lambda x: (-x[1], x[0]))
+
+        # The heap compares the scores alone, the documents tied with the k-th score are
+        # then gathered again so that ties are broken by doc id
+        top = heapq.nlargest(k, similarity, key=similarity.get)
+        threshold = similarity[top[-1]]
+
+        return sorted([(doc, score) for doc, score in similarity.items() if score >= threshold],
+                      key=lambda x: (-x[1], x[0]))[:k]
+
+    @staticmethod
+    def top_k(similarity, k):
+        """
+        Select the k documents with the highest similarity scores with a bounded heap
+
+        :param similarity: The similarity score of each document
+        :param k: The number of documents to select
+        :return: The documents by similarity scores in descending order, ties broken by
+                 ascending document id
+        """
+
+        return [doc for doc, score in Retrieve.top_k_scores(similarity, k)]
+
+    def query_weights(self, query):
+        """
+        Get the weight of each query term that appears in the index, folded so that the
+        contribution of a posting is weight * posting_tf
+
+        :param query: The query to process
+        :return: The dictionary of query term weights
+        """
+
+        if self.term_weighting == 'binary':
+            return {term: 1 for term in query if term in self.index}
+
+        if self.term_weighting == 'tf':
+            return {term: count for term, count in query.items() if term in self.index}
+
+        if self.term_weighting == 'tfidf':
+            # TFIDF in query * IDF of the document side
+            return {term: count * self.idf[term] ** 2
+                    for term, count in query.items()
+                    if term in self.index}
+
+        total_doc, doc_freq, _ = self.collection_stats()
+
+        if self.term_weighting == 'bm25':
+            # The BM25 IDF, which stays positive for terms in most documents, with the
+            # (k1 + 1) factor of the saturated term frequency
+            return {term: count * (BM25_K1 + 1) *
+                    math.log(1 + (total_doc - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                    for term, count in query.items()
+                    if term in self.index}
+
+        # Pivoted
+        return {term: count * math.log((total_doc + 1) / doc_freq[term])
+                for term, count in query.items()
+                if term in self.index}
+
+    def score_postings(self, query):
+        """
+        Score documents term at a time, walking the postings of every query term into an
+        accumulator and dividing once by the cached document vector sizes
+
+        Walking the postings accumulates the scores, so the walk is timed with the division
+        as scoring, term at a time has no separate candidate generation
+
+        :param query: The query to process
+        :return: The similarity score of every document sharing a term with the query
+        """
+
+        start = time.perf_counter()
+        accumulator = {}
+
+        for term, weight in self.query_weights(query).items():
+            if self.term_weighting == 'binary':
+                for doc in self.index[term]:
+                    accumulator[doc] = accumulator.get(doc, 0) + weight
+            elif self.term_weighting == 'bm25':
+                saturation = self.doc_saturation
+                for doc, count in self.index[term].items():
+                    accumulator[doc] = (accumulator.get(doc, 0) +
+                                        weight * count / (count + saturation[doc]))
+            elif self.term_weighting == 'pivoted':
+                for doc, count in self.index[term].items():
+                    accumulator[doc] = accumulator.get(doc, 0) + weight * pivoted_tf(count)
+            else:
+                for doc, count in self.index[term].items():
+                    accumulator[doc] = accumulator.get(doc, 0) + weight * count
+
+        self.query_stats = {'postings': sum(len(self.index[term]) for term in query
+                                            if term in self.index),
+                            'scored': len(accumulator)}
+
+        similarity = {doc: product / self.doc_vec_size[doc]
+                      for doc, product in accumulator.items()}
+
+        self.query_times['scoring'] = time.perf_counter() - start
+
+        return similarity
+
+    def score_candidates(self, query):
+        """
+        Score documents one candidate at a time, intersecting the query with its terms
+
+        :param query: The query to process
+        :return: The similarity score of every document sharing a term with the query
         """
 
+        if self.terms_in_doc is None:
+            return self.score_cursors(query)
+
+        start = time.perf_counter()
         candidate = self.get_candidate(query)
+        collected = time.perf_counter()
 
         similarity = {}
 
         if self.term_weighting == 'tfidf':
             # Prevent repeating the same calculation for every candidate document
-            query_tfidf = {term: query[term] * math.log(self.total_doc / self.doc_freq[term])
+            query_tfidf = {term: query[term] * self.idf[term]
                            for term in query
                            if term in self.index}
+        elif self.term_weighting in ('bm25', 'pivoted'):
+            weights = self.query_weights(query)
 
         for doc in candidate:
             # The same terms in query and candidate document
@@ -76,9 +667,6 @@ class Retrieve:
             # The numerator of vector space model
             query_doc_product = 0
 
-            # The denominator (right one) of vector space model
-            doc_vec_size = 0
-
             if self.term_weighting == 'binary':
                 """
                 Binary weighting scheme
@@ -89,10 +677,7 @@ class Retrieve:
                 # The number of terms that appear in both query and candidate document
                 query_doc_product = len(same_terms)
 
-                # The number of terms in the candidate document
-                doc_vec_size = len(self.terms_in_doc[doc])
-
-                similarity[doc] = query_doc_product / math.sqrt(doc_vec_size)
+                similarity[doc] = query_doc_product / self.doc_vec_size[doc]
 
             elif self.term_weighting == 'tf':
                 """
@@ -108,6 +693,21 @@ class Retrieve:
 
                 similarity[doc] = query_doc_product / self.doc_vec_size[doc]
 
+            elif self.term_weighting in ('bm25', 'pivoted'):
+                """
+                BM25 and pivoted normalisation weighting schemes
+
+                Term weight is the query weight times the dampened term frequency of the
+                candidate document, its length normalised by the saturation (BM25) or
+                the pivoted length factor (pivoted)
+                """
+
+                for term in same_terms:
+                    count = self.index[term][doc]
+                    query_doc_product += weights[term] * self.posting_tf(doc, count)
+
+                similarity[doc] = query_doc_product / self.doc_vec_size[doc]
+
             else:
                 """
                 TFIDF weighting scheme
@@ -120,29 +720,915 @@ class Retrieve:
                     # TFIDF in query * TFIDF in the candidate document
                     query_doc_product += query_tfidf[term] * self.term_tfidf_in_doc[doc][term]
 
-                for tfidf in self.term_tfidf_in_doc[doc].values():
-                    doc_vec_size += tfidf ** 2
+                similarity[doc] = query_doc_product / self.doc_vec_size[doc]
 
-                similarity[doc] = query_doc_product / math.sqrt(doc_vec_size)
+        self.query_stats = {'postings': sum(len(self.index[term]) for term in query
+                                            if term in self.index),
+                            'scored': len(candidate)}
 
-        # Sort documents by similarity scores in descending order
-        ranked_doc = sorted(similarity.items(), key=lambda x: x[1], reverse=True)
+        self.query_times['candidates'] = collected - start
+        self.query_times['scoring'] = time.perf_counter() - collected
 
-        return [x[0] for x in ranked_doc[:10]]
+        return similarity
 
-    def get_candidate(self, query):
+    def score_cursors(self, query):
         """
-        Get a list of candidate documents that are related to the query
+        Score documents one candidate at a time over cursors on the postings of the query
+        terms, for a mapped index without a forward index, its compressed postings decoded
+        block by block as the cursors move
 
-        :param query: The query to search for
-        :return: The list of documents that contain at least one same word with query
+        Candidates and scores are interleaved, timed as scoring
+
+        :param query: The query to process
+        :return: The similarity score of every document sharing a term with the query
         """
 
-        candidate_docs = set()
+        start = time.perf_counter()
 
-        # Get all documents that contain more than one term from query
-        for term in query:
-            if term in self.index:
-                candidate_docs.update(set(self.index[term].keys()))
+        binary = self.term_weighting == 'binary'
+        transform = self.term_weighting in ('bm25', 'pivoted')
+        weights = self.query_weights(query)
+        cursors = [self.cursor(term) for term in weights]
+        term_weights = list(weights.values())
+        similarity = {}
 
-        return candidate_docs
+        while cursors:
+            doc = min([cursor.doc for cursor in cursors])
+
+            if doc == END:
+                break
+
+            product = 0
+
+            for i, cursor in enumerate(cursors):
+                if cursor.doc == doc:
+                    if transform:
+                        product += term_weights[i] * self.posting_tf(doc, cursor.count())
+                    else:
+                        product += term_weights[i] * (1 if binary else cursor.count())
+                    cursor.next()
+
+            similarity[doc] = product / self.doc_vec_size[doc]
+
+        self.query_stats = {'postings': sum(cursor.touched for cursor in cursors),
+                            'scored': len(similarity)}
+        self.query_times['scoring'] = time.perf_counter() - start
+
+        return similarity
+
+    def score_maxscore(self, query, k):
+        """
+        Score documents at a time with MaxScore dynamic pruning
+
+        Query terms are ordered by the upper bound of their contribution. The terms whose
+        bounds add up to less than the score of the current k-th document are non-essential:
+        a document appearing only in them cannot enter the top k, so only the postings of the
+        essential terms produce candidates, and the non-essential postings are only probed,
+        by skipping, for those candidates whose score may still reach the top k
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The (doc id, score) pairs of the top k most relevant documents to the query
+        """
+
+        binary = self.term_weighting == 'binary'
+        transform = self.term_weighting in ('bm25', 'pivoted')
+        weights = self.query_weights(query)
+
+        # Query terms by ascending upper bound, with the running sum of the bounds, slightly
+        # inflated so that rounding never prunes a document reaching the threshold
+        terms = sorted(weights, key=lambda term: weights[term] * self.term_max_score[term])
+        cursors = [self.cursor(term) for term in terms]
+        term_weights = [weights[term] for term in terms]
+        bound_sum = []
+
+        for term in terms:
+            bound = weights[term] * self.term_max_score[term] * (1 + 1e-9)
+            bound_sum.append(bound + (bound_sum[-1] if bound_sum else 0))
+
+        # Min heap of the top k (score, -doc), its root is the document to beat
+        top = []
+        threshold = -END
+        first_essential = 0
+        scored = 0
+
+        while first_essential < len(terms):
+            doc = min([cursor.doc for cursor in cursors[first_essential:]])
+
+            if doc == END:
+                break
+
+            scored += 1
+            norm = self.doc_vec_size[doc]
+            product = 0
+
+            for i in range(first_essential, len(terms)):
+                cursor = cursors[i]
+                if cursor.doc == doc:
+                    if transform:
+                        product += term_weights[i] * self.posting_tf(doc, cursor.count())
+                    else:
+                        product += term_weights[i] * (1 if binary else cursor.count())
+                    cursor.next()
+
+            for i in range(first_essential - 1, -1, -1):
+                if product / norm + bound_sum[i] < threshold:
+                    break
+
+                cursor = cursors[i]
+                cursor.advance(doc)
+                if cursor.doc == doc:
+                    if transform:
+                        product += term_weights[i] * self.posting_tf(doc, cursor.count())
+                    else:
+                        product += term_weights[i] * (1 if binary else cursor.count())
+
+            entry = (product / norm, -doc)
+
+            if len(top) < k:
+                heapq.heappush(top, entry)
+            elif entry > top[0]:
+                heapq.heapreplace(top, entry)
+            else:
+                continue
+
+            if len(top) == k:
+                threshold = top[0][0]
+
+                while first_essential < len(terms) and bound_sum[first_essential] < threshold:
+                    first_essential += 1
+
+        self.query_stats = {'postings': sum(cursor.touched for cursor in cursors),
+                            'scored': scored}
+
+        return [(-doc, score) for score, doc in sorted(top, reverse=True)]
+
+    def phrase_ranked(self, phrase, k=10):
+        """
+        Retrieve the top k documents containing a phrase, scored by its terms as a query
+
+        The documents holding every term of the phrase are found from the postings first,
+        positions are only decoded for them, rarest term first, until a term rules the
+        document out
+
+        :param phrase: The (term, position) pairs of the phrase, as analyze_positions of the
+                       Preprocessor returns, only the differences of the positions matter
+        :param k: The number of documents to return
+        :return: The (doc id, score) pairs of the top k documents containing the phrase
+        """
+
+        if self.positions is None:
+            raise ValueError('phrase queries need a positional index')
+
+        self.query_times = {}
+
+        if self.idf_stale:
+            self.reweigh()
+
+        start = time.perf_counter()
+
+        # The offsets of each term in the phrase, a term may appear more than once
+        offsets = {}
+        for term, position in phrase:
+            offsets.setdefault(term, []).append(position)
+
+        if not offsets or any(term not in self.index for term in offsets):
+            self.query_stats = {'postings': 0, 'scored': 0, 'positions': 0}
+            return []
+
+        terms = sorted(offsets, key=lambda term: len(self.index[term]))
+
+        candidates = set(self.index[terms[0]])
+        for term in terms[1:]:
+            candidates.intersection_update(self.index[term])
+        candidates -= self.unpositioned
+
+        matched = []
+        decoded = 0
+
+        for doc in candidates:
+            # The positions the phrase can start at in the document
+            starts = None
+
+            for term in terms:
+                found = self.positions.positions(term, doc, self.index[term][doc])
+                decoded += 1
+
+                for offset in offsets[term]:
+                    shifted = {position - offset for position in found}
+                    starts = shifted if starts is None else starts & shifted
+
+                if not starts:
+                    break
+            else:
+                matched.append(doc)
+
+        walked = time.perf_counter()
+        similarity = self.score_docs({term: len(found) for term, found in offsets.items()},
+                                     matched)
+
+        scored = time.perf_counter()
+        ranked_doc = self.top_k_scores(similarity, k)
+
+        self.query_stats = {'postings': sum(len(self.index[term]) for term in terms),
+                            'scored': len(matched), 'positions': decoded}
+        self.query_times = {'candidates': walked - start, 'scoring': scored - walked,
+                            'top_k': time.perf_counter() - scored}
+
+        return ranked_doc
+
+    def feedback_ranked(self, query, k=10, docs=FEEDBACK_DOCS, terms=FEEDBACK_TERMS,
+                        budget=FEEDBACK_POSTINGS, alpha=ROCCHIO_ALPHA, beta=ROCCHIO_BETA):
+        """
+        Retrieve the top k documents of a query expanded with Rocchio pseudo relevance
+        feedback
+
+        The top documents of the query are taken as relevant and the query vector is moved
+        towards the centroid of their normalised TFIDF vectors, adding the strongest terms
+        of the centroid that are not in the query, as long as their postings fit in the
+        budget. The scores are linear in the query weights, so the second pass adds the
+        postings of the new terms to the first pass scores times alpha instead of scoring
+        the whole query again. Binary query weights ignore alpha and beta, so binary
+        weighting has no feedback
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :param docs: The number of top documents taken as relevant
+        :param terms: The largest number of terms added to the query
+        :param budget: The most postings the added terms may have, relative to the postings
+                       of the query terms
+        :param alpha: The weight of the original query
+        :param beta: The weight of the centroid of the feedback documents
+        :return: The (doc id, score) pairs of the top k documents of the expanded query
+        """
+
+        if self.term_weighting == 'binary':
+            raise ValueError('pseudo relevance feedback needs weighted query terms, not binary')
+
+        self.query_times = {}
+
+        if self.idf_stale:
+            self.reweigh()
+
+        # The first pass scores every document, MaxScore would only keep the top k
+        scores = self.score_postings(query)
+        postings = self.query_stats['postings']
+
+        start = time.perf_counter()
+
+        # The first pass top documents, in any order among equal scores, the feedback
+        # documents and the k-th score
+        first = heapq.nlargest(max(docs, k), scores, key=scores.get)
+        feedback = first[:docs]
+        threshold = scores[first[k - 1]] if len(first) >= k else -END
+
+        # The centroid of the unit TFIDF vectors of the feedback documents, over the terms
+        # that are not in the query
+        centroid = {}
+        vectors = self.tfidf_vectors()
+        for doc in feedback:
+            inverse = 1 / (self.doc_norm['tfidf'][doc] or 1)
+            for term, value in vectors[doc].items():
+                centroid[term] = centroid.get(term, 0) + value * inverse
+
+        for term in query:
+            centroid.pop(term, None)
+
+        # Against the unit query vector, in the counts query_weights takes: the TFIDF of a
+        # query term is its count times its IDF
+        query_norm = math.sqrt(sum((count * self.idf[term]) ** 2
+                                   for term, count in query.items() if term in self.index))
+        added = {}
+        allowed = budget * postings
+
+        for term in sorted(centroid, key=centroid.get, reverse=True):
+            value = centroid[term]
+            if len(added) == terms or value <= 0:
+                break
+
+            if len(self.index[term]) <= allowed:
+                allowed -= len(self.index[term])
+                added[term] = beta * query_norm * value / len(feedback) / self.idf[term]
+
+        # The score each added term brings to the documents it appears in
+        norms = self.doc_vec_size
+        change = {}
+
+        for term, weight in self.query_weights(added).items():
+            postings += len(self.index[term])
+
+            if self.term_weighting in ('tf', 'tfidf'):
+                for doc, count in self.index[term].items():
+                    change[doc] = change.get(doc, 0) + weight * count / norms[doc]
+            else:
+                for doc, count in self.index[term].items():
+                    change[doc] = (change.get(doc, 0) +
+                                   weight * self.posting_tf(doc, count) / norms[doc])
+
+        # The added terms only raise scores, so a document they do not appear in can only
+        # be in the top k if it already was, or tied with the k-th
+        if sum(score == threshold for score in scores.values()) == \
+                sum(scores[doc] == threshold for doc in first[:k]):
+            candidates = {doc: alpha * scores[doc] for doc in first[:k]}
+        else:
+            candidates = {doc: alpha * score for doc, score in scores.items()
+                          if score >= threshold}
+
+        for doc, score in change.items():
+            candidates[doc] = alpha * scores.get(doc, 0) + score
+
+        scored = time.perf_counter()
+        ranked_doc = self.top_k_scores(candidates, k)
+
+        self.query_stats = {'postings': postings, 'scored': len(scores) + len(change),
+                            'expansion': len(added)}
+        self.query_times['scoring'] += scored - start
+        self.query_times['top_k'] = time.perf_counter() - scored
+
+        return ranked_doc
+
+    def score_docs(self, query, docs):
+        """
+        Score given documents against a query one at a time
+
+        :param query: The query to process
+        :param docs: The doc ids
+        :return: The similarity score of each document, 0 for those without a query term
+        """
+
+        # In ascending doc id, so that cursors over compressed postings only move forward
+        docs = sorted(docs)
+        products = dict.fromkeys(docs, 0)
+
+        for term, weight in self.query_weights(query).items():
+            postings = self.index[term]
+
+            if hasattr(postings, 'cursor'):
+                cursor = postings.cursor()
+                for doc in docs:
+                    cursor.advance(doc)
+                    if cursor.doc == doc:
+                        products[doc] += weight * self.posting_tf(doc, cursor.count())
+            else:
+                for doc in docs:
+                    count = postings.get(doc)
+                    if count:
+                        products[doc] += weight * self.posting_tf(doc, count)
+
+        return {doc: product / self.doc_vec_size[doc] for doc, product in products.items()}
+
+    def boolean_cursor(self, expression):
+        """
+        Get a cursor over the documents matching a Boolean query, its conjunctions
+        intersecting the postings from the shortest
+
+        The cursors of a conjunction and of its negations consume each other directly: the
+        documents of the leading cursor are looked up in the other postings when they are
+        in memory, and skipped to with their cursors otherwise (compressed or mapped
+        postings, nested expressions), without building any list of documents
+
+        :param expression: The expression tree, as parse_boolean returns
+        :return: The cursor and an upper bound of the number of documents it visits
+        """
+
+        op = expression[0]
+
+        if op == 'term':
+            if expression[1] not in self.index:
+                return PostingsCursor([], {}), 0
+            return self.cursor(expression[1]), len(self.index[expression[1]])
+
+        if op == 'or':
+            children = [self.boolean_cursor(child) for child in expression[1]]
+            return (DisjunctionCursor([cursor for cursor, _ in children]),
+                    min(sum(size for _, size in children), self.total_doc))
+
+        operands = [expression] if op == 'not' else expression[1]
+        children = [self.boolean_cursor(child) for child in operands if child[0] != 'not']
+
+        if not children:
+            # Only negations, the matches are taken out of the whole collection
+            children.append((PostingsCursor(sorted(self.doc_len), self.doc_len), self.total_doc))
+
+        children.sort(key=lambda child: child[1])
+        size = children[0][1]
+
+        if len(children) == 1:
+            cursor = children[0][0]
+        else:
+            cursor = ConjunctionCursor([cursor for cursor, _ in children])
+
+        for child in operands:
+            if child[0] == 'not':
+                cursor = ExclusionCursor(cursor, self.boolean_cursor(child[1])[0])
+
+        return cursor, size
+
+    def boolean_docs(self, expression):
+        """
+        Find the documents matching a Boolean query
+
+        :param expression: The expression tree, as parse_boolean returns
+        :return: The doc ids in ascending order
+        """
+
+        cursor, _ = self.boolean_cursor(expression)
+
+        matched = []
+        while cursor.doc != END:
+            matched.append(cursor.doc)
+            cursor.next()
+
+        self.query_stats = {'postings': cursor.touched, 'scored': len(matched)}
+
+        return matched
+
+    def boolean_ranked(self, expression, k=10, query=None):
+        """
+        Retrieve the top k documents matching a Boolean query
+
+        :param expression: The expression tree, as parse_boolean returns, None matches no
+                           document
+        :param k: The number of documents to return
+        :param query: The query ranking the matching documents under the weighting scheme,
+                      by default the terms of the Boolean query outside a NOT
+        :return: The (doc id, score) pairs of the top k matching documents
+        """
+
+        self.query_times = {}
+
+        if self.idf_stale:
+            self.reweigh()
+
+        if expression is None:
+            self.query_stats = {'postings': 0, 'scored': 0}
+            return []
+
+        if query is None:
+            query = {}
+            for term in positive_terms(expression):
+                query[term] = query.get(term, 0) + 1
+
+        start = time.perf_counter()
+        matched = self.boolean_docs(expression)
+
+        walked = time.perf_counter()
+        similarity = self.score_docs(query, matched)
+
+        scored = time.perf_counter()
+        ranked_doc = self.top_k_scores(similarity, k)
+
+        self.query_times = {'candidates': walked - start, 'scoring': scored - walked,
+                            'top_k': time.perf_counter() - scored}
+
+        return ranked_doc
+
+    def proximity_ranked(self, query, k=10, depth=PROXIMITY_DEPTH, weight=PROXIMITY_WEIGHT):
+        """
+        Retrieve the top k documents of a query, reranking the top documents by how close
+        together the query terms appear in them
+
+        Positions are only decoded for the top depth documents by similarity score, and only
+        for the query terms each of them holds
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :param depth: The number of top documents to rerank
+        :param weight: How much the proximity of the query terms raises the scores
+        :return: The (doc id, score) pairs of the top k documents after reranking
+        """
+
+        if self.positions is None:
+            raise ValueError('proximity queries need a positional index')
+
+        ranked_doc = self.ranked(query, max(k, depth))
+
+        start = time.perf_counter()
+        terms = [term for term in query if term in self.index]
+        similarity = {}
+        decoded = 0
+
+        for doc, score in ranked_doc:
+            # The positions of a document added since the index was built are unknown, those
+            # of an updated one are stale
+            if doc in self.unpositioned:
+                similarity[doc] = score
+                continue
+
+            found = [self.positions.positions(term, doc, self.index[term][doc])
+                     for term in terms if doc in self.index[term]]
+
+            if len(found) < 2:
+                similarity[doc] = score
+                continue
+
+            decoded += len(found)
+            similarity[doc] = score * (1 + weight * term_proximity(found))
+
+        self.query_stats['positions'] = decoded
+        self.query_times['scoring'] += time.perf_counter() - start
+
+        return self.top_k_scores(similarity, k)
+
+    def cursor(self, term):
+        """
+        Get a cursor over the postings of a term
+
+        :param term: The term, it must appear in the index
+        :return: The cursor positioned on the first posting
+        """
+
+        postings = self.index[term]
+
+        if hasattr(postings, 'cursor'):
+            return postings.cursor()
+
+        return PostingsCursor(self.sorted_docs(term), postings)
+
+    def sorted_docs(self, term):
+        """
+        Get the doc ids of a term in ascending order, sorting them on first use
+
+        :param term: The term, it must appear in the index
+        :return: The list of doc ids
+        """
+
+        if term not in self.sorted_postings:
+            self.sorted_postings[term] = sorted(self.index[term])
+
+        return self.sorted_postings[term]
+
+    def get_candidate(self, query):
+        """
+        Get a list of candidate documents that are related to the query
+
+        :param query: The query to search for
+        :return: The list of documents that contain at least one same word with query
+        """
+
+        candidate_docs = set()
+
+        # Get all documents that contain more than one term from query, straight from the
+        # postings without copying them
+        for term in query:
+            if term in self.index:
+                candidate_docs.update(self.index[term])
+
+        return candidate_docs
+
+
+def min_distance(first, second):
+    """
+    Get the smallest distance between the positions of two terms, merging them in order
+
+    :param first: The positions of a term in ascending order
+    :param second: The positions of another term in ascending order
+    :return: The smallest absolute difference of two positions
+    """
+
+    i = j = 0
+    distance = END
+
+    while i < len(first) and j < len(second):
+        if first[i] < second[j]:
+            distance = min(distance, second[j] - first[i])
+            i += 1
+        else:
+            distance = min(distance, first[i] - second[j])
+            j += 1
+
+    return distance
+
+
+def term_proximity(found):
+    """
+    Get the proximity of the terms of a query in a document, the mean over the pairs of
+    terms of the inverse of their smallest distance
+
+    :param found: The positions of each query term in the document, at least two
+    :return: The proximity, 1 when every pair of terms appears side by side
+    """
+
+    pairs = [1 / min_distance(first, second)
+             for i, first in enumerate(found) for second in found[i + 1:]]
+
+    return sum(pairs) / len(pairs)
+
+
+class PostingsCursor:
+    """
+    The class for a forward only cursor over the postings of a term
+    """
+
+    def __init__(self, docs, counts):
+        """
+        Create new cursor positioned on the first posting
+
+        :param docs: The doc ids of the postings in ascending order
+        :param counts: The dictionary of the term count in each document
+        """
+
+        self.docs = docs
+        self.counts = counts
+        self.position = 0
+        self.touched = 0
+        self.doc = END
+        self._move(0)
+
+    def _move(self, position):
+        """
+        Move the cursor to a position of the postings
+
+        :param position: The new position
+        """
+
+        self.position = position
+
+        if position < len(self.docs):
+            self.doc = self.docs[position]
+            self.touched += 1
+        else:
+            self.doc = END
+
+    def next(self):
+        """
+        Move the cursor to the next posting
+        """
+
+        self._move(self.position + 1)
+
+    def advance(self, target):
+        """
+        Skip to the first posting whose doc id is not smaller than the target
+
+        :param target: The doc id to skip to
+        """
+
+        if self.doc < target:
+            self._move(bisect.bisect_left(self.docs, target, self.position + 1))
+
+    def count(self):
+        """
+        Get the term count in the current document
+
+        :return: The term count
+        """
+
+        return self.counts[self.doc]
+
+    def lookup(self):
+        """
+        Get the membership test of the postings, for the cursors that look documents up in
+        them instead of skipping to them
+
+        :return: The function checking whether a document has a posting, None when the
+                 postings are mapped and only skipping is cheap
+        """
+
+        return self.counts.__contains__ if isinstance(self.counts, dict) else None
+
+    def remaining(self):
+        """
+        Hand over the documents from the current one on, the cursor is left at the end
+
+        :return: The iterator over the doc ids in ascending order
+        """
+
+        docs = itertools.islice(self.docs, self.position, None)
+
+        # As if walked to the end
+        self.touched += max(len(self.docs) - self.position - 1, 0)
+        self._move(len(self.docs))
+
+        return docs
+
+
+class ConjunctionCursor:
+    """
+    The class for a cursor over the documents in every one of several postings, the first
+    (shortest) postings lead and the others skip to its documents, or when they are all in
+    memory the documents of the lead are filtered by looking them up in the others
+    """
+
+    def __init__(self, cursors):
+        """
+        Create new cursor positioned on the first common document
+
+        :param cursors: The cursors, the one with the fewest documents first
+        """
+
+        self.cursors = cursors
+        self.doc = END
+        self.matches = None
+
+        lookups = [cursor.lookup() if isinstance(cursor, PostingsCursor) else None
+                   for cursor in cursors[1:]]
+
+        if None in lookups:
+            self._align(cursors[0].doc)
+        else:
+            self.matches = remaining(cursors[0])
+            for lookup in lookups:
+                self.matches = filter(lookup, self.matches)
+            self.doc = next(self.matches, END)
+
+    @property
+    def touched(self):
+        return sum(cursor.touched for cursor in self.cursors)
+
+    def _align(self, target):
+        """
+        Move every cursor to the first common document not smaller than the target
+
+        :param target: The doc id to start from
+        """
+
+        lead = self.cursors[0]
+
+        while True:
+            lead.advance(target)
+            doc = lead.doc
+
+            if doc == END:
+                self.doc = END
+                return
+
+            for cursor in self.cursors[1:]:
+                cursor.advance(doc)
+                if cursor.doc != doc:
+                    target = cursor.doc
+                    break
+            else:
+                self.doc = doc
+                return
+
+    def next(self):
+        """
+        Move the cursor to the next common document
+        """
+
+        if self.matches is not None:
+            self.doc = next(self.matches, END)
+        else:
+            self.cursors[0].next()
+            self._align(self.cursors[0].doc)
+
+    def advance(self, target):
+        """
+        Skip to the first common document not smaller than the target
+
+        :param target: The doc id to skip to
+        """
+
+        if self.matches is not None:
+            while self.doc < target:
+                self.doc = next(self.matches, END)
+        elif self.doc < target:
+            self._align(target)
+
+
+class DisjunctionCursor:
+    """
+    The class for a cursor over the documents in any of several postings
+    """
+
+    def __init__(self, cursors):
+        """
+        Create new cursor positioned on the first document
+
+        :param cursors: The cursors
+        """
+
+        self.cursors = cursors
+        self.doc = min(cursor.doc for cursor in cursors)
+
+    @property
+    def touched(self):
+        return sum(cursor.touched for cursor in self.cursors)
+
+    def next(self):
+        """
+        Move the cursor to the next document
+        """
+
+        for cursor in self.cursors:
+            if cursor.doc == self.doc:
+                cursor.next()
+
+        self.doc = min(cursor.doc for cursor in self.cursors)
+
+    def advance(self, target):
+        """
+        Skip to the first document not smaller than the target
+
+        :param target: The doc id to skip to
+        """
+
+        if self.doc < target:
+            for cursor in self.cursors:
+                cursor.advance(target)
+
+            self.doc = min(cursor.doc for cursor in self.cursors)
+
+
+class ExclusionCursor:
+    """
+    The class for a cursor over the documents of a cursor that are not in another, the
+    excluded cursor only skips to the documents of the included one, or when it is in
+    memory the included documents are filtered by looking them up in it
+    """
+
+    def __init__(self, included, excluded):
+        """
+        Create new cursor positioned on the first document
+
+        :param included: The cursor of the documents to keep
+        :param excluded: The cursor of the documents to leave out
+        """
+
+        self.included = included
+        self.excluded = excluded
+        self.doc = END
+        self.matches = None
+
+        lookup = excluded.lookup() if isinstance(excluded, PostingsCursor) else None
+
+        if lookup is None:
+            self._skip()
+        else:
+            self.matches = itertools.filterfalse(lookup, remaining(included))
+            self.doc = next(self.matches, END)
+
+    @property
+    def touched(self):
+        return self.included.touched + self.excluded.touched
+
+    def _skip(self):
+        """
+        Move the included cursor past the excluded documents
+        """
+
+        while self.included.doc != END:
+            self.excluded.advance(self.included.doc)
+            if self.excluded.doc != self.included.doc:
+                break
+            self.included.next()
+
+        self.doc = self.included.doc
+
+    def next(self):
+        """
+        Move the cursor to the next document
+        """
+
+        if self.matches is not None:
+            self.doc = next(self.matches, END)
+        else:
+            self.included.next()
+            self._skip()
+
+    def advance(self, target):
+        """
+        Skip to the first document not smaller than the target
+
+        :param target: The doc id to skip to
+        """
+
+        if self.matches is not None:
+            while self.doc < target:
+                self.doc = next(self.matches, END)
+        elif self.doc < target:
+            self.included.advance(target)
+            self._skip()
+
+
+def remaining(cursor):
+    """
+    Hand over the documents of a cursor from the current one on, to a cursor that filters
+    them by looking them up in other postings
+
+    :param cursor: The cursor, only the iterator moves it from now on
+    :return: The iterator over the doc ids in ascending order
+    """
+
+    if isinstance(cursor, PostingsCursor):
+        return cursor.remaining()
+
+    if getattr(cursor, 'matches', None) is not None:
+        # The cursor filters documents itself, its filters are taken over
+        return itertools.chain([cursor.doc] if cursor.doc != END else [], cursor.matches)
+
+    return walk(cursor)
+
+
+def walk(cursor):
+    """
+    Walk a cursor to the end
+
+    :param cursor: The cursor
+    :return: The generator of its doc ids in ascending order
+    """
+
+    while cursor.doc != END:
+        yield cursor.doc
+        cursor.next()
@@ -0,0 +1,95 @@
+"""
+The positional index of Document Retrieval System
+
+The positions of a term in a document are its token offsets in the document text, counted
+before stop words are removed so that phrases keep their gaps. A positions file has one
+line per term, in the order of the index file, followed by doc:positions postings in
+ascending doc id, the positions delta coded and comma separated. In memory, the positions
+of every posting of a term are variable byte encoded into one byte string and decoded only
+for the documents a query asks about
+"""
+
+import re
+from postings_codec import encode_varbyte, decode_varbyte
+
+
+def delta_encode(positions):
+    """
+    Delta code ascending positions
+
+    :param positions: The positions in ascending order
+    :return: The first position followed by the gaps between positions, comma separated
+    """
+
+    previous = 0
+    gaps = []
+
+    for position in positions:
+        gaps.append(position - previous)
+        previous = position
+
+    return ','.join(map(str, gaps))
+
+
+class PositionalIndex:
+    """
+    The class for the positions of every posting of an index
+    """
+
+    def __init__(self, positions_file):
+        """
+        Load a positions file, keeping the gaps variable byte encoded
+
+        :param positions_file: The positions file
+        """
+
+        # The encoded gaps of each term, and where the gaps of each document start
+        self.data = {}
+        self.start = {}
+
+        docid_gaps_re = re.compile(r'(\d+):([\d,]+)')
+
+        with open(positions_file, 'r') as f:
+            for line in f:
+                term, postings = line.split(' ', 1)
+                data = bytearray()
+                start = {}
+
+                for doc, gaps in docid_gaps_re.findall(postings):
+                    start[int(doc)] = len(data)
+                    encode_varbyte(map(int, gaps.split(',')), data)
+
+                self.data[term] = bytes(data)
+                self.start[term] = start
+
+    def __contains__(self, term):
+        return term in self.data
+
+    def positions(self, term, doc, count):
+        """
+        Decode the positions of a term in a document
+
+        :param term: The term
+        :param doc: The doc id, the term must appear in it
+        :param count: The term count in the document, the number of positions
+        :return: The positions in ascending order
+        """
+
+        gaps, _ = decode_varbyte(self.data[term], self.start[term][doc], count)
+
+        position = 0
+        positions = []
+        for gap in gaps:
+            position += gap
+            positions.append(position)
+
+        return positions
+
+    def size(self):
+        """
+        Get the size of the encoded positions
+
+        :return: The number of bytes of the encoded gaps
+        """
+
+        return sum(len(data) for data in self.data.values())
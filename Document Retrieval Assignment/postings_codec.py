@@ -0,0 +1,290 @@
+"""
+The postings codec of Document Retrieval System
+
+The postings of a term are cut into blocks of BLOCK_SIZE postings. A block stores the
+gaps between its doc ids (the first one relative to the last doc id of the previous
+block) followed by the term counts minus one, all variable byte encoded. The skip data
+of a block is its last doc id and the position of its bytes, so a doc id can be found
+by decoding a single block
+"""
+
+import bisect, math
+from collections.abc import Mapping, ItemsView
+
+# The number of postings in every block but the last one of a term
+BLOCK_SIZE = 128
+
+# Cursor position past the end of a postings list
+END = math.inf
+
+
+def encode_varbyte(values, out):
+    """
+    Variable byte encode non negative integers, 7 bits per byte with the most significant
+    group first and the high bit set on the last byte of each integer
+
+    :param values: The integers to encode
+    :param out: The bytearray to append the encoded bytes to
+    """
+
+    for value in values:
+        groups = [value & 0x7f | 0x80]
+        value >>= 7
+
+        while value:
+            groups.append(value & 0x7f)
+            value >>= 7
+
+        out.extend(reversed(groups))
+
+
+def decode_varbyte(data, position, count):
+    """
+    Decode variable byte encoded integers
+
+    :param data: The encoded bytes
+    :param position: The position of the first byte to decode
+    :param count: The number of integers to decode
+    :return: The decoded integers and the position after the last decoded byte
+    """
+
+    values = []
+    value = 0
+
+    while len(values) < count:
+        byte = data[position]
+        position += 1
+
+        if byte & 0x80:
+            values.append(value << 7 | byte & 0x7f)
+            value = 0
+        else:
+            value = value << 7 | byte
+
+    return values, position
+
+
+def encode_postings(docs, counts, out):
+    """
+    Encode the postings of a term into blocks
+
+    :param docs: The doc ids in ascending order
+    :param counts: The term count in each document
+    :param out: The bytearray to append the blocks to
+    :return: The skip data, a list of (last doc id, byte position) for every block
+    """
+
+    skips = []
+    previous = 0
+
+    for start in range(0, len(docs), BLOCK_SIZE):
+        block_docs = docs[start:start + BLOCK_SIZE]
+        skips.append((block_docs[-1], len(out)))
+
+        gaps = []
+        for doc in block_docs:
+            gaps.append(doc - previous)
+            previous = doc
+
+        encode_varbyte(gaps, out)
+        encode_varbyte([count - 1 for count in counts[start:start + BLOCK_SIZE]], out)
+
+    return skips
+
+
+class CompressedPostings(Mapping):
+    """
+    The class for the compressed postings of a term, a read only mapping of each doc id
+    to the term count in that document, decoding only the blocks it needs
+    """
+
+    def __init__(self, data, length, block_last, block_position):
+        """
+        Create new postings over encoded blocks
+
+        :param data: The encoded bytes of the blocks
+        :param length: The number of postings
+        :param block_last: The last doc id of each block
+        :param block_position: The position of each block in data
+        """
+
+        self.data = data
+        self.length = length
+        self.block_last = block_last
+        self.block_position = block_position
+
+        # The most recently decoded block, lookups tend to hit the same block again
+        self.cached_block = None
+        self.cached_postings = None
+
+    def block_length(self, block):
+        """
+        Get the number of postings in a block
+
+        :param block: The block number
+        :return: The number of postings
+        """
+
+        return min(BLOCK_SIZE, self.length - block * BLOCK_SIZE)
+
+    def block(self, block):
+        """
+        Decode a block
+
+        :param block: The block number
+        :return: The doc ids and the term counts of the block
+        """
+
+        if block != self.cached_block:
+            length = self.block_length(block)
+            gaps, position = decode_varbyte(self.data, self.block_position[block], length)
+            counts, _ = decode_varbyte(self.data, position, length)
+
+            doc = self.block_last[block - 1] if block > 0 else 0
+            docs = []
+            for gap in gaps:
+                doc += gap
+                docs.append(doc)
+
+            self.cached_block = block
+            self.cached_postings = (docs, [count + 1 for count in counts])
+
+        return self.cached_postings
+
+    def __getitem__(self, doc):
+        block = bisect.bisect_left(self.block_last, doc)
+
+        if block < len(self.block_last):
+            docs, counts = self.block(block)
+            i = bisect.bisect_left(docs, doc)
+
+            if i < len(docs) and docs[i] == doc:
+                return counts[i]
+
+        raise KeyError(doc)
+
+    def __iter__(self):
+        for block in range(len(self.block_last)):
+            yield from self.block(block)[0]
+
+    def __len__(self):
+        return self.length
+
+    def items(self):
+        return CompressedItems(self)
+
+    def cursor(self):
+        """
+        Get a cursor over the postings
+
+        :return: The cursor positioned on the first posting
+        """
+
+        return BlockPostingsCursor(self)
+
+
+class CompressedItems(ItemsView):
+    """
+    The class for the (doc id, count) pairs of compressed postings, decoded block by block
+    """
+
+    def __iter__(self):
+        postings = self._mapping
+
+        for block in range(len(postings.block_last)):
+            yield from zip(*postings.block(block))
+
+
+class BlockPostingsCursor:
+    """
+    The class for a forward only cursor over compressed postings, using the skip data to
+    jump over the blocks that cannot contain the target of an advance
+    """
+
+    def __init__(self, postings):
+        """
+        Create new cursor positioned on the first posting
+
+        :param postings: The compressed postings
+        """
+
+        self.postings = postings
+        self.block = 0
+        self.docs = []
+        self.counts = []
+        self.position = 0
+        self.touched = 0
+        self.doc = END
+
+        if postings.block_last:
+            self._decode(0)
+            self._move(0)
+
+    def _decode(self, block):
+        """
+        Make a block the current block of the cursor
+
+        :param block: The block number
+        """
+
+        self.block = block
+        self.docs, self.counts = self.postings.block(block)
+
+    def _move(self, position):
+        """
+        Move the cursor to a position of the current block, or to the start of the next
+
+        :param position: The new position in the current block
+        """
+
+        self.position = position
+
+        if position < len(self.docs):
+            self.doc = self.docs[position]
+            self.touched += 1
+        elif self.block + 1 < len(self.postings.block_last):
+            self._decode(self.block + 1)
+            self._move(0)
+        else:
+            self.doc = END
+
+    def next(self):
+        """
+        Move the cursor to the next posting
+        """
+
+        self._move(self.position + 1)
+
+    def advance(self, target):
+        """
+        Skip to the first posting whose doc id is not smaller than the target
+
+        :param target: The doc id to skip to
+        """
+
+        if self.doc >= target:
+            return
+
+        start = self.position + 1
+
+        if target > self.docs[-1]:
+            block = bisect.bisect_left(self.postings.block_last, target, self.block + 1)
+
+            if block == len(self.postings.block_last):
+                self.position = len(self.docs)
+                self.doc = END
+                return
+
+            self._decode(block)
+            start = 0
+
+        self._move(bisect.bisect_left(self.docs, target, start))
+
+    def count(self):
+        """
+        Get the term count in the current document
+
+        :return: The term count
+        """
+
+        return self.counts[self.position]
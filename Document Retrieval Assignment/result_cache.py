@@ -0,0 +1,174 @@
+"""
+The query result cache of Document Retrieval System
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    The class for a bounded LRU cache of ranked results, shared by any number of cached
+    retrievers and safe to use from several threads
+    """
+
+    def __init__(self, capacity=1024):
+        """
+        Create new empty cache
+
+        :param capacity: The largest number of results kept
+        """
+
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        """
+        Look up the results of a query
+
+        :param key: The key of the query
+        :param version: The current version of the index the results come from
+        :return: The results, or None if they are not cached for this version
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[0] != version:
+                # The index changed since the results were cached
+                del self.entries[key]
+                self.invalidations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def put(self, key, version, results):
+        """
+        Cache the results of a query, evicting the least recently used ones if full
+
+        :param key: The key of the query
+        :param version: The version of the index the results come from
+        :param results: The results
+        """
+
+        with self.lock:
+            self.entries[key] = (version, results)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Get the counters of the cache
+
+        :return: The dictionary of the hits, misses, evictions, invalidations and size
+        """
+
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'size': len(self.entries)}
+
+
+class CachedRetrieve:
+    """
+    The class for a retriever answering repeated queries from a result cache
+    """
+
+    def __init__(self, retrieve, cache, name=None):
+        """
+        Create new cached retriever
+
+        :param retrieve: The retriever, Retrieve, SegmentedIndex or SparseRetrieve
+        :param cache: The result cache, it may be shared with other retrievers
+        :param name: The name of the retriever in the cache keys, by default its id
+        """
+
+        self.retrieve = retrieve
+        self.cache = cache
+        self.name = id(retrieve) if name is None else name
+        self.term_weighting = retrieve.term_weighting
+        self.query_times = {}
+
+    def key(self, query, k):
+        """
+        Get the cache key of a query, the same for any order of its terms
+
+        :param query: The query
+        :param k: The number of documents to return
+        :return: The key
+        """
+
+        return self.name, self.term_weighting, k, tuple(sorted(query.items()))
+
+    def forQuery(self, query, k=10):
+        """
+        Method performing retrieval for specified query, from the cache when possible
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The top k most relevant documents to the query
+        """
+
+        key = self.key(query, k)
+        version = getattr(self.retrieve, 'version', 0)
+        results = self.cache.get(key, version)
+
+        if results is None:
+            results = self.retrieve.forQuery(query, k)
+            self.query_times = getattr(self.retrieve, 'query_times', self.query_times)
+            self.cache.put(key, version, list(results))
+        else:
+            self.query_times = {}
+
+        return list(results)
+
+    def forQueries(self, queries, k=10):
+        """
+        Method performing retrieval for a list of queries, the ones missing from the cache
+        retrieved in a single batch when the retriever scores batches
+
+        :param queries: The queries to process
+        :param k: The number of documents to return for each query
+        :return: The top k most relevant documents to each query
+        """
+
+        keys = [self.key(query, k) for query in queries]
+        version = getattr(self.retrieve, 'version', 0)
+        cached = [self.cache.get(key, version) for key in keys]
+
+        # The queries to retrieve, a query repeated in the batch only once
+        missed = {}
+        for key, query, results in zip(keys, queries, cached):
+            if results is None:
+                missed.setdefault(key, query)
+
+        retrieved = {}
+        if missed:
+            if hasattr(self.retrieve, 'forQueries'):
+                batch = self.retrieve.forQueries(list(missed.values()), k)
+            else:
+                batch = [self.retrieve.forQuery(query, k) for query in missed.values()]
+
+            for key, results in zip(missed, batch):
+                retrieved[key] = list(results)
+                self.cache.put(key, version, retrieved[key])
+
+        self.query_times = {}
+
+        return [list(retrieved[key] if results is None else results)
+                for key, results in zip(keys, cached)]
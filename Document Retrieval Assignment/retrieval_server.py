@@ -0,0 +1,383 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: loads the index variants once and answers queries over
+    HTTP until interrupted, connections are handled by asyncio
+    and queries are scored by a pool of worker processes
+    POST /search with a JSON body
+        {"query": TEXT, "variant": NAME, "weighting": LABEL, "k": INT,
+         "filter": BOOLEAN}
+    where TEXT is raw text, or term:count pairs as in the
+    queries_*.txt files (a leading query id is ignored), and
+    variant, weighting and k are optional. BOOLEAN, optional,
+    restricts the results to the documents matching a Boolean
+    query of words with AND, OR, NOT and parentheses (see
+    boolean_query.py), TEXT may then be empty to rank them by the
+    words of the filter. The reply is
+        {"variant": NAME, "weighting": LABEL,
+         "results": [{"doc": INT, "score": FLOAT}, ...]}
+    GET /status lists the loaded variants and weighting schemes
+OPTIONS:
+    -h : print this help message
+    -v NAMES : load the comma separated variants NAMES, e.g.
+               withstoplist_withstemming (default: all four)
+    -w LABELS : build the comma separated weighting schemes LABELS
+                (LABEL in {binary, tf, tfidf, bm25, pivoted},
+                default: all five)
+    -m : use the memory mapped binary indexes (index_*.bin)
+    -s FILE : use stoplist file FILE for raw text queries
+              (default: ../Lab Exercises/stop_list.txt)
+    -a HOST : listen on address HOST (default: 127.0.0.1)
+    -p PORT : listen on port PORT (default: 8000)
+    -j INT : score the queries across INT worker processes
+             (default: the number of CPUs)
+    -c INT : cache the results of up to INT distinct queries
+             (per worker process)
+------------------------------------------------------------\
+"""
+
+import sys, getopt, os, re, json, asyncio, concurrent.futures, multiprocessing
+from ir_engine import IndexLoader
+from indexer import VARIANTS, Preprocessor
+from my_retriever import Retrieve, SCHEMES
+from result_cache import ResultCache
+from boolean_query import parse_boolean
+
+# The largest number of stems each worker keeps for raw text queries
+STEM_CACHE_SIZE = 100000
+
+# The reason phrase of each status code the server replies with
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+TERM_COUNT_RE = re.compile(r'^(\w+):(\d+)$')
+
+# The server state, set before the worker processes are forked so that they inherit the
+# loaded indexes copy-on-write
+server_state = None
+
+
+class ServerOptions:
+    def __init__(self, opts):
+        variants = [name for name, _, _ in VARIANTS]
+        self.variants = opts['-v'].split(',') if '-v' in opts else variants
+        self.schemes = opts['-w'].split(',') if '-w' in opts else SCHEMES
+        self.suffix = '.bin' if '-m' in opts else '.txt'
+        self.stop_list_file = opts.get('-s', os.path.join('..', 'Lab Exercises', 'stop_list.txt'))
+        self.host = opts.get('-a', '127.0.0.1')
+        self.port = int(opts.get('-p', 8000))
+        self.jobs = int(opts.get('-j', os.cpu_count() or 1))
+        self.cache_size = int(opts['-c']) if '-c' in opts else None
+
+        for name in self.variants:
+            if name not in variants:
+                raise ValueError('unknown variant %s, must be one of: %s'
+                                 % (name, ', '.join(variants)))
+
+        for scheme in self.schemes:
+            if scheme not in SCHEMES:
+                raise ValueError('unknown weighting scheme %s, must be one of: %s'
+                                 % (scheme, ', '.join(SCHEMES)))
+
+
+class ServerState:
+    """
+    The class for the indexes and retrievers loaded by the server
+    """
+
+    def __init__(self, config):
+        """
+        Load every variant and build a retriever for each weighting scheme
+
+        :param config: The server options
+        """
+
+        self.variants = config.variants
+        self.schemes = config.schemes
+        self.preprocessor = Preprocessor(config.stop_list_file, STEM_CACHE_SIZE)
+        self.retrievers = {}
+
+        for name in config.variants:
+            index = IndexLoader('index_' + name + config.suffix).getIndex()
+
+            for scheme in config.schemes:
+                self.retrievers[name, scheme] = Retrieve(index, scheme)
+
+        # Each worker process fills its own copy of the cache
+        self.cache = ResultCache(config.cache_size) if config.cache_size else None
+
+    def parse_query(self, variant, text):
+        """
+        Turn a query into term counts
+
+        :param variant: The variant name, which preprocessing raw text goes through
+        :param text: The raw text, or term:count pairs optionally led by a query id
+        :return: The dictionary of the count of each term
+        """
+
+        tokens = text.split()
+        if tokens and tokens[0].isdigit():
+            pairs = [TERM_COUNT_RE.match(token) for token in tokens[1:]]
+        else:
+            pairs = [TERM_COUNT_RE.match(token) for token in tokens]
+
+        if pairs and all(pairs):
+            query = {}
+            for match in pairs:
+                query[match.group(1)] = query.get(match.group(1), 0) + int(match.group(2))
+            return query
+
+        return self.preprocessor.analyze(text, variant)
+
+    def search(self, variant, scheme, text, k, boolean=None):
+        """
+        Retrieve the top k documents of a query
+
+        :param variant: The variant name
+        :param scheme: The term weighting scheme
+        :param text: The query, as accepted by parse_query
+        :param k: The number of documents to return
+        :param boolean: The Boolean query the documents must match, if any
+        :return: The (doc id, score) pairs of the top k documents
+        """
+
+        retrieve = self.retrievers[variant, scheme]
+        query = self.parse_query(variant, text)
+
+        if boolean is not None:
+            expression = parse_boolean(boolean, lambda word: self.preprocessor.term(word, variant))
+            rank = lambda: retrieve.boolean_ranked(expression, k, query or None)
+        else:
+            rank = lambda: retrieve.ranked(query, k)
+
+        if self.cache is None:
+            return rank()
+
+        key = (variant, scheme, k, tuple(sorted(query.items())), boolean)
+        results = self.cache.get(key, retrieve.version)
+
+        if results is None:
+            results = rank()
+            self.cache.put(key, retrieve.version, results)
+
+        return results
+
+
+def search(variant, scheme, text, k, boolean=None):
+    """
+    Score a query in a worker process with the inherited server state
+
+    :param variant: The variant name
+    :param scheme: The term weighting scheme
+    :param text: The query
+    :param k: The number of documents to return
+    :param boolean: The Boolean query the documents must match, if any
+    :return: The (doc id, score) pairs of the top k documents
+    """
+
+    return [(int(doc), float(score))
+            for doc, score in server_state.search(variant, scheme, text, k, boolean)]
+
+
+class RetrievalServer:
+    """
+    The class for the HTTP front end, parsing requests on the event loop and handing the
+    scoring to the worker pool
+    """
+
+    def __init__(self, state, pool):
+        """
+        Create new server
+
+        :param state: The server state
+        :param pool: The executor scoring the queries
+        """
+
+        self.state = state
+        self.pool = pool
+
+    async def handle(self, reader, writer):
+        """
+        Serve the requests of a connection until the client closes it
+
+        :param reader: The stream reader of the connection
+        :param writer: The stream writer of the connection
+        """
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = headers.get('content-length', '0')
+
+                if not (length.isascii() and length.isdigit()):
+                    # The end of the body is unknown, so the connection is closed
+                    status, reply = 400, {'error': 'bad content-length %r' % length}
+                    version = 'HTTP/1.0'
+                else:
+                    body = await reader.readexactly(int(length))
+
+                    try:
+                        method, path, version = request_line.decode('latin-1').split()
+                    except ValueError:
+                        status, reply = 400, {'error': 'malformed request line'}
+                        version = 'HTTP/1.0'
+                    else:
+                        try:
+                            status, reply = await self.dispatch(method, path, body)
+                        except Exception as error:
+                            # A bug answering one request must not drop the connection
+                            print('ERROR: %s %s: %r' % (method, path, error), file=sys.stderr)
+                            status, reply = 500, {'error': 'internal error: %s' % error}
+
+                payload = json.dumps(reply).encode('utf-8')
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+
+                writer.write(('HTTP/1.1 %d %s\r\n'
+                              'Content-Type: application/json\r\n'
+                              'Content-Length: %d\r\n'
+                              'Connection: %s\r\n\r\n'
+                              % (status, REASONS[status], len(payload),
+                                 'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+                writer.write(payload)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        """
+        Answer a request
+
+        :param method: The HTTP method
+        :param path: The request path
+        :param body: The request body
+        :return: The status code and the JSON reply
+        """
+
+        if path == '/status':
+            return 200, {'variants': self.state.variants, 'weightings': self.state.schemes}
+
+        if path != '/search':
+            return 404, {'error': 'unknown path %s' % path}
+
+        if method != 'POST':
+            return 405, {'error': 'use POST with a JSON body'}
+
+        try:
+            request = json.loads(body)
+            text = request['query']
+            variant = request.get('variant', self.state.variants[0])
+            scheme = request.get('weighting', self.state.schemes[0])
+            k = request.get('k', 10)
+            boolean = request.get('filter')
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return 400, {'error': 'the body must be a JSON object with a query'}
+
+        if not (isinstance(variant, str) and isinstance(scheme, str)
+                and (boolean is None or isinstance(boolean, str))):
+            return 400, {'error': 'the variant, weighting and filter must be strings'}
+
+        if not isinstance(k, int) or isinstance(k, bool):
+            return 400, {'error': 'k must be an integer'}
+
+        if (variant, scheme) not in self.state.retrievers:
+            return 400, {'error': 'variant %s with weighting %s is not loaded' % (variant, scheme)}
+
+        if not isinstance(text, str) or k <= 0:
+            return 400, {'error': 'the query must be a string and k a positive integer'}
+
+        if boolean is not None:
+            try:
+                parse_boolean(boolean)
+            except (ValueError, TypeError) as error:
+                return 400, {'error': 'bad filter: %s' % error}
+
+        loop = asyncio.get_running_loop()
+
+        try:
+            results = await loop.run_in_executor(self.pool, search, variant, scheme, text, k,
+                                                 boolean)
+        except Exception as error:
+            return 500, {'error': str(error)}
+
+        return 200, {'variant': variant, 'weighting': scheme,
+                     'results': [{'doc': doc, 'score': score} for doc, score in results]}
+
+
+async def serve(state, pool, host, port):
+    """
+    Run the server until it is cancelled
+
+    :param state: The server state
+    :param pool: The executor scoring the queries
+    :param host: The address to listen on
+    :param port: The port to listen on
+    """
+
+    server = await asyncio.start_server(RetrievalServer(state, pool).handle, host, port)
+
+    print('Serving on http://%s:%d' % (host, port), file=sys.stderr)
+
+    async with server:
+        await server.serve_forever()
+
+
+def make_pool(jobs):
+    """
+    Start the worker processes, forked so that they inherit the server state
+
+    :param jobs: The number of worker processes
+    :return: The executor
+    """
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        print('WARNING: worker processes need fork -- scoring in a thread', file=sys.stderr)
+        return concurrent.futures.ThreadPoolExecutor(1)
+
+    pool = concurrent.futures.ProcessPoolExecutor(jobs, multiprocessing.get_context('fork'))
+
+    # The first task forks every worker, before the event loop starts any thread
+    pool.submit(int).result()
+
+    return pool
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hv:w:ms:a:p:j:c:')
+    opts = dict(opts)
+
+    if '-h' in opts or len(args) > 0:
+        print(__doc__.replace('<PROGNAME>', sys.argv[0].split('/')[-1], 1), file=sys.stderr)
+        sys.exit(0)
+
+    try:
+        config = ServerOptions(opts)
+    except ValueError as error:
+        print('*** ERROR: %s ***' % error, file=sys.stderr)
+        sys.exit(1)
+
+    server_state = ServerState(config)
+    pool = make_pool(config.jobs)
+
+    try:
+        asyncio.run(serve(server_state, pool, config.host, config.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown()
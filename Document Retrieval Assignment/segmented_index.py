@@ -0,0 +1,572 @@
+"""
+The segmented index of Document Retrieval System
+
+New documents are written into small immutable segments that are searched together with
+the main index, and a background thread merges small segments into bigger ones. Readers
+never take a lock: every query works on the snapshot of segments and tombstones that was
+current when it started, and writers publish new snapshots by replacing the reference
+
+Segments are built and merged in a worker process of the lowest scheduling priority, so
+that the queries neither wait for the interpreter lock nor share a CPU with the building
+while they are busy. A segment keeps its postings in flat arrays, which the worker hands
+back at the cost of a copy instead of rebuilding the dictionaries of every posting. Under
+a query load saturating every CPU, the ingest only gets the time the queries leave
+"""
+
+import os
+import math
+import threading
+import multiprocessing
+import concurrent.futures
+from array import array
+from my_retriever import Retrieve
+
+# The niceness of the worker process building the segments, the lowest priority
+BUILDER_NICENESS = 19
+
+
+class Segment:
+    """
+    The class for an immutable segment, the postings and document vector sizes of a set
+    of documents
+    """
+
+    def __init__(self, forward, term_weighting, idf=None):
+        """
+        Create new segment
+
+        :param forward: The dictionary of the count of each term in each document
+        :param term_weighting: The term weighting scheme, binary, tf or tfidf
+        :param idf: The dictionary of the IDF of each term, for the TFIDF vector sizes, by
+                    default the IDF over the documents of the segment
+        """
+
+        # The sequence number, assigned when the segment is published
+        self.seq = 0
+
+        postings = {}
+        for doc, terms in forward.items():
+            for term, count in terms.items():
+                if term in postings:
+                    postings[term][0].append(doc)
+                    postings[term][1].append(count)
+                else:
+                    postings[term] = ([doc], [count])
+
+        if term_weighting == 'tfidf' and idf is None:
+            idf = {term: math.log(len(forward) / len(docs))
+                   for term, (docs, _) in postings.items()}
+
+        self.doc_vec_size = {}
+
+        for doc, terms in forward.items():
+            if term_weighting == 'binary':
+                size = len(terms)
+            elif term_weighting == 'tf':
+                # TF: 1.95 gives better results
+                size = sum(count ** 1.95 for count in terms.values())
+            else:
+                size = sum((idf[term] * count) ** 2 for term, count in terms.items())
+
+            self.doc_vec_size[doc] = math.sqrt(size)
+
+        # The postings of the term of row i are docs[offsets[i]:offsets[i + 1]], with the
+        # counts at the same places
+        self.terms = {}
+        self.offsets = array('l', [0])
+        self.docs = array('l')
+        self.counts = array('l')
+
+        for row, (term, (docs, counts)) in enumerate(postings.items()):
+            self.terms[term] = row
+            self.docs.extend(docs)
+            self.counts.extend(counts)
+            self.offsets.append(len(self.docs))
+
+    def __len__(self):
+        return len(self.doc_vec_size)
+
+    def __contains__(self, doc):
+        return doc in self.doc_vec_size
+
+    def __iter__(self):
+        return iter(self.doc_vec_size)
+
+    def doc_freq(self, term):
+        """
+        Get the number of postings of a term in the segment
+
+        :param term: The term
+        :return: The document frequency, 0 if the term is not in the segment
+        """
+
+        row = self.terms.get(term)
+
+        return 0 if row is None else self.offsets[row + 1] - self.offsets[row]
+
+    def postings(self, term):
+        """
+        Get the postings of a term in the segment
+
+        :param term: The term
+        :return: The iterator of the (doc id, count) pairs of the term
+        """
+
+        row = self.terms.get(term)
+        if row is None:
+            return iter(())
+
+        start, end = self.offsets[row], self.offsets[row + 1]
+
+        return zip(self.docs[start:end], self.counts[start:end])
+
+    def forward(self):
+        """
+        Get the terms of the documents of the segment
+
+        :return: The dictionary of the count of each term in each document
+        """
+
+        forward = {doc: {} for doc in self.doc_vec_size}
+
+        for term in self.terms:
+            for doc, count in self.postings(term):
+                forward[doc][term] = count
+
+        return forward
+
+
+def merge_segments(segments, hidden, term_weighting, idf=None):
+    """
+    Merge segments into a new one, dropping the deleted documents
+
+    :param segments: The segments to merge
+    :param hidden: The set of the deleted doc ids of each segment
+    :param term_weighting: The term weighting scheme, binary, tf or tfidf
+    :param idf: The dictionary of the IDF of each term, for the TFIDF vector sizes, by
+                default the IDF over the documents of the merged segment
+    :return: The merged segment, its sequence number not assigned
+    """
+
+    forward = {}
+
+    for segment, deleted in zip(segments, hidden):
+        for doc, terms in segment.forward().items():
+            if doc not in deleted:
+                forward[doc] = terms
+
+    return Segment(forward, term_weighting, idf)
+
+
+class Snapshot:
+    """
+    The class for the state of a segmented index seen by a query, never modified once
+    published but for the tombstones newer than it
+    """
+
+    def __init__(self, segments, tombstones, total_doc, seq):
+        """
+        Create new snapshot
+
+        :param segments: The tuple of segments
+        :param tombstones: The dictionary of the sequence numbers at which each deleted
+                           document was deleted, each hides the versions in older segments.
+                           Writers append to it in place, the tombstones newer than the
+                           snapshot are ignored
+        :param total_doc: The number of live documents |D|
+        :param seq: The last sequence number given when the snapshot was published
+        """
+
+        self.segments = segments
+        self.tombstones = tombstones
+        self.total_doc = total_doc
+        self.seq = seq
+
+    def is_visible(self, segment, doc):
+        """
+        Check whether the version of a document in a segment is live
+
+        :param segment: The segment
+        :param doc: The doc id, it must be in the segment
+        :return: True if the document was not deleted after the segment was published
+        """
+
+        seqs = self.tombstones.get(doc)
+
+        return seqs is None or not any(segment.seq < deleted <= self.seq for deleted in seqs)
+
+    def is_live(self, doc):
+        """
+        Check whether a document is in the collection
+
+        :param doc: The doc id
+        :return: True if a segment holds a live version of the document
+        """
+
+        return any(doc in segment and self.is_visible(segment, doc)
+                   for segment in self.segments)
+
+    def doc_freq(self, term):
+        """
+        Get the number of postings of a term, including deleted ones not merged away yet
+
+        :param term: The term
+        :return: The document frequency
+        """
+
+        return sum(segment.doc_freq(term) for segment in self.segments)
+
+    def idf(self, term):
+        """
+        Get the inverse document frequency of a term
+
+        :param term: The term
+        :return: The IDF, as if the term appeared in one document when it appears in none
+        """
+
+        return math.log(max(self.total_doc, 1) / min(max(self.doc_freq(term), 1),
+                                                     max(self.total_doc, 1)))
+
+
+class SegmentedIndex:
+    """
+    The class for a segmented index with background merging, searched like Retrieve
+    """
+
+    def __init__(self, index, term_weighting, merge_factor=4):
+        """
+        Create new segmented index whose first segment holds the main index
+
+        :param index: The index dictionary of the main index
+        :param term_weighting: The term weighting scheme, binary, tf or tfidf
+        :param merge_factor: The number of segments of the same size tier that are merged
+                             together, segment tiers grow by this factor
+        """
+
+        if term_weighting not in ('binary', 'tf', 'tfidf'):
+            raise ValueError('unsupported term weighting %s, must be binary, tf or tfidf'
+                             % term_weighting)
+
+        self.term_weighting = term_weighting
+        self.merge_factor = merge_factor
+
+        # All the terms of each document of the main index, documents without any indexed
+        # term still count towards |D| as in Retrieve
+        forward = {}
+        for term, postings in index.items():
+            for doc, count in postings.items():
+                forward.setdefault(doc, {})[term] = count
+
+        forward = {doc: forward.get(doc, {}) for doc in range(1, max(forward, default=0) + 1)}
+
+        # Forked before the merging thread starts, the worker process building the segments
+        # holds no lock of this one, without fork they are built in the calling thread
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self.builder = concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context('fork'), initializer=os.nice,
+                initargs=(BUILDER_NICENESS,))
+        else:
+            self.builder = None
+
+        main = self._build(Segment, forward, term_weighting)
+        self.snapshot = Snapshot((main,), {}, len(main), 0)
+
+        # The last sequence number given to a segment or a tombstone
+        self.seq = 0
+
+        # The sequence number of the oldest segment when the tombstones were last collected
+        self.collected = 0
+
+        # The number of merges done by the background thread
+        self.merges = 0
+
+        # The number of snapshots published, for result caches
+        self.version = 0
+
+        # Writers publish snapshots holding the lock, readers never take it
+        self.changed = threading.Condition()
+        self.merging = False
+        self.closing = False
+
+        self.merger = threading.Thread(target=self._merge_loop, daemon=True)
+        self.merger.start()
+
+    def add_documents(self, docs):
+        """
+        Add documents in a new segment, replacing the documents already in the index
+
+        :param docs: The dictionary of the count of each term in each document
+        """
+
+        terms = {term for counts in docs.values() for term in counts}
+        segment = self._build(Segment, dict(docs), self.term_weighting,
+                              self._term_idf(self.snapshot, terms))
+
+        with self.changed:
+            snapshot = self.snapshot
+            replaced = [doc for doc in docs if snapshot.is_live(doc)]
+
+            if replaced:
+                self.seq += 1
+                for doc in replaced:
+                    snapshot.tombstones.setdefault(doc, []).append(self.seq)
+
+            self.seq += 1
+            segment.seq = self.seq
+
+            self._publish(Snapshot(snapshot.segments + (segment,), snapshot.tombstones,
+                                   snapshot.total_doc + len(docs) - len(replaced), self.seq))
+
+    def add_document(self, doc, terms):
+        """
+        Add a document, replacing it if it is already in the index
+
+        :param doc: The doc id
+        :param terms: The dictionary of the count of each term in the document
+        """
+
+        self.add_documents({doc: terms})
+
+    def delete_document(self, doc):
+        """
+        Delete a document with a tombstone, its postings are dropped by the next merge of
+        its segment and the tombstone once every older segment is merged away
+
+        :param doc: The doc id, it must be in the index
+        """
+
+        with self.changed:
+            snapshot = self.snapshot
+
+            if not snapshot.is_live(doc):
+                raise KeyError(doc)
+
+            self.seq += 1
+            snapshot.tombstones.setdefault(doc, []).append(self.seq)
+
+            self._publish(Snapshot(snapshot.segments, snapshot.tombstones,
+                                   snapshot.total_doc - 1, self.seq))
+
+    def _build(self, function, *args):
+        """
+        Build a segment in the worker process
+
+        :param function: The function returning the segment, Segment or merge_segments
+        :param args: Its arguments
+        :return: The segment
+        """
+
+        if self.builder is None:
+            return function(*args)
+
+        # The calling thread waits without the interpreter lock
+        return self.builder.submit(function, *args).result()
+
+    def _term_idf(self, snapshot, terms):
+        """
+        Get the IDF of terms for the TFIDF vector sizes of a new segment
+
+        :param snapshot: The snapshot the IDF is computed over
+        :param terms: The terms of the segment
+        :return: The dictionary of the IDF of each term, None unless the weighting is tfidf
+        """
+
+        if self.term_weighting != 'tfidf':
+            return None
+
+        return {term: snapshot.idf(term) for term in terms}
+
+    def _publish(self, snapshot):
+        """
+        Make a snapshot the one seen by new queries, the lock must be held
+
+        :param snapshot: The snapshot
+        """
+
+        self.snapshot = snapshot
+        self.version += 1
+        self.changed.notify_all()
+
+    def forQuery(self, query, k=10):
+        """
+        Method performing retrieval for specified query over all the segments
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The top k most relevant documents to the query
+        """
+
+        snapshot = self.snapshot
+
+        # The query weights folded as in Retrieve.query_weights, with the IDF of the
+        # whole snapshot
+        weights = {}
+        for term, count in query.items():
+            if snapshot.doc_freq(term) > 0:
+                if self.term_weighting == 'binary':
+                    weights[term] = 1
+                elif self.term_weighting == 'tf':
+                    weights[term] = count
+                else:
+                    weights[term] = count * snapshot.idf(term) ** 2
+
+        similarity = {}
+
+        for segment in snapshot.segments:
+            accumulator = {}
+
+            for term, weight in weights.items():
+                for doc, count in segment.postings(term):
+                    if snapshot.is_visible(segment, doc):
+                        product = weight if self.term_weighting == 'binary' else weight * count
+                        accumulator[doc] = accumulator.get(doc, 0) + product
+
+            for doc, product in accumulator.items():
+                similarity[doc] = product / segment.doc_vec_size[doc]
+
+        return Retrieve.top_k(similarity, k)
+
+    def _pick_merge(self, snapshot):
+        """
+        Choose the segments to merge, the merge_factor smallest segments of the first size
+        tier holding that many
+
+        :param snapshot: The snapshot to choose from
+        :return: The segments to merge, or None if no tier is full
+        """
+
+        tiers = {}
+
+        for segment in sorted(snapshot.segments, key=len):
+            tier, size = 0, len(segment)
+            while size >= self.merge_factor:
+                size //= self.merge_factor
+                tier += 1
+
+            tiers.setdefault(tier, []).append(segment)
+
+            if len(tiers[tier]) == self.merge_factor:
+                return tiers[tier]
+
+        return None
+
+    def _merge(self, segments, snapshot, exact=False):
+        """
+        Merge segments into a new one in the worker process, dropping the deleted documents
+
+        :param segments: The segments to merge
+        :param snapshot: The snapshot the segments belong to
+        :param exact: True to compute the TFIDF vector sizes with the IDF of the merged
+                      documents, when they are every live document
+        :return: The merged segment, with the sequence number of the snapshot
+        """
+
+        # The writers add tombstones without waiting for the merge, only looked up here
+        hidden = [{doc for doc in segment if not snapshot.is_visible(segment, doc)}
+                  for segment in segments]
+        idf = None if exact else self._term_idf(snapshot, {term for segment in segments
+                                                           for term in segment.terms})
+
+        merged = self._build(merge_segments, segments, hidden, self.term_weighting, idf)
+
+        # The merge applied every tombstone of the snapshot, so that only the newer ones
+        # hide its documents
+        merged.seq = snapshot.seq
+
+        return merged
+
+    def _replace(self, segments, merged):
+        """
+        Publish a snapshot where merged segments are replaced by their merge, dropping the
+        tombstones older than every segment left as they hide nothing, the lock must be
+        held
+
+        :param segments: The segments that were merged
+        :param merged: The merged segment
+        """
+
+        snapshot = self.snapshot
+        kept = tuple(segment for segment in snapshot.segments if segment not in segments)
+        segments = tuple(sorted(kept + (merged,), key=lambda x: x.seq))
+
+        # The older snapshots keep the tombstones they were published with, the writers
+        # append to the new ones
+        tombstones = snapshot.tombstones
+        if segments[0].seq > self.collected:
+            self.collected = segments[0].seq
+            tombstones = {}
+            for doc, seqs in snapshot.tombstones.items():
+                seqs = [deleted for deleted in seqs if deleted > self.collected]
+                if seqs:
+                    tombstones[doc] = seqs
+
+        self._publish(Snapshot(segments, tombstones, snapshot.total_doc, snapshot.seq))
+
+    def _merge_loop(self):
+        """
+        Merge segments in the background whenever a size tier is full, never while a
+        compaction is merging the same segments
+        """
+
+        while True:
+            with self.changed:
+                while not self.closing and (self.merging or
+                                            self._pick_merge(self.snapshot) is None):
+                    self.changed.wait()
+
+                if self.closing:
+                    return
+
+                snapshot = self.snapshot
+                segments = self._pick_merge(snapshot)
+                self.merging = True
+
+            # Merging reads an immutable snapshot, so writers and readers carry on
+            merged = self._merge(segments, snapshot)
+
+            with self.changed:
+                self._replace(segments, merged)
+                self.merges += 1
+                self.merging = False
+
+    def wait_merges(self):
+        """
+        Wait until the background thread has no merge left to do
+        """
+
+        with self.changed:
+            while self.merging or self._pick_merge(self.snapshot) is not None:
+                self.changed.wait()
+
+    def compact(self):
+        """
+        Merge every segment into one, dropping the deleted documents and recomputing the
+        TFIDF vector sizes with the IDF of the live documents
+        """
+
+        with self.changed:
+            while self.merging:
+                self.changed.wait()
+
+            snapshot = self.snapshot
+            self.merging = True
+
+        merged = self._merge(snapshot.segments, snapshot, exact=True)
+
+        with self.changed:
+            self._replace(snapshot.segments, merged)
+            self.merging = False
+
+    def close(self):
+        """
+        Stop the background merging thread and the worker process
+        """
+
+        with self.changed:
+            self.closing = True
+            self.changed.notify_all()
+
+        self.merger.join()
+
+        if self.builder is not None:
+            self.builder.shutdown()
@@ -0,0 +1,227 @@
+"""
+The sharded retriever of Document Retrieval System
+
+The documents are partitioned by doc id range or hash across shard processes, each
+holding a Retrieve over its part of the index. The document frequency of every term and
+the average document length are computed once over the whole collection and handed to
+every shard, so that the scores of a document do not depend on the shard it is in. Queries
+are sent to every shard at once and the top k documents of each shard are merged into the
+global top k. Without fork, the shards are scored one after the other in the coordinator
+"""
+
+import sys
+import heapq
+import multiprocessing
+from my_retriever import Retrieve
+
+PARTITIONS = ('range', 'hash')
+
+
+def partition(index, shards, by='range'):
+    """
+    Split an index into the indexes of document-partitioned shards
+
+    :param index: The index dictionary
+    :param shards: The number of shards
+    :param by: How documents are assigned to shards, range (contiguous doc id ranges) or
+               hash (doc id modulo the number of shards)
+    :return: The (index dictionary, doc ids) of each shard
+    """
+
+    total_doc = max((doc for docs in index.values() for doc in docs), default=0)
+
+    if by == 'range':
+        size = -(-total_doc // shards) or 1
+        shard_of = lambda doc: (doc - 1) // size
+    elif by == 'hash':
+        shard_of = lambda doc: doc % shards
+    else:
+        raise ValueError('unknown partition %s, must be one of: %s' % (by, ', '.join(PARTITIONS)))
+
+    parts = [({}, []) for _ in range(shards)]
+
+    for term, postings in index.items():
+        for doc, count in postings.items():
+            shard_index = parts[shard_of(doc)][0]
+            if term in shard_index:
+                shard_index[term][doc] = count
+            else:
+                shard_index[term] = {doc: count}
+
+    # Documents without any indexed term still count towards |D|, as in Retrieve
+    for doc in range(1, total_doc + 1):
+        parts[shard_of(doc)][1].append(doc)
+
+    return parts
+
+
+def global_stats(index):
+    """
+    Compute the statistics of the whole collection the shards score documents with
+
+    :param index: The index dictionary of the whole collection
+    :return: The |D|, the document frequency of each term and the average document length
+    """
+
+    total_doc = max((doc for docs in index.values() for doc in docs), default=0)
+    doc_freq = {term: len(docs) for term, docs in index.items()}
+    total_len = sum(sum(docs.values()) for docs in index.values())
+
+    return total_doc, doc_freq, total_len / max(total_doc, 1)
+
+
+def serve_shard(connection, index, docs, term_weighting, evaluation, stats):
+    """
+    Answer the queries of a shard process until the connection sends None
+
+    :param connection: The end of the pipe to the coordinator
+    :param index: The index dictionary of the shard
+    :param docs: The doc ids of the shard
+    :param term_weighting: The term weighting scheme
+    :param evaluation: The query evaluation strategy of Retrieve
+    :param stats: The statistics of the whole collection, as returned by global_stats
+    """
+
+    retrieve = Retrieve(index, term_weighting, evaluation, docs=docs, stats=stats)
+    connection.send(len(docs))
+
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+
+        queries, k = request
+        connection.send([retrieve.ranked(query, k) for query in queries])
+
+    connection.close()
+
+
+class ShardedRetrieve:
+    """
+    The class for the sharded Retriever, ranking documents as Retrieve does over the whole
+    index
+    """
+
+    def __init__(self, index, term_weighting, shards=4, by='range', evaluation='taat'):
+        """
+        Create new ShardedRetrieve object starting the shard processes
+
+        :param index: The index dictionary of the whole collection
+        :param term_weighting: The term weighting scheme, binary, tf, tfidf, bm25 or pivoted
+        :param shards: The number of shard processes
+        :param by: How documents are assigned to shards, range or hash
+        :param evaluation: The query evaluation strategy of each shard's Retrieve
+        """
+
+        self.term_weighting = term_weighting
+        self.version = 0
+        self.query_times = {}
+
+        # The global statistics, computed once by the coordinator
+        stats = global_stats(index)
+
+        # Forked, the shards inherit their part of the index instead of having it pickled,
+        # and build their Retrieve in parallel
+        self.connections = []
+        self.processes = []
+        self.retrieves = None
+
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            print('WARNING: shard processes need fork -- scoring the shards serially',
+                  file=sys.stderr)
+            self.retrieves = [Retrieve(shard_index, term_weighting, evaluation, docs=docs,
+                                       stats=stats)
+                              for shard_index, docs in partition(index, shards, by)]
+            self.shard_docs = [retrieve.total_doc for retrieve in self.retrieves]
+            return
+
+        context = multiprocessing.get_context('fork')
+
+        for shard_index, docs in partition(index, shards, by):
+            connection, shard_connection = context.Pipe()
+            process = context.Process(target=serve_shard, daemon=True,
+                                      args=(shard_connection, shard_index, docs,
+                                            term_weighting, evaluation, stats))
+            process.start()
+            shard_connection.close()
+
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        # The number of documents of each shard, once every shard is ready
+        self.shard_docs = [connection.recv() for connection in self.connections]
+
+    def forQueries(self, queries, k=10):
+        """
+        Method performing retrieval for a list of queries, scattered to every shard
+
+        :param queries: The queries to process
+        :param k: The number of documents to return for each query
+        :return: The top k most relevant documents to each query
+        """
+
+        return [[doc for doc, score in ranked] for ranked in self.rankedQueries(queries, k)]
+
+    def forQuery(self, query, k=10):
+        """
+        Method performing retrieval for specified query
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The top k most relevant documents to the query
+        """
+
+        return self.forQueries([query], k)[0]
+
+    def ranked(self, query, k=10):
+        """
+        Retrieve the top k documents of a query with their similarity scores
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The (doc id, score) pairs of the top k most relevant documents to the query
+        """
+
+        return self.rankedQueries([query], k)[0]
+
+    def rankedQueries(self, queries, k=10):
+        """
+        Send queries to every shard and merge the top k documents of the shards
+
+        :param queries: The queries to process
+        :param k: The number of documents to return for each query
+        :return: The (doc id, score) pairs of the top k documents of each query, by
+                 similarity score in descending order, ties broken by ascending doc id
+        """
+
+        queries = list(queries)
+
+        # Every shard scores the queries at once, its top k holds every document of the
+        # global top k that it has
+        if self.retrieves is not None:
+            shard_ranked = [[retrieve.ranked(query, k) for query in queries]
+                            for retrieve in self.retrieves]
+        else:
+            for connection in self.connections:
+                connection.send((queries, k))
+
+            shard_ranked = [connection.recv() for connection in self.connections]
+
+        return [heapq.nsmallest(k, (pair for ranked in rankings for pair in ranked),
+                                key=lambda x: (-x[1], x[0]))
+                for rankings in zip(*shard_ranked)]
+
+    def close(self):
+        """
+        Stop the shard processes, if any
+        """
+
+        for connection in self.connections:
+            connection.send(None)
+            connection.close()
+
+        for process in self.processes:
+            process.join()
+
+        self.connections = []
+        self.processes = []
@@ -0,0 +1,248 @@
+"""
+The sparse matrix retriever of Document Retrieval System, scoring batches of queries with
+NumPy and SciPy instead of dictionary loops
+"""
+
+import numpy as np
+from scipy import sparse
+
+# The chunks each row of scores is cut into per document selected, the more chunks, the
+# fewer candidates the chunk maxima leave but the longer they take, see top_k_rows
+CHUNKS_PER_DOC = 3
+
+
+class SparseRetrieve:
+    """
+    The class for the sparse matrix Retriever, ranking documents as Retrieve does
+    """
+
+    def __init__(self, index, term_weighting, batch_size=256):
+        """
+        Create new SparseRetrieve object building the term-document weight matrix
+
+        :param index: The index dictionary
+        :param term_weighting: The term weighting scheme, binary, tf or tfidf
+        :param batch_size: The number of queries scored by one matrix product
+        """
+
+        if term_weighting not in ('binary', 'tf', 'tfidf'):
+            raise ValueError('unsupported term weighting %s, must be binary, tf or tfidf'
+                             % term_weighting)
+
+        self.term_weighting = term_weighting
+        self.batch_size = batch_size
+
+        # The row of each term in the matrices
+        self.term_id = {term: i for i, term in enumerate(index)}
+
+        rows, docs, counts = [], [], []
+        for i, postings in enumerate(index.values()):
+            for doc, count in postings.items():
+                rows.append(i)
+                docs.append(doc)
+                counts.append(count)
+
+        # The total number of documents in the collection |D|, doc ids are column numbers
+        self.total_doc = max(docs, default=0)
+
+        counts = sparse.csr_matrix((np.array(counts, dtype=np.float64), (rows, docs)),
+                                   shape=(len(self.term_id), self.total_doc + 1))
+
+        # The inverse document frequency of each term
+        doc_freq = np.diff(counts.indptr)
+        self.idf = np.log(self.total_doc / np.maximum(doc_freq, 1))
+
+        # The document side weights of the chosen scheme and the document vector sizes,
+        # the IDF of tfidf is folded into the query side as in Retrieve.query_weights
+        if term_weighting == 'binary':
+            weights = counts.copy()
+            weights.data[:] = 1
+            norm = np.sqrt(weights.sum(axis=0))
+        elif term_weighting == 'tf':
+            # TF: 1.95 gives better results
+            weights = counts
+            norm = np.sqrt(counts.power(1.95).sum(axis=0))
+        else:
+            weights = counts
+            norm = np.sqrt((sparse.diags(self.idf) @ counts).power(2).sum(axis=0))
+
+        self.doc_weights = weights.tocsr()
+
+        # Documents without any term are never scored, keep their size away from 0
+        self.doc_vec_size = np.asarray(norm).ravel()
+        self.doc_vec_size[self.doc_vec_size == 0] = 1
+
+        # Which documents contain each term, for the candidates of a query
+        self.incidence = self.doc_weights.copy()
+        self.incidence.data[:] = 1
+
+    def query_matrix(self, queries):
+        """
+        Build the query side weights of a batch of queries
+
+        :param queries: The queries to process
+        :return: The sparse matrix of the weight of each query term, one row per query
+        """
+
+        rows, cols, values = [], [], []
+
+        for row, query in enumerate(queries):
+            for term, count in query.items():
+                if term in self.term_id:
+                    i = self.term_id[term]
+                    rows.append(row)
+                    cols.append(i)
+
+                    if self.term_weighting == 'binary':
+                        values.append(1)
+                    elif self.term_weighting == 'tf':
+                        values.append(count)
+                    else:
+                        # TFIDF in query * IDF of the document side
+                        values.append(count * self.idf[i] ** 2)
+
+        return sparse.csr_matrix((np.array(values, dtype=np.float64), (rows, cols)),
+                                 shape=(len(queries), len(self.term_id)))
+
+    def forQueries(self, queries, k=10):
+        """
+        Method performing retrieval for a list of queries
+
+        :param queries: The queries to process
+        :param k: The number of documents to return for each query
+        :return: The top k most relevant documents to each query
+        """
+
+        ranked = []
+
+        for start in range(0, len(queries), self.batch_size):
+            ranked.extend(self.score_batch(queries[start:start + self.batch_size], k))
+
+        return ranked
+
+    def forQuery(self, query, k=10):
+        """
+        Method performing retrieval for specified query
+
+        :param query: The query to process
+        :param k: The number of documents to return
+        :return: The top k most relevant documents to the query
+        """
+
+        return self.forQueries([query], k)[0]
+
+    def score_batch(self, queries, k):
+        """
+        Score a batch of queries with one sparse matrix product and select the top k
+        documents of all of them at once from its nonzero entries
+
+        :param queries: The queries to process
+        :param k: The number of documents to return for each query
+        :return: The top k most relevant documents to each query, by similarity score in
+                 descending order, ties broken by ascending document id
+        """
+
+        query_weights = self.query_matrix(queries)
+
+        if k <= 0:
+            return [[] for _ in queries]
+
+        product = (query_weights @ self.doc_weights).tocsr()
+        similarity = product.data / self.doc_vec_size[product.indices]
+        ranked = top_k_rows(product.indptr, product.indices, similarity, k)
+
+        # The product holds the nonzero scores only, the documents sharing no term of
+        # nonzero weight with a query (a term in every document has no IDF) score 0 and
+        # are only ranked when it has fewer than k nonzero scores
+        short = np.flatnonzero(np.diff(product.indptr) < k)
+        if len(short) > 0:
+            binary_query = query_weights[short]
+            binary_query.data[:] = 1
+            candidate = (binary_query @ self.incidence).tocsr()
+
+            for row, start, end in zip(short, candidate.indptr[:-1], candidate.indptr[1:]):
+                first, last = product.indptr[row], product.indptr[row + 1]
+                docs, scores = product.indices[first:last], similarity[first:last]
+
+                zero = np.setdiff1d(candidate.indices[start:end], docs)
+                docs = np.concatenate((docs, zero))
+                scores = np.concatenate((scores, np.zeros(len(zero))))
+
+                ranked[row] = docs[np.lexsort((docs, -scores))[:k]].tolist()
+
+        return ranked
+
+
+def top_k_rows(indptr, docs, scores, k):
+    """
+    Select the top k entries of every row of a sparse matrix at once
+
+    Each row with enough entries is cut into CHUNKS_PER_DOC * k chunks: at least k of its
+    entries reach the k-th highest of the chunk maxima, so only the entries reaching it
+    are candidates. The exact k-th score of each row is then found among its candidates,
+    and the rows are sorted side by side in a matrix padded to the most candidates of a
+    row, so that the ties at the boundary are broken by doc id as in Retrieve
+
+    :param indptr: The offset of the first entry of each row, and the number of entries
+    :param docs: The doc id (column) of each entry
+    :param scores: The score of each entry
+    :param k: The number of entries to select in each row, at least 1
+    :return: The doc ids of the top k entries of each row, by score in descending order,
+             ties broken by ascending doc id
+    """
+
+    counts = np.diff(indptr)
+    chunks = CHUNKS_PER_DOC * k
+
+    # The lowest score of the candidates of each row, every entry of the short rows
+    lowest = np.full(len(counts), -np.inf)
+    long = np.flatnonzero(counts >= chunks)
+
+    if len(long) > 0:
+        bounds = indptr[long, None] + np.arange(chunks) * counts[long, None] // chunks
+
+        # Each row also ends a segment, which is dropped, so that its last chunk stops at
+        # its end; the score appended after the others keeps the end of the last row a
+        # valid offset
+        bounds = np.column_stack((bounds, indptr[long + 1])).ravel()
+        maxima = np.maximum.reduceat(np.append(scores, -np.inf), bounds)
+        maxima = maxima.reshape(len(long), chunks + 1)[:, :chunks]
+        lowest[long] = np.partition(maxima, chunks - k, axis=1)[:, chunks - k]
+
+    candidates = np.flatnonzero(scores >= np.repeat(lowest, counts))
+    rows = np.searchsorted(indptr, candidates, 'right') - 1
+
+    # The k-th highest score of each row, the rows with fewer candidates keep them all
+    negated = pad_rows(rows, -scores[candidates], len(counts), np.inf)
+    if negated.shape[1] > k:
+        kth = -np.partition(negated, k - 1, axis=1)[:, k - 1]
+        kept = scores[candidates] >= kth[rows]
+        candidates, rows = candidates[kept], rows[kept]
+
+    # Every row at once by descending score then ascending doc id, the padding last
+    negated = pad_rows(rows, -scores[candidates], len(counts), np.inf)
+    padded_docs = pad_rows(rows, docs[candidates], len(counts), 0)
+    top = np.lexsort((padded_docs, negated), axis=-1)[:, :k]
+    ranked = np.take_along_axis(padded_docs, top, axis=1).tolist()
+
+    return [row[:length] for row, length in zip(ranked, np.minimum(counts, k).tolist())]
+
+
+def pad_rows(rows, values, total_rows, fill):
+    """
+    Lay values out in a matrix with one row per row id, in their order
+
+    :param rows: The row id of each value, in ascending order
+    :param values: The values
+    :param total_rows: The number of rows
+    :param fill: The value of the padding after the values of each row
+    :return: The matrix, as wide as the most values of a row
+    """
+
+    per_row = np.bincount(rows, minlength=total_rows)
+    columns = np.arange(len(rows)) - (np.cumsum(per_row) - per_row)[rows]
+
+    matrix = np.full((total_rows, per_row.max(initial=0)), fill, dtype=values.dtype)
+    matrix[rows, columns] = values
+
+    return matrix
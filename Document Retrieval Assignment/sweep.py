@@ -0,0 +1,168 @@
+"""\
+------------------------------------------------------------
+USE: python <PROGNAME> (options)
+ACTION: evaluates every weighting scheme under every stoplist /
+    stemming configuration, loading each index once and scoring
+    the results in memory, and prints a table of each measure
+    (Rel_Retr, Precision, Recall, F-measure, MAP, nDCG@k, Time and
+    the p50 / p95 latency of a query), with a row for each scheme
+    and a column for each configuration, as in the README
+OPTIONS:
+    -h : print this help message
+    -g FILE : use gold standard FILE (default: cacm_gold_std.txt)
+    -k INT : retrieve the top INT documents for each query (default: 10)
+    -j INT : run the queries across INT worker processes (default: 1)
+    -m : use the memory mapped binary indexes (index_*.bin)
+    -f : also evaluate every weighting scheme but binary with Rocchio
+         pseudo relevance feedback (rows marked +RF)
+------------------------------------------------------------\
+"""
+
+import sys, getopt, time
+from ir_engine import IndexLoader, Queries, MyTimer, retrieveAll
+from eval_ir import Key, Response, Score, AP, NDCG
+from my_retriever import Retrieve
+
+# The configurations, (label, file name suffix), in the order of the README
+CONFIGURATIONS = [('stp-/stm-', 'nostoplist_nostemming'),
+                  ('stp+/stm-', 'withstoplist_nostemming'),
+                  ('stp-/stm+', 'nostoplist_withstemming'),
+                  ('stp+/stm+', 'withstoplist_withstemming')]
+
+SCHEMES = [('Binary', 'binary'), ('TF', 'tf'), ('TFIDF', 'tfidf'), ('BM25', 'bm25'),
+           ('Pivoted', 'pivoted')]
+
+# The measures, (title, format), in the order evaluate returns them
+MEASURES = [('RELEVANT RETRIEVED', '%d'), ('PRECISION', '%.2f'), ('RECALL', '%.2f'),
+            ('F-SCORES', '%.2f'), ('MAP', '%.3f'), ('NDCG@K', '%.3f'), ('TIMES', '%.2f'),
+            ('P50 LATENCY (MS)', '%.2f'), ('P95 LATENCY (MS)', '%.2f')]
+
+
+class SweepOptions:
+    def __init__(self, opts):
+        self.keyfile = opts.get('-g', 'cacm_gold_std.txt')
+        self.k = int(opts.get('-k', 10))
+        self.jobs = int(opts.get('-j', 1))
+        self.suffix = '.bin' if '-m' in opts else '.txt'
+        self.schemes = SCHEMES + ([(label + '+RF', scheme + '+rf') for label, scheme in SCHEMES
+                                   if scheme != 'binary'] if '-f' in opts else [])
+
+        # The eval_ir options for scoring the responses
+        self.response_limit = None
+        self.interp_points = 10
+        self.cutoff = self.k
+        self.query_print = False
+        self.show_interp_prec = False
+
+
+def evaluate(config, key, index, queries, scheme):
+    """
+    Retrieve the results of every query under a weighting scheme and score them
+
+    :param config: The sweep options
+    :param key: The gold standard
+    :param index: The index
+    :param queries: The queries
+    :param scheme: The term weighting scheme, followed by +rf for pseudo relevance feedback
+    :return: The relevant documents retrieved, precision, recall, F-measure, MAP, nDCG@k,
+             the retrieval time in seconds and the p50 and p95 query latency in milliseconds
+    """
+
+    scheme, _, feedback = scheme.partition('+')
+    retrieve = Retrieve(index, scheme, feedback=bool(feedback))
+    timer = MyTimer()
+
+    start = time.perf_counter()
+    results = retrieveAll(retrieve, queries, config.k, config.jobs, timer)
+    duration = time.perf_counter() - start
+
+    response = Response(config, key, ((qid, doc) for qid, docs in results for doc in docs))
+    score = Score(config, key, response)
+
+    latency = [timer.percentile('query', p) * 1000 for p in (50, 95)]
+
+    return ((score.total_relevant_retrieved,) + score.precisionRecallF() +
+            (score.rank_measures[AP], score.rank_measures[NDCG], duration, *latency))
+
+
+def print_table(title, fmt, schemes, scores):
+    """
+    Print the table of a measure, in the markdown layout of the README
+
+    :param title: The title of the measure
+    :param fmt: The format of a value of the measure
+    :param schemes: The (label, scheme) of each row
+    :param scores: The value of the measure under each (configuration suffix, scheme)
+    """
+
+    # The first column is as wide as the longest label, the others as their header
+    width = max(6, max(len(label) for label, _ in schemes))
+
+    print('- %s:' % title)
+    print()
+    print('| %*s |' % (width, '') + ''.join(' %s |' % label for label, _ in CONFIGURATIONS))
+    print('|:%s:|' % ('-' * width) + ''.join(':%s:|' % ('-' * len(label))
+                                            for label, _ in CONFIGURATIONS))
+
+    for label, scheme in schemes:
+        print('| %s |' % label.center(width) +
+              ''.join(' %s |' % (fmt % scores[suffix, scheme]).center(len(column))
+                      for column, suffix in CONFIGURATIONS))
+
+    print('-' * (width + sum(len(label) + 3 for label, _ in CONFIGURATIONS) + 4))
+    print()
+
+
+def positive_option(opts, option, name, default):
+    """
+    Read an option that must be a positive integer
+
+    :param opts: The command line options
+    :param option: The option
+    :param name: The name of the option in the error message
+    :param default: The value when the option is not given
+    :return: The value of the option, or None when it is not a positive integer
+    """
+
+    value = opts.get(option, str(default))
+
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+
+    warning = (
+        "*** ERROR: %s (opt: %s INT)! ***\n"
+        "    -- value (%s) not recognised!\n"
+        "    -- must be a positive integer"
+        ) % (name, option, value)
+    print(warning, file=sys.stderr)
+    return None
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'hg:k:j:mf')
+    opts = dict(opts)
+    usage = __doc__.replace('<PROGNAME>', sys.argv[0].split('/')[-1], 1)
+
+    if '-h' in opts or len(args) > 0:
+        print(usage, file=sys.stderr)
+        sys.exit(0)
+
+    if (positive_option(opts, '-k', 'number of documents', 10) is None or
+            positive_option(opts, '-j', 'number of worker processes', 1) is None):
+        print(usage, file=sys.stderr)
+        sys.exit(1)
+
+    config = SweepOptions(opts)
+    key = Key(config)
+    scores = {}
+
+    for _, suffix in CONFIGURATIONS:
+        index = IndexLoader('index_' + suffix + config.suffix).getIndex()
+        queries = Queries('queries_' + suffix + '.txt')
+
+        for _, scheme in config.schemes:
+            scores[suffix, scheme] = evaluate(config, key, index, queries, scheme)
+
+    for row, (title, fmt) in enumerate(MEASURES):
+        print_table(title, fmt, config.schemes,
+                    {run: measures[row] for run, measures in scores.items()})
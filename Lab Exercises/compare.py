@@ -7,12 +7,19 @@ OPTIONS:
     -s FILE : use stoplist file FILE
     -I PATT : identify input files using pattern PATT,
               (otherwise uses files listed on command line)
+    -C FILE : compare the documents of collection FILE, in the
+              <document docid=N> markup of documents.txt, instead of
+              input files
+    -m : find the pairs above the threshold from MinHash signatures
+         and LSH banding, only candidate pairs are compared exactly
+         (default: compare every pair)
+    -t NUM : the Jaccard threshold of -m (default: 0.5)
 ------------------------------------------------------------
 """
 
-import sys, re, getopt, glob
+import sys, re, getopt, glob, zlib
 
-opts, args = getopt.getopt(sys.argv[1:], 'hs:bI:')
+opts, args = getopt.getopt(sys.argv[1:], 'hs:bI:C:mt:')
 opts = dict(opts)
 filenames = args
 
@@ -30,7 +37,7 @@ if '-h' in opts:
 if '-I' in opts:
     filenames = glob.glob(opts['-I'])
 
-print('INPUT-FILES:', ' '.join(filenames))
+print('INPUT-FILES:', opts['-C'] if '-C' in opts else ' '.join(filenames))
 
 ##############################
 # STOPLIST option
@@ -44,24 +51,51 @@ if '-s' in opts:
 ##############################
 
 
-def count_words(filename):
+def count_words(lines):
     """
+    Count the words of a text, leaving out stop words
 
-    :param filename: The given file name
-    :return:
+    :param lines: The lines of the text
+    :return: The dictionary of the count of each word
     """
     wordre = re.compile(r'[A-Za-z]+')
     counts = {}
 
+    for line in lines:
+        for word in wordre.findall(line.lower()):
+            if word not in stops:
+                if word not in counts:
+                    counts[word] = 0
+                counts[word] += 1
+
+    return counts
+
+
+def read_collection(filename):
+    """
+    Read the documents of a collection file in the <document docid=N> markup
+
+    :param filename: The collection file name
+    :return: The list of (name, lines) of each document, named FILE#N
+    """
+    docidre = re.compile(r'<document docid=(\d+)>')
+    documents = []
+    lines = None
+
     with open(filename, 'r') as infile:
         for line in infile:
-            for word in wordre.findall(line.lower()):
-                if word not in stops:
-                    if word not in counts:
-                        counts[word] = 0
-                    counts[word] += 1
+            match = docidre.match(line)
 
-    return counts
+            if match:
+                name = '%s#%s' % (filename, match.group(1))
+                lines = []
+            elif line.startswith('</document>'):
+                documents.append((name, lines))
+                lines = None
+            elif lines is not None:
+                lines.append(line)
+
+    return documents
 
 ##############################
 # Compute counts for individual components
@@ -69,8 +103,15 @@ def count_words(filename):
 
 docs = []
 
-for infile in filenames:
-    docs.append(count_words(infile))
+if '-C' in opts:
+    filenames = []
+    for name, lines in read_collection(opts['-C']):
+        filenames.append(name)
+        docs.append(count_words(lines))
+else:
+    for infile in filenames:
+        with open(infile, 'r') as lines:
+            docs.append(count_words(lines))
 
 ##############################
 
@@ -84,28 +125,19 @@ def jaccard(d1, d2):
     :return: Similarity score
     """
 
-    wds1 = set(d1)
-    wds2 = set(d2)
-
+    # The union is what both documents have less their intersection, so that neither
+    # the sets of words nor their union have to be built
     if '-b' in opts:
-        over = len(wds1 & wds2)  # where '&' is set intersection op
-        under = len(wds1 | wds2)  # where '|' is set union op
+        over = len(d1.keys() & d2.keys())
+        under = len(d1) + len(d2) - over
     else:
-        over = under = 0
-
-        for w in (wds1 | wds2):
-
-            if w in d1 and w in d2:
-                over += min(d1[w], d2[w])
+        over = 0
 
-            wmax = 0
-
-            if w in d1:
-                wmax = d1[w]
+        for w in d1:
             if w in d2:
-                wmax = max(d2[w], wmax)
+                over += min(d1[w], d2[w])
 
-            under += wmax
+        under = sum(d1.values()) + sum(d2.values()) - over
 
     if under > 0:
         return over / under
@@ -114,13 +146,127 @@ def jaccard(d1, d2):
 
 
 ##############################
-# Compute scores for all document pairs
+# MinHash signatures and LSH banding, when "-m" option used
+
+# The number of hash functions of a signature, and the prime modulus of the hash functions
+SIGNATURE_SIZE = 128
+PRIME = (1 << 31) - 1
+
+
+def elements(d):
+    """
+    Turn word counts into the hashes of the elements of a set, whose Jaccard similarity
+    is the weighted Jaccard of the counts: each word is repeated as many times as it
+    occurs (once with binary weights)
+
+    :param d: The document
+    :return: The list of the hashes of the elements
+    """
+
+    return [zlib.crc32(('%s %d' % (w, i)).encode()) % PRIME
+            for w in d for i in range(1 if '-b' in opts else d[w])]
+
+
+def minhash(d, a, b):
+    """
+    Compute the MinHash signature of a document
+
+    :param d: The document, it must have a word
+    :param a: The multipliers of the hash functions
+    :param b: The offsets of the hash functions
+    :return: The smallest hash of the elements of the document under each function
+    """
+
+    x = np.array(elements(d), dtype=np.int64)
+
+    return ((a[:, None] * x[None, :] + b[:, None]) % PRIME).min(axis=1)
+
+
+def banding(threshold, size=SIGNATURE_SIZE, recall=0.95):
+    """
+    Choose how signatures are cut into bands: the most rows per band, so the fewest
+    candidates, such that a pair at the threshold still shares a band with probability
+    recall
+
+    :param threshold: The Jaccard threshold
+    :param size: The number of hash functions of a signature
+    :param recall: The probability a pair at the threshold becomes a candidate
+    :return: The number of bands and of rows per band
+    """
+
+    best = (size, 1)
+
+    for rows in range(1, size + 1):
+        bands = size // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            best = (bands, rows)
+
+    return best
+
+
+def candidate_pairs(docs, threshold):
+    """
+    Find the pairs of documents likely to be above a Jaccard threshold: the pairs whose
+    signatures agree on every row of at least one band
+
+    :param docs: The documents
+    :param threshold: The Jaccard threshold
+    :return: The set of candidate pairs (i, j) of document numbers, i < j
+    """
+
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, PRIME, SIGNATURE_SIZE)
+    b = rng.integers(0, PRIME, SIGNATURE_SIZE)
+    bands, rows = banding(threshold)
+
+    buckets = {}
+
+    for i, d in enumerate(docs):
+        # A document without words is not similar to any other
+        if not d:
+            continue
+
+        signature = minhash(d, a, b)
+
+        for band in range(bands):
+            key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            buckets.setdefault(key, []).append(i)
+
+    pairs = set()
+
+    for members in buckets.values():
+        for x in range(len(members) - 1):
+            for j in members[x + 1:]:
+                pairs.add((members[x], j))
+
+    return pairs
+
+##############################
+# Compute scores for all document pairs, or for the candidate pairs only
 
 results = {}
-for i in range(len(docs) - 1):
-    for j in range(i + 1, len(docs)):
-        pair_name = '%s <> %s' % (filenames[i], filenames[j])
-        results[pair_name] = jaccard(docs[i], docs[j])
+
+if '-m' in opts:
+    # NumPy is needed for the signatures only
+    import numpy as np
+
+    threshold = float(opts.get('-t', 0.5))
+    candidates = candidate_pairs(docs, threshold)
+
+    for i, j in sorted(candidates):
+        score = jaccard(docs[i], docs[j])
+        if score >= threshold:
+            pair_name = '%s <> %s' % (filenames[i], filenames[j])
+            results[pair_name] = score
+
+    print('CANDIDATES: %d of %d pairs, %d at or above %.2f'
+          % (len(candidates), len(docs) * (len(docs) - 1) // 2, len(results), threshold),
+          file=sys.stderr)
+else:
+    for i in range(len(docs) - 1):
+        for j in range(i + 1, len(docs)):
+            pair_name = '%s <> %s' % (filenames[i], filenames[j])
+            results[pair_name] = jaccard(docs[i], docs[j])
 
 ##############################
 # Sort, and print top N results